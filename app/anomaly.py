@@ -0,0 +1,147 @@
+import math
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import NamedTuple
+from .database import site_key
+
+# ── Streaming anomaly detection ───────────────────────────────────────────────
+# /track counts each site's human views and bot hits in ANOMALY_BUCKET_SECONDS
+# buckets and scores every bucket against an exponentially weighted mean and
+# variance of the previous ones (half-life ANOMALY_HALF_LIFE_BUCKETS). The
+# deviation is floored at the Poisson noise sqrt(mean), so quiet sites don't
+# alert on a handful of extra hits. Values are clipped to the alert band
+# before they update the baseline, so one flood doesn't inflate it, while a
+# lasting change in level is still absorbed over a few half-lives.
+# A spike is reported as soon as the running count of the current bucket
+# crosses the band, not when the bucket closes. A dip is reported when the
+# bucket closes, which for a complete outage is when traffic returns.
+# One event is recorded per run of anomalous buckets. State is a few numbers
+# per (site, metric). It is kept in memory per process, like heavy_hitters,
+# so with several workers each one scores its own share of the traffic. Only
+# the ANOMALY_MAX_SITES most recently tracked sites are kept; a site evicted
+# and seen again warms up from scratch.
+ANOMALY_BUCKET_SECONDS = int(os.getenv("ANOMALY_BUCKET_SECONDS", "60"))
+ANOMALY_HALF_LIFE_BUCKETS = float(os.getenv("ANOMALY_HALF_LIFE_BUCKETS", "30"))
+# Buckets seen before anything is reported
+ANOMALY_WARMUP_BUCKETS = int(os.getenv("ANOMALY_WARMUP_BUCKETS", "60"))
+# Width of the alert band in deviations; 0 disables detection
+ANOMALY_THRESHOLD = float(os.getenv("ANOMALY_THRESHOLD", "4"))
+ANOMALY_MAX_SITES = int(os.getenv("ANOMALY_MAX_SITES", "256"))
+
+_ALPHA = 1.0 - 2.0 ** (-1.0 / ANOMALY_HALF_LIFE_BUCKETS)
+# Empty buckets replayed after a gap; past this the baseline has decayed to ~0 anyway
+_MAX_GAP_BUCKETS = int(math.ceil(10 * ANOMALY_HALF_LIFE_BUCKETS))
+
+
+class AnomalyEvent(NamedTuple):
+    bucket_start: str   # UTC, "YYYY-MM-DD HH:MM:SS"
+    metric: str         # "views" or "bot_hits"
+    type: str           # "spike" or "dip"
+    observed: int       # bucket count when reported (a spike's bucket may still be filling)
+    expected: float     # baseline mean
+    score: float        # (observed - expected) / deviation
+
+
+class _Series:
+    """Baseline and current bucket of one (site, metric) count."""
+
+    __slots__ = ("bucket", "count", "mean", "var", "seen", "run", "lower", "upper")
+
+    def __init__(self, bucket: int):
+        self.bucket = bucket
+        self.count = 0
+        self.mean = 0.0
+        self.var = 0.0
+        self.seen = 0        # closed buckets
+        self.run = None      # "spike" / "dip" while consecutive buckets are anomalous
+        self.lower = -math.inf
+        self.upper = math.inf
+
+    def deviation(self) -> float:
+        return max(math.sqrt(self.var), math.sqrt(self.mean), 1.0)
+
+    def event(self, metric: str, type_: str, bucket: int, count: int) -> AnomalyEvent:
+        return AnomalyEvent(
+            datetime.utcfromtimestamp(bucket * ANOMALY_BUCKET_SECONDS).strftime("%Y-%m-%d %H:%M:%S"),
+            metric,
+            type_,
+            count,
+            round(self.mean, 2),
+            round((count - self.mean) / self.deviation(), 2),
+        )
+
+    def close(self, metric: str, bucket: int, count: int, events: list):
+        """Scores a finished bucket, folds it into the baseline and opens the next one."""
+        warm = self.seen >= ANOMALY_WARMUP_BUCKETS
+        if warm and count > self.upper:
+            self.run = "spike"   # reported while the bucket filled
+        elif warm and count < self.lower:
+            if self.run != "dip":
+                events.append(self.event(metric, "dip", bucket, count))
+            self.run = "dip"
+        else:
+            self.run = None
+
+        if self.seen == 0:
+            self.mean = float(count)
+        else:
+            x = min(max(count, self.lower), self.upper) if warm else count
+            diff = x - self.mean
+            incr = _ALPHA * diff
+            self.mean += incr
+            self.var = (1.0 - _ALPHA) * (self.var + diff * incr)
+        self.seen += 1
+
+        band = ANOMALY_THRESHOLD * self.deviation()
+        self.lower = self.mean - band
+        self.upper = self.mean + band
+
+
+class AnomalyDetector:
+    """Per-site EWMA detectors over bucketed ingest counts."""
+
+    def __init__(self):
+        # site_id -> {metric: _Series}, least recently tracked first
+        self._series: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def observe(self, site_id: str, metric: str, now: float) -> list:
+        """Counts one hit of `metric`; returns the AnomalyEvents it completes (usually none)."""
+        if ANOMALY_THRESHOLD <= 0:
+            return []
+        sid = site_key(site_id)
+        bucket = int(now // ANOMALY_BUCKET_SECONDS)
+        with self._lock:
+            site = self._series.get(sid)
+            if site is None:
+                site = self._series[sid] = {}
+                if len(self._series) > ANOMALY_MAX_SITES:
+                    self._series.popitem(last=False)
+            else:
+                self._series.move_to_end(sid)
+            series = site.get(metric)
+            if series is None:
+                series = site[metric] = _Series(bucket)
+            return self._count(series, metric, bucket)
+
+    @staticmethod
+    def _count(series: _Series, metric: str, bucket: int) -> list:
+        events = []
+        if bucket > series.bucket:
+            series.close(metric, series.bucket, series.count, events)
+            for empty in range(series.bucket + 1, min(bucket, series.bucket + 1 + _MAX_GAP_BUCKETS)):
+                series.close(metric, empty, 0, events)
+            series.bucket = bucket
+            series.count = 0
+        # Hits stamped before the current bucket (clock steps) count towards it
+
+        series.count += 1
+        if series.count > series.upper and series.run != "spike" and series.seen >= ANOMALY_WARMUP_BUCKETS:
+            series.run = "spike"
+            events.append(series.event(metric, "spike", bucket, series.count))
+        return events
+
+
+anomaly_detector = AnomalyDetector()
@@ -1,10 +1,10 @@
+import hashlib
 import os
 import time
-import ipaddress
 from fastapi import APIRouter, Request, Depends, HTTPException, Header, Query
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
 from cryptography.hazmat.primitives import serialization
@@ -12,60 +12,47 @@ import qrcode
 import io
 import base64
 import json
-from .database import get_db, list_sites, purge_stale_pages
-from .utils import hash_ip, get_country_from_ip, parse_user_agent_info, parse_referrer_category
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .database import site_key, list_sites, get_site_records, update_site
+from .storage import VisitRecord, get_storage
+from .async_storage import AsyncStorage, get_async_storage
+from .utils import hash_ip, get_client_ip, get_country_from_ip, parse_user_agent_info, parse_referrer_category
+from .maintenance import get_last_report
+from .export import EXPORT_TABLES, EXPORT_FORMATS, stream_table
 from .ml import generate_forecast, generate_summary, detect_anomalies, detect_bots
-from .auth import verify_signature
-from .limiter import limiter
-import sqlite3
-
-# ── Rolling-window bot detection ─────────────────────────────────────────────
-# In-memory store: ip_hash -> list of (page_path, unix_timestamp)
-# Resets on server restart; intentional for single-process deployments.
-_path_window: dict = {}
-_PATH_WINDOW_SECONDS = 900        # 15-minute window
-_PATH_WINDOW_THRESHOLD = 20       # distinct paths within the window to flag
-_PATH_WINDOW_MAX_ENTRIES = 200    # cap per IP to prevent memory abuse
-_LIFETIME_PATH_THRESHOLD = 50     # distinct paths lifetime to flag
-
-# ── Distributed crawl detection ───────────────────────────────────────────────
-# Tracks timestamps of first-ever IP visits per site to detect coordinated
-# distributed crawls (many new IPs, each hitting only a small number of paths).
-# dict[site_id, list[float]]
-_new_ip_window: dict = {}
-_NEW_IP_WINDOW_SECONDS = 300      # 5-minute window
-_NEW_IP_ALERT_THRESHOLD = int(os.getenv("CRAWL_ALERT_THRESHOLD", "100"))  # new IPs / 5 min
-
-# ── Self-tracking filter ──────────────────────────────────────────────────────
-# Requests originating from the site's own backend proxy carry this header.
-# Tracking them would pollute analytics with server-side fetch noise.
-_PROXY_SOURCE_HEADER = "x-proxy-source"
-_SELF_SOURCE_VALUE = os.getenv("PROXY_SOURCE_VALUE", "followthecredits")
-
-# ── Lazy cleanup tracking ──────────────────────────────────────────────────────
-# Last time purge_stale_pages ran per site_id. Cleanup runs at most once per day.
-_last_cleanup: dict = {}
+from .auth import verify_signature, verify_site_signature, verify_admin_signature, verify_stream_signature
+from . import heavy_hitters, journal
+from .anomaly import anomaly_detector
+from .live import live_hub
+from .read_copies import read_copy
+from .heavy_hitters import HEAVY_HITTER_CAPACITY
+from .detection import BotDetector
+from .serialization import EncodedJSON, FastJSONResponse, decode_model, dumps, json_body_schema
+from . import page_views
+from .page_views import PAGE_VIEWS_CACHE_SECONDS, PAGE_VIEWS_MAX_PATHS, PAGE_VIEWS_STALE_SECONDS
+
+# Behavioral checks (rolling windows etc.), one set of windows per process
+_detector = BotDetector()
 
 _DEBUG_ENABLED = os.getenv("ENABLE_DEBUG_ENDPOINTS", "false").lower() == "true"
 
+# ── Cross-site overview ───────────────────────────────────────────────────────
+# /overview fans out over site DBs on a bounded pool and caches the result
+# briefly; concurrent callers wait on the lock instead of refreshing in parallel.
+_OVERVIEW_MAX_WORKERS = int(os.getenv("OVERVIEW_MAX_WORKERS", "8"))
+_OVERVIEW_CACHE_SECONDS = int(os.getenv("OVERVIEW_CACHE_SECONDS", "30"))
+_overview_pool = ThreadPoolExecutor(max_workers=_OVERVIEW_MAX_WORKERS, thread_name_prefix="overview")
+_overview_lock = threading.Lock()
+_overview_cache: dict = {"at": 0.0, "sites": [], "encoded": {}}
 
-def _get_client_ip(request: Request) -> str:
-    """Extract and validate client IP, preferring X-Forwarded-For for proxied deployments."""
-    forwarded = request.headers.get("x-forwarded-for")
-    if forwarded:
-        raw = forwarded.split(",")[0].strip()
-        try:
-            ipaddress.ip_address(raw)
-            return raw
-        except ValueError:
-            pass
-    return request.client.host or "0.0.0.0"
 
-router = APIRouter()
+router = APIRouter(default_response_class=FastJSONResponse)
 
 class VisitData(BaseModel):
     path: str = "/"
     site_id: str = "default"
+    referrer: Optional[str] = None  # document.referrer; the Referer header is used when absent
 
 class ClickData(BaseModel):
     url: str
@@ -76,27 +63,15 @@ class RegisterKeyData(BaseModel):
     public_key_hex: str
 
 @router.post("/register-key")
-def register_key(data: RegisterKeyData):
+async def register_key(data: RegisterKeyData):
     """
     Registers a public key for a site. 
     This is a one-time setup. Once a key is registered, all subsequent 
     requests to stats endpoints for this site MUST be signed.
     """
-    conn = get_db(data.site_id)
-    cursor = conn.cursor()
-    
-    # Check if key already exists
-    cursor.execute("SELECT key_value FROM auth_config WHERE key_type = 'public_key'")
-    if cursor.fetchone():
-        conn.close()
+    if not await get_async_storage().set_public_key(data.site_id, data.public_key_hex):
         raise HTTPException(status_code=400, detail="Public key already registered for this site")
-        
-    cursor.execute(
-        "INSERT INTO auth_config (key_type, key_value) VALUES ('public_key', ?)",
-        (data.public_key_hex,)
-    )
-    conn.commit()
-    conn.close()
+    update_site(data.site_id, requires_auth=True)
     return {"status": "ok", "message": "Public key registered"}
 
 @router.get("/pair/{site_id}", response_class=HTMLResponse)
@@ -112,15 +87,12 @@ def pair_device(
     If force=True, requires a valid signed request (X-Timestamp + X-Signature headers) to
     prevent unauthorized key replacement.
     """
-    conn = get_db(site_id)
-    cursor = conn.cursor()
+    store = get_storage()
 
     # 1. Check if a key already exists
-    cursor.execute("SELECT key_value FROM auth_config WHERE key_type = 'public_key'")
-    existing_key = cursor.fetchone()
+    existing_key = store.get_public_key(site_id)
 
     if existing_key and not force:
-        conn.close()
         return HTMLResponse(
             f"""
             <h1>Error: Already Paired</h1>
@@ -132,12 +104,7 @@ def pair_device(
 
     if existing_key and force:
         # Require proof of the existing key before overwriting
-        try:
-            verify_signature(request, site_id, x_timestamp, x_signature)
-        except HTTPException:
-            conn.close()
-            raise
-        cursor.execute("DELETE FROM auth_config WHERE key_type = 'public_key'")
+        verify_site_signature(site_id, x_timestamp, x_signature)
         
     # 2. Generate New Key Pair
     private_key = Ed25519PrivateKey.generate()
@@ -156,12 +123,8 @@ def pair_device(
     ).hex()
     
     # 3. Save Public Key to DB
-    cursor.execute(
-        "INSERT INTO auth_config (key_type, key_value) VALUES ('public_key', ?)",
-        (public_hex,)
-    )
-    conn.commit()
-    conn.close()
+    store.set_public_key(site_id, public_hex, replace=True)
+    update_site(site_id, requires_auth=True)
     
     # 4. Create QR Payload
     # Use the request's base URL (e.g., http://192.168.1.5:8000)
@@ -230,14 +193,9 @@ def get_auth_status(site_id: str):
     """
     if not _DEBUG_ENABLED:
         raise HTTPException(status_code=404, detail="Not found")
-    conn = get_db(site_id)
-    cursor = conn.cursor()
-    cursor.execute("SELECT key_value FROM auth_config WHERE key_type = 'public_key'")
-    row = cursor.fetchone()
-    conn.close()
     return {
         "site_id": site_id,
-        "is_locked": row is not None,
+        "is_locked": get_storage().get_public_key(site_id) is not None,
     }
 
 @router.get("/sites")
@@ -245,321 +203,136 @@ def get_sites():
     """
     Returns a list of available sites with their auth status.
     """
-    site_ids = list_sites()
-    sites_data = []
-    
-    for site_id in site_ids:
-        # Check if site requires auth
-        conn = get_db(site_id)
-        cursor = conn.cursor()
-        cursor.execute("SELECT key_value FROM auth_config WHERE key_type = 'public_key'")
-        row = cursor.fetchone()
-        conn.close()
-        
-        sites_data.append({
-            "id": site_id,
-            "requiresAuth": row is not None
-        })
-        
+    sites_data = [
+        {"id": site["id"], "requiresAuth": site["requires_auth"]}
+        for site in get_site_records()
+    ]
     return {"sites": sites_data}
 
-@router.post("/click")
-def track_click(request: Request, data: ClickData):
-    conn = get_db(data.site_id)
-    cursor = conn.cursor()
-    try:
-        cursor.execute("""
-            INSERT INTO link_stats (link_url, click_count) 
-            VALUES (?, 1) 
-            ON CONFLICT(link_url) 
-            DO UPDATE SET click_count = click_count + 1
-        """, (data.url,))
-        conn.commit()
-    finally:
-        conn.close()
+def _overview_sites() -> tuple:
+    with _overview_lock:
+        now = time.time()
+        if now - _overview_cache["at"] > _OVERVIEW_CACHE_SECONDS:
+            today = datetime.utcnow().strftime("%Y-%m-%d")
+            store = get_storage()
+            _overview_cache["sites"] = list(
+                _overview_pool.map(lambda sid: store.get_headline(sid, today), list_sites())
+            )
+            _overview_cache["at"] = now
+            # Encoded responses of this result, per audience (admin or not)
+            _overview_cache["encoded"] = {}
+        return _overview_cache["at"], _overview_cache["sites"], _overview_cache["encoded"]
+
+
+@router.get("/overview")
+def get_overview(request: Request, is_admin: bool = Depends(verify_admin_signature)):
+    """
+    Headline numbers for every site plus grand totals. Sites with a
+    registered key are redacted unless the request is signed with the
+    operator key (ADMIN_PUBLIC_KEY).
+    """
+    generated_at, cached_sites, encoded = _overview_sites()
+    payload = encoded.get(is_admin)
+    if payload is None:
+        payload = encoded[is_admin] = EncodedJSON(_overview_document(generated_at, cached_sites, is_admin))
+    return payload.response(request)
+
+
+def _overview_document(generated_at: float, cached_sites: list, is_admin: bool) -> dict:
+    sites = []
+    totals = {"total_visits": 0, "visits_today": 0, "unique_visitors_today": 0, "bots_today": 0, "crawlers_today": 0}
+    for site in cached_sites:
+        if site["requiresAuth"] and not is_admin:
+            sites.append({"id": site["id"], "requiresAuth": True, "redacted": True})
+            continue
+        sites.append(site)
+        for key in totals:
+            totals[key] += site[key]
+
+    return {
+        "generated_at": int(generated_at),
+        "sites": sites,
+        "totals": totals,
+    }
+
+@router.post("/click", openapi_extra=json_body_schema(ClickData))
+async def track_click(request: Request):
+    data = decode_model(ClickData, await request.body(), required=True)
+    await get_async_storage().record_click(data.site_id, data.url)
     return {"status": "ok", "url": data.url}
 
-@router.post("/track")
-@limiter.limit("60/minute")
-def track_visit(request: Request, data: Optional[VisitData] = None):
-    # Filter self-tracking: requests from the site's own backend proxy are skipped
-    if request.headers.get(_PROXY_SOURCE_HEADER, "").strip().lower() == _SELF_SOURCE_VALUE:
-        return {"status": "ok", "skipped": True}
+# ── Ingest ────────────────────────────────────────────────────────────────────
+# /track takes a JSON POST, which browsers preflight with an OPTIONS request
+# when sent cross-origin. /pixel.gif (an <img> GET with query parameters) and
+# /beacon (navigator.sendBeacon with a text/plain body) are CORS-simple
+# requests with no preflight; all three record through _record_visit().
+# Self-tracking requests (X-Proxy-Source) to any of them are answered by
+# middleware.SelfTrackingFilterMiddleware.
+
+# 1×1 transparent GIF
+_PIXEL_GIF = base64.b64decode("R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7")
+_PIXEL_HEADERS = {"Cache-Control": "no-store, max-age=0"}
+
 
-    client_ip = _get_client_ip(request)
+async def _record_visit(request: Request, site_id: str, page_path: str, referrer: Optional[str]) -> dict:
+    """Classifies and records one page view; returns the /track response document."""
+    client_ip = get_client_ip(request)
 
     hashed_ip = hash_ip(client_ip)
     country = get_country_from_ip(client_ip)
-    page_path = data.path if data and data.path else "/"
-    site_id = data.site_id if data and data.site_id else "default"
 
     user_agent = request.headers.get("user-agent", "")
     ua_info = parse_user_agent_info(user_agent)
     bot_type = ua_info["bot_type"]
     ua_score = ua_info["ua_score"]
 
-    referrer = request.headers.get("referer")
+    referrer = referrer or request.headers.get("referer")
     referrer_category = parse_referrer_category(referrer)
 
-    is_unique_ever = False
-    is_unique_today = False
+    now = time.time()
+    paused = journal.is_paused(site_id)
+    journal.record(site_id, now, hashed_ip, country, page_path, user_agent, referrer, counted=not paused)
+    if paused:
+        # `python -m app.replay --apply` is rebuilding the site; the journal has the hit
+        return {"status": "paused", "page": page_path}
+
     today = datetime.utcnow().strftime("%Y-%m-%d")
+    store = get_async_storage()
 
-    conn = get_db(site_id)
-    cursor = conn.cursor()
-    try:
-        # Query existing activity once — used for carry-forward and behavioral checks
-        cursor.execute(
-            "SELECT request_count, first_seen, last_seen, bot_type FROM visitor_activity WHERE ip_hash = ?",
-            (hashed_ip,),
-        )
-        existing_activity = cursor.fetchone()
+    # Streaming per-IP / per-path volume (bots included, so /top-talkers shows scrapers)
+    ip_recent_hits = heavy_hitters.observe(site_id, hashed_ip, page_path)
 
-        # Pre-read distinct path count (read-only, no write lock acquired yet)
-        cursor.execute(
-            "SELECT COUNT(*) AS cnt FROM ip_path_counts WHERE ip_hash = ?",
-            (hashed_ip,),
-        )
-        prior_path_count = (cursor.fetchone() or {"cnt": 0})["cnt"]
-
-        # Carry forward existing bot flag (once flagged, always flagged)
-        if existing_activity:
-            prev_bot_type = existing_activity["bot_type"] or "none"
-            if prev_bot_type != "none" and bot_type == "none":
-                bot_type = prev_bot_type
-                ua_score = 1.0 if bot_type == "bot" else 0.5
-
-        behavioral_flag = False
-        behavioral_reason = None
-
-        # (0) Distributed crawl detection — for brand-new IPs only
-        # Track the rate of new unique IPs per site. If it exceeds the threshold
-        # within a 5-minute window, flag this new IP as part of a distributed crawl.
-        if bot_type == "none" and existing_activity is None:
-            now = time.time()
-            site_window = _new_ip_window.get(site_id, [])
-            site_window.append(now)
-            cutoff = now - _NEW_IP_WINDOW_SECONDS
-            site_window = [t for t in site_window if t >= cutoff]
-            _new_ip_window[site_id] = site_window
-            if len(site_window) > _NEW_IP_ALERT_THRESHOLD:
-                bot_type = "bot"
-                ua_score = 1.0
-                behavioral_flag = True
-                behavioral_reason = "Behavioral: Distributed Crawl Pattern"
-
-        # (1) Rolling window: >20 distinct paths within 15 minutes
-        if bot_type == "none":
-            now = time.time()
-            window = _path_window.get(hashed_ip, [])
-            if len(window) >= _PATH_WINDOW_MAX_ENTRIES:
-                window = window[-_PATH_WINDOW_MAX_ENTRIES:]
-            window.append((page_path, now))
-            cutoff = now - _PATH_WINDOW_SECONDS
-            window = [(p, t) for p, t in window if t >= cutoff]
-            _path_window[hashed_ip] = window
-            if len({p for p, _ in window}) > _PATH_WINDOW_THRESHOLD:
-                bot_type = "bot"
-                ua_score = 1.0
-                behavioral_flag = True
-                behavioral_reason = "Behavioral: High Path Diversity (rolling window)"
-
-        # (2) Lifetime distinct path heuristic: >=50 distinct paths ever seen
-        # Uses the pre-read count (before this request's path is inserted) so no
-        # write lock is acquired here. INSERT happens in the human traffic path below.
-        if bot_type == "none" and prior_path_count >= _LIFETIME_PATH_THRESHOLD:
-            bot_type = "bot"
-            ua_score = 1.0
-            behavioral_flag = True
-            behavioral_reason = "Behavioral: High Unique Path Count"
-
-
-        # (3) Behavioral rate check: high lifetime request rate
-        if bot_type == "none" and existing_activity:
-            try:
-                existing_count = existing_activity["request_count"]
-                first_seen_dt = datetime.fromisoformat(existing_activity["first_seen"])
-                last_seen_dt = datetime.fromisoformat(existing_activity["last_seen"])
-                duration_seconds = max(1.0, (last_seen_dt - first_seen_dt).total_seconds())
-                rate_per_hour = (existing_count / duration_seconds) * 3600
-                if existing_count >= 50 and rate_per_hour > 60:
-                    bot_type = "bot"
-                    ua_score = 1.0
-                    behavioral_flag = True
-                    behavioral_reason = "Behavioral: High Request Rate"
-            except Exception:
-                pass
-
-        # Only log a bot on first detection per IP
-        prev_bot_type = (existing_activity["bot_type"] or "none") if existing_activity else "none"
-        should_log_bot = bot_type != "none" and prev_bot_type == "none"
-
-        # For already-known bots (carry-forward, no new behavioral flag), skip the
-        # visitor_activity upsert. It's the highest-frequency write and the data
-        # (request_count, last_seen) is not needed once a bot is flagged. Bot volume
-        # stats (bot_daily_stats, bot_page_stats) are still updated below.
-        skip_activity_upsert = bot_type != "none" and prev_bot_type != "none" and not behavioral_flag
-
-        # Update visitor_activity for all visitors (needed for rate tracking)
-        if not skip_activity_upsert:
-            cursor.execute("""
-            INSERT INTO visitor_activity (ip_hash, request_count, ua_score, bot_type)
-            VALUES (?, 1, ?, ?)
-            ON CONFLICT(ip_hash)
-            DO UPDATE SET
-                last_seen = CURRENT_TIMESTAMP,
-                request_count = request_count + 1,
-                ua_score = excluded.ua_score,
-                bot_type = CASE
-                    WHEN visitor_activity.bot_type = 'bot' THEN 'bot'
-                    WHEN excluded.bot_type = 'bot' THEN 'bot'
-                    WHEN visitor_activity.bot_type = 'crawler' THEN 'crawler'
-                    WHEN excluded.bot_type = 'crawler' THEN 'crawler'
-                    ELSE 'none'
-                END
-        """, (hashed_ip, ua_score, bot_type))
-
-        if bot_type != "none":
-            # ── Bot / Crawler path: separate counters, no human stats touched ──
-            if bot_type == "bot":
-                cursor.execute("""
-                    INSERT INTO bot_daily_stats (date, bot_visits, crawler_visits)
-                    VALUES (?, 1, 0)
-                    ON CONFLICT(date) DO UPDATE SET bot_visits = bot_visits + 1
-                """, (today,))
-                cursor.execute("""
-                    INSERT INTO bot_page_stats (page_path, bot_views, crawler_views)
-                    VALUES (?, 1, 0)
-                    ON CONFLICT(page_path) DO UPDATE SET bot_views = bot_views + 1
-                """, (page_path,))
-            else:  # crawler
-                cursor.execute("""
-                    INSERT INTO bot_daily_stats (date, bot_visits, crawler_visits)
-                    VALUES (?, 0, 1)
-                    ON CONFLICT(date) DO UPDATE SET crawler_visits = crawler_visits + 1
-                """, (today,))
-                cursor.execute("""
-                    INSERT INTO bot_page_stats (page_path, bot_views, crawler_views)
-                    VALUES (?, 0, 1)
-                    ON CONFLICT(page_path) DO UPDATE SET crawler_views = crawler_views + 1
-                """, (page_path,))
-
-            if should_log_bot:
-                if behavioral_flag:
-                    reason = behavioral_reason
-                elif bot_type == "crawler":
-                    reason = "Known Crawler (User-Agent)"
-                else:
-                    reason = "Known Bot Signature (User-Agent)"
-                cursor.execute(
-                    "INSERT INTO bot_logs (ip_hash, reason, bot_type, confidence) VALUES (?, ?, ?, ?)",
-                    (hashed_ip, reason, bot_type, ua_score),
-                )
-        else:
-            # ── Human traffic path ──
-            # 1. Total visits counter
-            cursor.execute("UPDATE general_stats SET value = value + 1 WHERE key = 'total_visits'")
-
-            # 2. Unique visitor tracking
-            cursor.execute("SELECT last_seen FROM unique_visitors WHERE ip_hash = ?", (hashed_ip,))
-            uv_row = cursor.fetchone()
-            if uv_row is None:
-                is_unique_ever = True
-                is_unique_today = True
-                cursor.execute("INSERT INTO unique_visitors (ip_hash) VALUES (?)", (hashed_ip,))
-            else:
-                last_seen_str = uv_row["last_seen"]
-                if not last_seen_str.startswith(today):
-                    is_unique_today = True
-                cursor.execute(
-                    "UPDATE unique_visitors SET last_seen = CURRENT_TIMESTAMP WHERE ip_hash = ?",
-                    (hashed_ip,),
-                )
-
-            # 3. Daily stats
-            cursor.execute("""
-                INSERT INTO daily_stats (date, total_visits, unique_visitors)
-                VALUES (?, 1, ?)
-                ON CONFLICT(date)
-                DO UPDATE SET
-                    total_visits = total_visits + 1,
-                    unique_visitors = unique_visitors + ?
-            """, (today, 1 if is_unique_today else 0, 1 if is_unique_today else 0))
-
-            # 4. Country stats
-            cursor.execute("""
-                INSERT INTO country_stats (country_code, visitor_count)
-                VALUES (?, 1)
-                ON CONFLICT(country_code)
-                DO UPDATE SET visitor_count = visitor_count + 1
-            """, (country,))
-
-            # 5. Page stats
-            cursor.execute("""
-                INSERT INTO page_stats (page_path, view_count, last_seen)
-                VALUES (?, 1, CURRENT_TIMESTAMP)
-                ON CONFLICT(page_path)
-                DO UPDATE SET
-                    view_count = view_count + 1,
-                    last_seen = CURRENT_TIMESTAMP
-            """, (page_path,))
-
-            # 5a. Track per-IP distinct paths for lifetime heuristic (INSERT only; count read earlier)
-            cursor.execute(
-                "INSERT OR IGNORE INTO ip_path_counts (ip_hash, path) VALUES (?, ?)",
-                (hashed_ip, page_path),
-            )
+    # Query existing activity once — used for carry-forward and behavioral checks.
+    # The distinct path count is pre-read too (read-only, no write lock acquired yet).
+    existing_activity, prior_path_count = await store.get_visitor_state(site_id, hashed_ip)
 
-            # 6. Device stats
-            cursor.execute("""
-                INSERT INTO device_stats (device_type, count)
-                VALUES (?, 1)
-                ON CONFLICT(device_type)
-                DO UPDATE SET count = count + 1
-            """, (ua_info["device"],))
-
-            # 7. Browser stats
-            cursor.execute("""
-                INSERT INTO browser_stats (browser_family, count)
-                VALUES (?, 1)
-                ON CONFLICT(browser_family)
-                DO UPDATE SET count = count + 1
-            """, (ua_info["browser"],))
-
-            # 8. OS stats
-            cursor.execute("""
-                INSERT INTO os_stats (os_family, count)
-                VALUES (?, 1)
-                ON CONFLICT(os_family)
-                DO UPDATE SET count = count + 1
-            """, (ua_info["os"],))
-
-            # 9. Referrer stats
-            cursor.execute("""
-                INSERT INTO referrer_stats (category, count)
-                VALUES (?, 1)
-                ON CONFLICT(category)
-                DO UPDATE SET count = count + 1
-            """, (referrer_category,))
-
-            # 10. Per-page country stats
-            cursor.execute("""
-                INSERT INTO page_country_stats (page_path, country_code, view_count)
-                VALUES (?, ?, 1)
-                ON CONFLICT(page_path, country_code)
-                DO UPDATE SET view_count = view_count + 1
-            """, (page_path, country))
-
-        conn.commit()
-    finally:
-        conn.close()
-
-    # Lazy daily cleanup: purge single-view stale pages at most once per day per site
-    _CLEANUP_INTERVAL = 86400  # 24 hours
-    now_ts = time.time()
-    if now_ts - _last_cleanup.get(site_id, 0) > _CLEANUP_INTERVAL:
-        _last_cleanup[site_id] = now_ts
-        purge_stale_pages(site_id, days=30)
+    bot_type, ua_score, reason, update_activity, flag_visitor = _detector.check(
+        site_id, hashed_ip, page_path, bot_type, ua_score,
+        existing_activity, prior_path_count, ip_recent_hits, now,
+    )
+
+    is_unique_ever, is_unique_today = await store.record_visit(site_id, VisitRecord(
+        ip_hash=hashed_ip,
+        page_path=page_path,
+        country=country,
+        device=ua_info["device"],
+        browser=ua_info["browser"],
+        os=ua_info["os"],
+        referrer=referrer_category,
+        date=today,
+        bot_type=bot_type,
+        ua_score=ua_score,
+        update_activity=update_activity,
+        flag_visitor=flag_visitor,
+        bot_log_reason=reason,
+    ))
+
+    live_hub.publish(site_id, page_path, bot_type, is_unique_ever, is_unique_today)
+
+    # Bucketed EWMA scoring (app/anomaly.py); events only come back when a spike or dip starts
+    events = anomaly_detector.observe(site_id, "views" if bot_type == "none" else "bot_hits", now)
+    if events:
+        await store.record_anomalies(site_id, events)
 
     return {
         "status": "ok",
@@ -572,114 +345,101 @@ def track_visit(request: Request, data: Optional[VisitData] = None):
         "bot_type": bot_type,
     }
 
+
+@router.post("/track", openapi_extra=json_body_schema(VisitData))
+async def track_visit(request: Request):
+    data = decode_model(VisitData, await request.body())
+    page_path = data.path if data and data.path else "/"
+    # A site_id in the query string (which the rate limiter sees) takes precedence
+    site_id = request.query_params.get("site_id") or (data.site_id if data and data.site_id else "default")
+    return await _record_visit(request, site_id, page_path, data.referrer if data else None)
+
+
+@router.get("/pixel.gif", response_class=Response)
+async def track_pixel(request: Request, site_id: str = "default", path: str = "/", referrer: Optional[str] = None):
+    """
+    /track as an image request: `<img src="/pixel.gif?site_id=...&path=...">`.
+    Always answers with the same uncacheable 1×1 GIF.
+    """
+    await _record_visit(request, site_id or "default", path or "/", referrer)
+    return Response(_PIXEL_GIF, media_type="image/gif", headers=_PIXEL_HEADERS)
+
+
+@router.post("/beacon", status_code=204, response_class=Response, openapi_extra={
+    "requestBody": {"content": {"text/plain": {"schema": VisitData.model_json_schema()}}},
+})
+async def track_beacon(request: Request):
+    """
+    /track for navigator.sendBeacon(): the same JSON body, sent as text/plain so
+    no preflight is needed. The browser discards the response, so it is an empty 204.
+    """
+    data = decode_model(VisitData, await request.body())
+    page_path = data.path if data and data.path else "/"
+    site_id = request.query_params.get("site_id") or (data.site_id if data and data.site_id else "default")
+    await _record_visit(request, site_id, page_path, data.referrer if data else None)
+    return Response(status_code=204)
+
+
+@router.get("/live", response_class=StreamingResponse, dependencies=[Depends(verify_stream_signature)])
+async def live_stream(site_id: str = "default"):
+    """
+    Server-Sent Events: one `delta` event per LIVE_INTERVAL_SECONDS with the
+    visits recorded since the previous one (see app/live.py).
+    """
+    subscriber = live_hub.subscribe(site_id)
+    if subscriber is None:
+        raise HTTPException(status_code=503, detail="Too many live streams")
+    return StreamingResponse(
+        live_hub.stream(subscriber),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.get("/page-stats", dependencies=[Depends(verify_signature)])
-def get_page_stats(site_id: str = "default", path: str = "/"):
+async def get_page_stats(site_id: str = "default", path: str = "/"):
     """
     Returns view count and country breakdown for a single page path.
     Useful for displaying per-page analytics directly on the page.
     """
-    conn = get_db(site_id)
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            "SELECT view_count FROM page_stats WHERE page_path = ?",
-            (path,)
-        )
-        row = cursor.fetchone()
-        view_count = row["view_count"] if row else 0
+    return FastJSONResponse(await get_async_storage().get_page_stats(site_id, path))
 
-        cursor.execute(
-            "SELECT country_code, view_count FROM page_country_stats "
-            "WHERE page_path = ? ORDER BY view_count DESC",
-            (path,)
-        )
-        countries = {r["country_code"]: r["view_count"] for r in cursor.fetchall()}
-    finally:
-        conn.close()
 
-    return {
-        "path": path,
-        "view_count": view_count,
-        "countries": countries,
+@router.get("/page-views")
+async def get_page_views(request: Request, site_id: str = "default", path: List[str] = Query(default=["/"])):
+    """
+    Public, cacheable view counts for one or more paths (repeat `path` for a
+    batch). Sites with a registered key must opt in via PUBLIC_PAGE_VIEWS_SITES.
+    """
+    if len(path) > PAGE_VIEWS_MAX_PATHS:
+        raise HTTPException(status_code=400, detail=f"At most {PAGE_VIEWS_MAX_PATHS} paths per request")
+    if not await page_views.is_public(site_id):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    body = dumps({"site_id": site_id, "views": await page_views.page_view_cache.get_many(site_id, path)})
+    # Weak: CompressionMiddleware may send the body gzip/br/zstd-encoded under the same tag
+    etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+    headers = {
+        "Cache-Control": (
+            f"public, max-age={int(PAGE_VIEWS_CACHE_SECONDS)}, "
+            f"stale-while-revalidate={int(PAGE_VIEWS_STALE_SECONDS)}"
+        ),
+        "ETag": f"W/{etag}",
+        "Vary": "Accept-Encoding",
     }
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
 
 
 @router.get("/stats", dependencies=[Depends(verify_signature)])
-def get_stats(site_id: str = "default"):
-    conn = get_db(site_id)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    try:
-        cursor.execute("SELECT value FROM general_stats WHERE key = 'total_visits'")
-        row = cursor.fetchone()
-        total_visits = row["value"] if row else 0
-
-        cursor.execute("SELECT COUNT(*) as count FROM unique_visitors")
-        row = cursor.fetchone()
-        unique_visitors = row["count"] if row else 0
-
-        cursor.execute("SELECT * FROM country_stats ORDER BY visitor_count DESC")
-        countries = {row["country_code"]: row["visitor_count"] for row in cursor.fetchall()}
-
-        cursor.execute("SELECT * FROM page_stats ORDER BY view_count DESC")
-        pages = {row["page_path"]: row["view_count"] for row in cursor.fetchall()}
-
-        cursor.execute("SELECT * FROM device_stats ORDER BY count DESC")
-        devices = {row["device_type"]: row["count"] for row in cursor.fetchall()}
-
-        cursor.execute("SELECT * FROM browser_stats ORDER BY count DESC")
-        browsers = {row["browser_family"]: row["count"] for row in cursor.fetchall()}
-
-        cursor.execute("SELECT * FROM os_stats ORDER BY count DESC")
-        os_stats = {row["os_family"]: row["count"] for row in cursor.fetchall()}
-
-        cursor.execute("SELECT * FROM referrer_stats ORDER BY count DESC")
-        referrers = {row["category"]: row["count"] for row in cursor.fetchall()}
-
-        cursor.execute("SELECT * FROM link_stats ORDER BY click_count DESC")
-        links = {row["link_url"]: row["click_count"] for row in cursor.fetchall()}
-
-        # Get last 30 days of history
-        cursor.execute("SELECT * FROM daily_stats ORDER BY date DESC LIMIT 30")
-        history = [dict(row) for row in cursor.fetchall()]
-
-        # Per-page country breakdown
-        cursor.execute("SELECT page_path, country_code, view_count FROM page_country_stats ORDER BY page_path, view_count DESC")
-        page_countries: dict = {}
-        for r in cursor.fetchall():
-            page_countries.setdefault(r["page_path"], {})[r["country_code"]] = r["view_count"]
-
-        # Bot summary
-        today_str = datetime.utcnow().strftime("%Y-%m-%d")
-        cursor.execute("SELECT SUM(bot_visits) AS bv, SUM(crawler_visits) AS cv FROM bot_daily_stats")
-        _bt = cursor.fetchone()
-        cursor.execute(
-            "SELECT bot_visits, crawler_visits FROM bot_daily_stats WHERE date = ?", (today_str,)
-        )
-        _bd = cursor.fetchone()
-        bot_summary = {
-            "total_bot_visits": (_bt["bv"] or 0) if _bt else 0,
-            "total_crawler_visits": (_bt["cv"] or 0) if _bt else 0,
-            "bots_today": _bd["bot_visits"] if _bd else 0,
-            "crawlers_today": _bd["crawler_visits"] if _bd else 0,
-        }
-    finally:
-        conn.close()
-
-    return {
-        "total_visits": total_visits,
-        "unique_visitors": unique_visitors,
-        "history": history,
-        "countries": countries,
-        "pages": pages,
-        "devices": devices,
-        "browsers": browsers,
-        "os": os_stats,
-        "referrers": referrers,
-        "links": links,
-        "page_countries": page_countries,
-        "bot_summary": bot_summary,
-    }
+async def get_stats(site_id: str = "default", top: Optional[int] = Query(default=None, ge=1, le=1000)):
+    """Site stats. `top` limits each breakdown (pages, countries, links, ...) to its N largest entries."""
+    copy = read_copy(site_id)
+    if copy is None:
+        return FastJSONResponse(await get_async_storage().get_stats(site_id, top))
+    store, read_copy_info = copy
+    return FastJSONResponse({**await AsyncStorage(store).get_stats(site_id, top), "read_copy": read_copy_info})
 
 @router.get("/forecast", dependencies=[Depends(verify_signature)])
 def get_forecast(site_id: str = "default", days: int = Query(default=7, ge=1, le=90)):
@@ -691,90 +451,76 @@ def get_summary(site_id: str = "default"):
 
 @router.get("/anomalies", dependencies=[Depends(verify_signature)])
 def get_anomalies(site_id: str = "default"):
-    return detect_anomalies(site_id)
+    result = detect_anomalies(site_id)
+    # Spikes/dips flagged on ingest (app/anomaly.py), as opposed to the daily batch model above
+    result["realtime"] = get_storage().get_traffic_anomalies(site_id)
+    return result
 
 @router.get("/bots", dependencies=[Depends(verify_signature)])
 def get_bots(site_id: str = "default"):
-    ml_result = detect_bots(site_id)
-
-    conn = get_db(site_id)
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            "SELECT date, bot_visits, crawler_visits FROM bot_daily_stats ORDER BY date DESC LIMIT 30"
-        )
-        bot_daily_trend = [dict(row) for row in cursor.fetchall()]
-
-        cursor.execute("""
-            SELECT page_path, bot_views, crawler_views, (bot_views + crawler_views) AS total
-            FROM bot_page_stats
-            ORDER BY total DESC
-            LIMIT 10
-        """)
-        top_bot_pages = [dict(row) for row in cursor.fetchall()]
-
-        cursor.execute("SELECT bot_type, COUNT(*) AS count FROM bot_logs GROUP BY bot_type")
-        bot_type_breakdown = {row["bot_type"]: row["count"] for row in cursor.fetchall()}
-
-        cursor.execute("""
-            SELECT ip_hash, detected_at, reason, bot_type, confidence
-            FROM bot_logs
-            ORDER BY detected_at DESC
-            LIMIT 20
-        """)
-        recent_bot_logs = [dict(row) for row in cursor.fetchall()]
-    finally:
-        conn.close()
-
-    return {
+    copy = read_copy(site_id)
+    store, read_copy_info = copy if copy else (get_storage(), None)
+    ml_result = detect_bots(site_id, store)
+    result = {
         **ml_result,
-        "bot_daily_trend": bot_daily_trend,
-        "top_bot_pages": top_bot_pages,
-        "bot_type_breakdown": bot_type_breakdown,
-        "recent_bot_logs": recent_bot_logs,
+        **store.get_bot_overview(site_id),
     }
+    if read_copy_info:
+        result["read_copy"] = read_copy_info
+    return FastJSONResponse(result)
 
 
 @router.get("/bot-stats", dependencies=[Depends(verify_signature)])
-def get_bot_stats(site_id: str = "default"):
-    conn = get_db(site_id)
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            "SELECT date, bot_visits, crawler_visits FROM bot_daily_stats ORDER BY date DESC"
-        )
-        daily = [dict(row) for row in cursor.fetchall()]
-
-        cursor.execute("""
-            SELECT page_path, bot_views, crawler_views
-            FROM bot_page_stats
-            ORDER BY (bot_views + crawler_views) DESC
-        """)
-        pages = [dict(row) for row in cursor.fetchall()]
-
-        cursor.execute("SELECT bot_type, COUNT(*) AS count FROM bot_logs GROUP BY bot_type")
-        type_breakdown = {row["bot_type"]: row["count"] for row in cursor.fetchall()}
-
-        cursor.execute("""
-            SELECT ip_hash, detected_at, reason, bot_type, confidence
-            FROM bot_logs
-            ORDER BY detected_at DESC
-            LIMIT 50
-        """)
-        recent_logs = [dict(row) for row in cursor.fetchall()]
-
-        total_bot_visits = sum(r["bot_visits"] for r in daily)
-        total_crawler_visits = sum(r["crawler_visits"] for r in daily)
-    finally:
-        conn.close()
+async def get_bot_stats(site_id: str = "default"):
+    copy = read_copy(site_id)
+    if copy is None:
+        return FastJSONResponse(await get_async_storage().get_bot_stats(site_id))
+    store, read_copy_info = copy
+    return FastJSONResponse({**await AsyncStorage(store).get_bot_stats(site_id), "read_copy": read_copy_info})
 
-    return {
-        "summary": {
-            "total_bot_visits": total_bot_visits,
-            "total_crawler_visits": total_crawler_visits,
-        },
-        "daily": daily,
-        "pages": pages,
-        "type_breakdown": type_breakdown,
-        "recent_logs": recent_logs,
-    }
+
+@router.get("/top-talkers", dependencies=[Depends(verify_signature)])
+async def get_top_talkers(site_id: str = "default", limit: int = Query(default=20, ge=1, le=HEAVY_HITTER_CAPACITY)):
+    """
+    Highest-volume IP hashes and paths over the last few half-lives, from the
+    in-memory streaming counters of this process (bots included).
+    """
+    return FastJSONResponse(heavy_hitters.top_talkers(site_id, limit))
+
+
+@router.get("/maintenance", dependencies=[Depends(verify_signature)])
+def get_maintenance_report(site_id: str = "default"):
+    """
+    Returns the most recent retention/compaction report for the site, or
+    null if the background job has not run for the site yet.
+    """
+    return {"site_id": site_id, "last_retention": get_last_report(site_id)}
+
+
+@router.get("/export", dependencies=[Depends(verify_signature)])
+def export_table(
+    site_id: str = "default",
+    table: str = "daily_stats",
+    fmt: str = Query(default="ndjson", alias="format"),
+    gzip: bool = False,
+):
+    """
+    Streams one aggregate table as NDJSON or CSV. Rows are read from the
+    cursor in batches, so memory use is constant regardless of table size.
+    """
+    if table not in EXPORT_TABLES:
+        raise HTTPException(status_code=400, detail=f"Unknown table. Choose one of: {', '.join(EXPORT_TABLES)}")
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format. Choose one of: {', '.join(EXPORT_FORMATS)}")
+
+    media_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    filename = f"{site_key(site_id)}-{table}.{fmt}"
+    if gzip:
+        media_type = "application/gzip"
+        filename += ".gz"
+
+    return StreamingResponse(
+        stream_table(site_id, table, fmt, compress=gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
@@ -0,0 +1,108 @@
+import asyncio
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Optional
+from .database import STORAGE_BACKEND, get_db_path
+from .storage import VisitRecord, get_storage
+
+# ── Async storage access ──────────────────────────────────────────────────────
+# Handlers are `async def` and await storage calls instead of occupying one of
+# Starlette's threadpool slots for the whole request.
+#   Writes (SQLite): DB_WRITE_THREADS single-thread executors, each database
+#     file always going to the same one. Writers in this process never contend
+#     for a file's lock, so busy_timeout waits only happen against other
+#     processes. The thread count doesn't grow with the number of site_ids
+#     clients send; files that share a thread share its queue.
+#   Reads, and all PostgreSQL calls: a shared pool of DB_READ_THREADS threads.
+#     WAL readers don't block on writers, and PostgreSQL handles concurrent
+#     writers itself.
+DB_READ_THREADS = int(os.getenv("DB_READ_THREADS", "16"))
+DB_WRITE_THREADS = max(1, int(os.getenv("DB_WRITE_THREADS", "8")))
+
+_read_pool = ThreadPoolExecutor(max_workers=DB_READ_THREADS, thread_name_prefix="db-read")
+_writers: dict = {}   # stripe index -> single-thread executor
+_writers_lock = threading.Lock()
+
+
+def _writer(site_id: str) -> ThreadPoolExecutor:
+    if STORAGE_BACKEND == "postgres":
+        return _read_pool
+    stripe = zlib.crc32(str(get_db_path(site_id)).encode()) % DB_WRITE_THREADS
+    executor = _writers.get(stripe)
+    if executor is None:
+        with _writers_lock:
+            executor = _writers.get(stripe)
+            if executor is None:
+                executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"db-write-{stripe}")
+                _writers[stripe] = executor
+    return executor
+
+
+async def _read(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(_read_pool, partial(func, *args))
+
+
+async def _write(site_id: str, func, *args):
+    return await asyncio.wrap_future(_writer(site_id).submit(func, *args))
+
+
+class AsyncStorage:
+    """Awaitable versions of the Storage calls made on the request path."""
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    async def get_public_key(self, site_id: str) -> Optional[str]:
+        return await _read(self.storage.get_public_key, site_id)
+
+    async def set_public_key(self, site_id: str, public_key_hex: str, replace: bool = False) -> bool:
+        return await _write(site_id, self.storage.set_public_key, site_id, public_key_hex, replace)
+
+    async def get_visitor_state(self, site_id: str, ip_hash: str) -> tuple:
+        return await _read(self.storage.get_visitor_state, site_id, ip_hash)
+
+    async def record_visit(self, site_id: str, visit: VisitRecord) -> tuple:
+        return await _write(site_id, self.storage.record_visit, site_id, visit)
+
+    async def record_click(self, site_id: str, url: str):
+        return await _write(site_id, self.storage.record_click, site_id, url)
+
+    async def record_anomalies(self, site_id: str, events: list):
+        return await _write(site_id, self.storage.record_anomalies, site_id, events)
+
+    async def get_stats(self, site_id: str, top: Optional[int] = None) -> dict:
+        return await _read(self.storage.get_stats, site_id, top)
+
+    async def get_page_stats(self, site_id: str, path: str) -> dict:
+        return await _read(self.storage.get_page_stats, site_id, path)
+
+    async def get_page_views(self, site_id: str, paths: list) -> dict:
+        return await _read(self.storage.get_page_views, site_id, paths)
+
+    async def get_bot_overview(self, site_id: str) -> dict:
+        return await _read(self.storage.get_bot_overview, site_id)
+
+    async def get_bot_stats(self, site_id: str) -> dict:
+        return await _read(self.storage.get_bot_stats, site_id)
+
+
+_async_storage: Optional[AsyncStorage] = None
+
+
+def get_async_storage() -> AsyncStorage:
+    global _async_storage
+    if _async_storage is None:
+        _async_storage = AsyncStorage(get_storage())
+    return _async_storage
+
+
+def shutdown_executors():
+    """Waits for queued writes to finish; call on application shutdown."""
+    with _writers_lock:
+        executors = list(_writers.values())
+        _writers.clear()
+    for executor in executors:
+        executor.shutdown(wait=True)
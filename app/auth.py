@@ -1,14 +1,16 @@
 import base64
+import os
 import time
 from typing import Optional
 from fastapi import HTTPException, Header, Request, Query
 from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
 from cryptography.exceptions import InvalidSignature
-from .database import get_db
+from .storage import get_storage
+from .async_storage import get_async_storage
 
 _UNAUTHORIZED = HTTPException(status_code=401, detail="Unauthorized")
 
-def verify_signature(
+async def verify_signature(
     request: Request,
     site_id: str = Query("default"),
     x_timestamp: Optional[int] = Header(None, alias="X-Timestamp"),
@@ -20,22 +22,45 @@ def verify_signature(
     Message format signed by client: "{site_id}:{x_timestamp}" (hex-encoded Ed25519 signature).
     """
     # 1. Check if site has a public key registered
-    conn = get_db(site_id)
-    cursor = conn.cursor()
-    cursor.execute("SELECT key_value FROM auth_config WHERE key_type = 'public_key'")
-    row = cursor.fetchone()
-    conn.close()
+    public_key_hex = await get_async_storage().get_public_key(site_id)
+    return _check_site_key(public_key_hex, site_id, x_timestamp, x_signature)
 
-    if not row:
+
+async def verify_stream_signature(
+    site_id: str = Query("default"),
+    timestamp: Optional[int] = Query(None),
+    signature: Optional[str] = Query(None),
+    x_timestamp: Optional[int] = Header(None, alias="X-Timestamp"),
+    x_signature: Optional[str] = Header(None, alias="X-Signature")
+):
+    """
+    verify_signature for EventSource, which can't send headers: the same
+    signature may be given as `timestamp` / `signature` query parameters.
+    """
+    public_key_hex = await get_async_storage().get_public_key(site_id)
+    return _check_site_key(public_key_hex, site_id, x_timestamp or timestamp, x_signature or signature)
+
+
+def verify_site_signature(site_id: str, x_timestamp: Optional[int], x_signature: Optional[str]) -> bool:
+    """Blocking variant of verify_signature for sync handlers."""
+    public_key_hex = get_storage().get_public_key(site_id)
+    return _check_site_key(public_key_hex, site_id, x_timestamp, x_signature)
+
+
+def _check_site_key(public_key_hex: Optional[str], site_id: str, x_timestamp: Optional[int], x_signature: Optional[str]) -> bool:
+    if not public_key_hex:
         # No key configured — allow public access
         return True
 
     # 2. Key exists; auth is required
+    return _verify_ed25519(public_key_hex, site_id, x_timestamp, x_signature)
+
+
+def _verify_ed25519(public_key_hex: str, scope: str, x_timestamp: Optional[int], x_signature: Optional[str]) -> bool:
+    """Checks a hex Ed25519 signature over "{scope}:{x_timestamp}" within the replay window."""
     if not x_timestamp or not x_signature:
         raise _UNAUTHORIZED
 
-    public_key_hex = row["key_value"]
-
     # 3. Verify timestamp to prevent replay attacks (5-minute window)
     current_time = int(time.time())
     if abs(current_time - x_timestamp) > 300:
@@ -43,7 +68,7 @@ def verify_signature(
 
     # 4. Verify Ed25519 signature
     try:
-        message = f"{site_id}:{x_timestamp}".encode()
+        message = f"{scope}:{x_timestamp}".encode()
 
         try:
             signature = bytes.fromhex(x_signature)
@@ -65,3 +90,22 @@ def verify_signature(
         raise
     except Exception:
         raise _UNAUTHORIZED
+
+
+# Operator key for cross-site endpoints (e.g. /overview). Requests signed with
+# it over "admin:{x_timestamp}" may read every site, including locked ones.
+_ADMIN_PUBLIC_KEY = os.getenv("ADMIN_PUBLIC_KEY", "").strip()
+
+
+def verify_admin_signature(
+    x_timestamp: Optional[int] = Header(None, alias="X-Timestamp"),
+    x_signature: Optional[str] = Header(None, alias="X-Signature"),
+) -> bool:
+    """
+    Returns True for a valid admin-signed request and False for an unsigned
+    one (or when no ADMIN_PUBLIC_KEY is configured). A signature that is
+    present but invalid is rejected with 401.
+    """
+    if not _ADMIN_PUBLIC_KEY or not (x_timestamp or x_signature):
+        return False
+    return _verify_ed25519(_ADMIN_PUBLIC_KEY, "admin", x_timestamp, x_signature)
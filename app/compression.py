@@ -0,0 +1,120 @@
+import asyncio
+import gzip
+import os
+from typing import Optional
+from starlette.datastructures import Headers, MutableHeaders
+
+# brotli and zstandard are optional; gzip is always available
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# ── Response compression ──────────────────────────────────────────────────────
+# CompressionMiddleware compresses complete response bodies with the best
+# coding the client accepts (zstd, br, gzip). Small bodies, streamed bodies
+# (e.g. /export, which gzips itself) and responses that already carry a
+# Content-Encoding pass through unchanged, so a cached EncodedJSON can answer
+# with a variant it compressed once (see serialization.EncodedJSON).
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+_OFFLOAD_BYTES = 256 * 1024   # bodies compressed off the event loop above this size
+_COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+# Preferred first when the client weights several codings equally
+AVAILABLE_ENCODINGS = tuple(
+    name for name, available in (("zstd", zstandard), ("br", brotli), ("gzip", True)) if available
+)
+
+# Per-request levels favour speed; variants stored by a cache are made once
+# and served many times, so they use the higher levels.
+_FAST_LEVELS = {"zstd": 3, "br": 4, "gzip": 6}
+_STORED_LEVELS = {"zstd": 12, "br": 9, "gzip": 9}
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """The coding to use for an Accept-Encoding header value, or None for identity."""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip().lower()] = q
+    best, best_q = None, 0.0
+    for name in AVAILABLE_ENCODINGS:
+        q = weights.get(name, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def compress(body: bytes, encoding: str, stored: bool = False) -> bytes:
+    level = (_STORED_LEVELS if stored else _FAST_LEVELS)[encoding]
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(body)
+    if encoding == "br":
+        return brotli.compress(body, quality=level)
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+class CompressionMiddleware:
+    """Compresses complete, compressible response bodies of COMPRESS_MIN_BYTES or more."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start_message = None
+        passthrough = False
+
+        async def compressing_send(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                return await send(message)
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body":
+                return await send(message)
+
+            headers = MutableHeaders(raw=start_message["headers"])
+            body = message.get("body", b"")
+            if (
+                message.get("more_body", False)
+                or "content-encoding" in headers
+                or len(body) < COMPRESS_MIN_BYTES
+                or not headers.get("content-type", "").startswith(_COMPRESSIBLE_TYPES)
+            ):
+                passthrough = True
+                await send(start_message)
+                return await send(message)
+
+            if len(body) > _OFFLOAD_BYTES:
+                body = await asyncio.get_running_loop().run_in_executor(None, compress, body, encoding)
+            else:
+                body = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+            if "accept-encoding" not in headers.get("vary", "").lower():
+                headers.add_vary_header("Accept-Encoding")
+            passthrough = True
+            await send(start_message)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, compressing_send)
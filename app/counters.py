@@ -0,0 +1,98 @@
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Optional
+from .database import site_key
+
+logger = logging.getLogger(__name__)
+
+# ── Hot counters ──────────────────────────────────────────────────────────────
+# general_stats.total_visits and today's daily_stats row are touched by every
+# human visit. Their increments are collected here instead and merged into the
+# database every COUNTER_FLUSH_SECONDS, so ingest doesn't serialise on those
+# rows. Sites are spread over lock stripes; a stripe's lock is held while its
+# deltas are written, and while /stats reads the persisted values, so readers
+# always see persisted + pending exactly once.
+# Up to COUNTER_FLUSH_SECONDS of increments are lost if the process is killed
+# (a clean shutdown flushes). Set to 0 to write the counters with each visit.
+COUNTER_FLUSH_SECONDS = float(os.getenv("COUNTER_FLUSH_SECONDS", "5"))
+_STRIPES = 16
+
+
+class HotCounters:
+    """Unflushed total_visits / daily_stats increments per site."""
+
+    def __init__(self, stripes: int = _STRIPES):
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        # site_id -> [total_visits, {date: [visits, unique_visitors]}]
+        self._pending = [{} for _ in range(stripes)]
+
+    def _stripe(self, site_id: str) -> int:
+        return hash(site_id) % len(self._locks)
+
+    def add(self, site_id: str, total: int, daily: dict):
+        """Adds `total` visits and {date: [visits, uniques]} to a site's pending counts."""
+        sid = site_key(site_id)
+        i = self._stripe(sid)
+        with self._locks[i]:
+            entry = self._pending[i].setdefault(sid, [0, {}])
+            entry[0] += total
+            for date, (visits, uniques) in daily.items():
+                counts = entry[1].setdefault(date, [0, 0])
+                counts[0] += visits
+                counts[1] += uniques
+
+    @contextmanager
+    def view(self, site_id: str):
+        """
+        Yields (total, {date: [visits, uniques]}) pending for the site. No flush
+        of the site happens inside the block, so read the persisted values there.
+        """
+        sid = site_key(site_id)
+        i = self._stripe(sid)
+        with self._locks[i]:
+            total, daily = self._pending[i].get(sid, (0, {}))
+            yield total, {date: tuple(counts) for date, counts in daily.items()}
+
+    def flush(self, write):
+        """Calls write(site_id, total, daily) for every site with pending counts, then clears them."""
+        for i, lock in enumerate(self._locks):
+            with lock:
+                for sid, (total, daily) in list(self._pending[i].items()):
+                    try:
+                        write(sid, total, daily)
+                    except Exception:
+                        # Kept for the next flush
+                        logger.exception("counter flush failed for site=%s", sid)
+                        continue
+                    del self._pending[i][sid]
+
+
+hot_counters = HotCounters()
+
+_flusher_thread: Optional[threading.Thread] = None
+_flusher_stop = threading.Event()
+
+
+def _flusher_loop(flush):
+    while not _flusher_stop.wait(COUNTER_FLUSH_SECONDS):
+        flush()
+
+
+def start_flusher(flush):
+    """Runs flush() every COUNTER_FLUSH_SECONDS on a daemon thread."""
+    global _flusher_thread
+    if COUNTER_FLUSH_SECONDS <= 0 or (_flusher_thread and _flusher_thread.is_alive()):
+        return
+    _flusher_stop.clear()
+    _flusher_thread = threading.Thread(target=_flusher_loop, args=(flush,), name="counter-flush", daemon=True)
+    _flusher_thread.start()
+
+
+def stop_flusher(flush):
+    """Stops the flusher thread and writes whatever is still pending."""
+    _flusher_stop.set()
+    if _flusher_thread:
+        _flusher_thread.join(timeout=5)
+    flush()
@@ -1,187 +1,610 @@
+import json
+import logging
 import sqlite3
+import threading
+import time
+import zlib
 from pathlib import Path
+from typing import Optional
 import os
 import re
 
+logger = logging.getLogger(__name__)
+
 # Ensure data directory exists
 DATA_DIR = Path("data")
 DATA_DIR.mkdir(exist_ok=True)
 
-# Track which site DBs have been initialised this process lifetime
+# ── Storage layout ────────────────────────────────────────────────────────────
+# "per_site": one SQLite file per site (data/{site_id}.db). The default.
+# "sharded":  sites are hashed into STORAGE_SHARDS files under data/shards/,
+#             bounding open files, WAL files and checkpoints for many small sites.
+# Every table carries a site_id column in both layouts, so all queries are the
+# same; upserts omit the conflict target so they match either primary key.
+# Changing STORAGE_SHARDS remaps sites: migrate with `python -m app.migrate`.
+STORAGE_LAYOUT = os.getenv("STORAGE_LAYOUT", "per_site").strip().lower()
+STORAGE_SHARDS = int(os.getenv("STORAGE_SHARDS", "8"))
+SHARD_DIR = DATA_DIR / "shards"
+if STORAGE_LAYOUT not in ("per_site", "sharded"):
+    raise ValueError(f"STORAGE_LAYOUT must be 'per_site' or 'sharded', got {STORAGE_LAYOUT!r}")
+if STORAGE_LAYOUT == "sharded":
+    SHARD_DIR.mkdir(exist_ok=True)
+
+# "sqlite" keeps analytics in the files above; "postgres" moves them to the
+# database at DATABASE_URL (see app/storage.py). The site registry stays local.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite").strip().lower()
+if STORAGE_BACKEND not in ("sqlite", "postgres"):
+    raise ValueError(f"STORAGE_BACKEND must be 'sqlite' or 'postgres', got {STORAGE_BACKEND!r}")
+
+# ── SQLite profiles ───────────────────────────────────────────────────────────
+# Connection settings applied by get_db(), chosen with SQLITE_PROFILE:
+#   durable     SQLite's defaults: every commit is fsynced, and the commit that
+#               fills the WAL past 1000 pages checkpoints it inline.
+#   balanced    synchronous=NORMAL: in WAL mode the database can't be corrupted,
+#               but the last commits before a power loss (not a process crash)
+#               may be lost. Larger cache, 256 MB memory-mapped reads.
+#   throughput  synchronous=OFF: an OS crash or power loss can lose recent
+#               commits or corrupt the file. 1 GB memory-mapped reads.
+# get_db() connections are short-lived, so the page cache mostly helps long
+# reads; mmap_size lets every connection share the OS page cache instead.
+# With balanced and throughput, a background thread per database file runs a
+# PASSIVE checkpoint every SQLITE_CHECKPOINT_SECONDS while the WAL grows, so
+# requests don't pay for checkpoints. Under continuous writes a checkpoint
+# never catches up with the newest frame, so the WAL can't restart. The inline
+# checkpoint is therefore kept as a fallback at 10000 pages; by then the
+# thread has copied nearly everything back and it costs little.
+# journal_size_limit shrinks the file again after a burst.
+_PROFILES = {
+    "durable": {
+        "synchronous": "FULL", "cache_size": -2000, "mmap_size": 0,
+        "temp_store": "DEFAULT", "wal_autocheckpoint": 1000,
+    },
+    "balanced": {
+        "synchronous": "NORMAL", "cache_size": -16000, "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY", "wal_autocheckpoint": 10000, "journal_size_limit": 64 * 1024 * 1024,
+    },
+    "throughput": {
+        "synchronous": "OFF", "cache_size": -64000, "mmap_size": 1024 * 1024 * 1024,
+        "temp_store": "MEMORY", "wal_autocheckpoint": 10000, "journal_size_limit": 64 * 1024 * 1024,
+    },
+}
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "durable").strip().lower()
+if SQLITE_PROFILE not in _PROFILES:
+    raise ValueError(f"SQLITE_PROFILE must be one of {', '.join(_PROFILES)}, got {SQLITE_PROFILE!r}")
+SQLITE_CHECKPOINT_SECONDS = float(os.getenv("SQLITE_CHECKPOINT_SECONDS", "1"))
+_CONNECTION_PRAGMAS = [
+    "PRAGMA journal_mode=WAL",   # concurrent reads during writes
+    "PRAGMA busy_timeout=5000",  # wait up to 5 s on lock instead of failing
+    *(f"PRAGMA {name}={value}" for name, value in _PROFILES[SQLITE_PROFILE].items()),
+]
+_BACKGROUND_CHECKPOINTS = SQLITE_PROFILE in ("balanced", "throughput")
+
+# Track which sites / DB files have been initialised this process lifetime
 _initialized_sites: set = set()
+_initialized_files: set = set()
 
-def get_db_path(site_id: str) -> Path:
+
+class SiteConnection(sqlite3.Connection):
+    """SQLite connection bound to one site. `site_id` is the value of every table's site_id column."""
+    site_id: str = "default"
+
+
+def site_key(site_id: str) -> str:
     # Sanitize site_id to prevent path traversal
     # Allow alphanumeric, dashes, underscores, and dots (for domains)
     safe_id = re.sub(r'[^a-zA-Z0-9_.-]', '', site_id)
-    if not safe_id:
-        safe_id = "default"
-    return DATA_DIR / f"{safe_id}.db"
+    return safe_id or "default"
+
+def get_shard_path(index: int) -> Path:
+    return SHARD_DIR / f"shard-{index:03d}.db"
+
+def get_shard_index(site_id: str, shards: int = STORAGE_SHARDS) -> int:
+    """Stable shard for a site (CRC32 of the sanitized id, so it survives restarts)."""
+    return zlib.crc32(site_key(site_id).encode()) % shards
+
+def get_db_path(site_id: str) -> Path:
+    if STORAGE_LAYOUT == "sharded":
+        return get_shard_path(get_shard_index(site_id))
+    return DATA_DIR / f"{site_key(site_id)}.db"
+
+def get_db_size(site_id: str) -> int:
+    """Size of the site's database file plus its WAL, in bytes."""
+    db_path = get_db_path(site_id)
+    total = 0
+    for path in (db_path, db_path.with_name(db_path.name + "-wal")):
+        try:
+            total += path.stat().st_size
+        except FileNotFoundError:
+            pass
+    return total
+
+# ── Site registry ─────────────────────────────────────────────────────────────
+# data/registry.sqlite3 records every site with its creation time, auth status
+# and DB size (the shard's size in the sharded layout), plus each site's latest
+# retention report so GET /maintenance answers the same on every worker. Each
+# process keeps an
+# in-memory copy, reloaded when the registry file's mtime changes (another
+# worker registered a site or key) and reconciled against the DB files every
+# _REGISTRY_RESCAN_SECONDS to pick up files added or removed outside the API.
+REGISTRY_PATH = DATA_DIR / "registry.sqlite3"
+_REGISTRY_RELOAD_SECONDS = 1.0
+_REGISTRY_RESCAN_SECONDS = int(os.getenv("REGISTRY_RESCAN_SECONDS", "60"))
+_registry_lock = threading.RLock()
+# site_id -> {"id", "created_at", "requires_auth", "db_size"}
+_registry_cache: dict = {}
+_registry_state = {"mtime": None, "checked_at": 0.0, "scanned_at": 0.0}
+
+def _registry_conn() -> sqlite3.Connection:
+    conn = sqlite3.connect(str(REGISTRY_PATH), timeout=5, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sites (
+            site_id TEXT PRIMARY KEY,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            requires_auth INTEGER DEFAULT 0,
+            db_size INTEGER DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS maintenance_reports (
+            site_id TEXT PRIMARY KEY,
+            report TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    return conn
+
+def update_site(site_id: str, requires_auth: Optional[bool] = None, db_size: Optional[int] = None):
+    """
+    Records a site in the registry, updating auth status and/or DB size when
+    given. Call on site creation and whenever a key is registered or removed.
+    """
+    key = site_key(site_id)
+    if db_size is None:
+        db_size = get_db_size(key)
+    auth_flag = None if requires_auth is None else int(requires_auth)
+    conn = _registry_conn()
+    try:
+        conn.execute("""
+            INSERT INTO sites (site_id, requires_auth, db_size)
+            VALUES (?, COALESCE(?, 0), ?)
+            ON CONFLICT(site_id) DO UPDATE SET
+                requires_auth = COALESCE(?, requires_auth),
+                db_size = excluded.db_size,
+                updated_at = CURRENT_TIMESTAMP
+        """, (key, auth_flag, db_size, auth_flag))
+        conn.commit()
+    finally:
+        conn.close()
+    with _registry_lock:
+        entry = _registry_cache.setdefault(
+            key, {"id": key, "created_at": None, "requires_auth": False, "db_size": 0}
+        )
+        if requires_auth is not None:
+            entry["requires_auth"] = bool(requires_auth)
+        entry["db_size"] = db_size
+
+def save_maintenance_report(site_id: str, report: dict):
+    """Stores a site's latest retention report where every worker can read it."""
+    conn = _registry_conn()
+    try:
+        conn.execute("""
+            INSERT INTO maintenance_reports (site_id, report) VALUES (?, ?)
+            ON CONFLICT(site_id) DO UPDATE SET
+                report = excluded.report,
+                updated_at = CURRENT_TIMESTAMP
+        """, (site_key(site_id), json.dumps(report)))
+        conn.commit()
+    finally:
+        conn.close()
+
+def get_maintenance_report(site_id: str) -> Optional[dict]:
+    conn = _registry_conn()
+    try:
+        row = conn.execute(
+            "SELECT report FROM maintenance_reports WHERE site_id = ?", (site_key(site_id),)
+        ).fetchone()
+    finally:
+        conn.close()
+    return json.loads(row["report"]) if row else None
+
+def _read_requires_auth(db_path: Path) -> set:
+    """Site ids with a public key in a DB file, read without initialising the file."""
+    try:
+        conn = sqlite3.connect(str(db_path), timeout=5)
+        try:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(auth_config)")}
+            if "site_id" in columns:
+                rows = conn.execute("SELECT site_id FROM auth_config WHERE key_type = 'public_key'").fetchall()
+                return {row[0] for row in rows}
+            row = conn.execute("SELECT 1 FROM auth_config WHERE key_type = 'public_key'").fetchone()
+            return {db_path.stem} if row else set()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return set()
+
+def _sites_on_disk() -> dict:
+    """site_id -> path of the DB file holding it, for the active storage layout."""
+    if STORAGE_LAYOUT == "per_site":
+        return {file.stem: file for file in DATA_DIR.glob("*.db")}
+    on_disk = {}
+    for path in SHARD_DIR.glob("shard-*.db"):
+        try:
+            conn = sqlite3.connect(str(path), timeout=5)
+            try:
+                rows = conn.execute("SELECT site_id FROM general_stats WHERE key = 'total_visits'").fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            continue
+        on_disk.update({row[0]: path for row in rows})
+    return on_disk
+
+def _rescan_registry(conn: sqlite3.Connection):
+    """Reconciles the registry with the sites present in storage (DB files or PostgreSQL)."""
+    if STORAGE_BACKEND == "postgres":
+        from .storage import get_storage  # deferred: app.storage imports this module
+        present = get_storage().site_auth_status()
+        requires_auth = present.get
+    else:
+        present = _sites_on_disk()
+        locked: dict = {}
+
+        def requires_auth(site_id: str) -> bool:
+            path = present[site_id]
+            if path not in locked:
+                locked[path] = _read_requires_auth(path)
+            return site_id in locked[path]
+
+    known = {row["site_id"] for row in conn.execute("SELECT site_id FROM sites")}
+    for site_id in known - present.keys():
+        conn.execute("DELETE FROM sites WHERE site_id = ?", (site_id,))
+        conn.execute("DELETE FROM maintenance_reports WHERE site_id = ?", (site_id,))
+    for site_id in present:
+        if site_id in known:
+            conn.execute("UPDATE sites SET db_size = ? WHERE site_id = ?", (get_db_size(site_id), site_id))
+        else:
+            conn.execute(
+                "INSERT INTO sites (site_id, requires_auth, db_size) VALUES (?, ?, ?)",
+                (site_id, int(requires_auth(site_id)), get_db_size(site_id)),
+            )
+    conn.commit()
+
+def _refresh_registry():
+    now = time.time()
+    with _registry_lock:
+        if now - _registry_state["checked_at"] < _REGISTRY_RELOAD_SECONDS:
+            return
+        _registry_state["checked_at"] = now
+
+        rescan = now - _registry_state["scanned_at"] >= _REGISTRY_RESCAN_SECONDS
+        try:
+            mtime = REGISTRY_PATH.stat().st_mtime
+        except FileNotFoundError:
+            mtime, rescan = None, True
+        if not rescan and mtime == _registry_state["mtime"]:
+            return
+
+        conn = _registry_conn()
+        try:
+            if rescan:
+                _rescan_registry(conn)
+                _registry_state["scanned_at"] = now
+            rows = conn.execute("SELECT site_id, created_at, requires_auth, db_size FROM sites").fetchall()
+        finally:
+            conn.close()
+        _registry_cache.clear()
+        for row in rows:
+            _registry_cache[row["site_id"]] = {
+                "id": row["site_id"],
+                "created_at": row["created_at"],
+                "requires_auth": bool(row["requires_auth"]),
+                "db_size": row["db_size"],
+            }
+        _registry_state["mtime"] = REGISTRY_PATH.stat().st_mtime
 
 def list_sites():
     """
-    Lists all available site IDs based on the database files.
+    Lists all known site IDs from the in-memory site registry.
     """
-    sites = []
-    for file in DATA_DIR.glob("*.db"):
-        # Remove .db extension
-        sites.append(file.stem)
-    return sorted(sites)
+    _refresh_registry()
+    with _registry_lock:
+        return sorted(_registry_cache)
 
-def get_db(site_id: str = "default") -> sqlite3.Connection:
-    """Return an open SQLite connection. Initialises the schema on first access per site."""
-    if site_id not in _initialized_sites:
-        init_db(site_id)  # init_db adds site_id to _initialized_sites
-    db_path = get_db_path(site_id)
-    conn = sqlite3.connect(str(db_path), check_same_thread=False)
+def get_site_records() -> list:
+    """Registry entries for all sites (id, created_at, requires_auth, db_size), sorted by id."""
+    _refresh_registry()
+    with _registry_lock:
+        return [dict(_registry_cache[site_id]) for site_id in sorted(_registry_cache)]
+
+
+def _connect(db_path: Path, site_id: str) -> SiteConnection:
+    conn = sqlite3.connect(str(db_path), check_same_thread=False, factory=SiteConnection)
+    conn.site_id = site_key(site_id)
     conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode=WAL")   # concurrent reads during writes
-    conn.execute("PRAGMA busy_timeout=5000")  # wait up to 5 s on lock instead of failing
     return conn
 
-def init_db(site_id: str = "default"):
-    global _initialized_sites
+def get_db(site_id: str = "default") -> SiteConnection:
+    """Return an open SQLite connection. Initialises the schema on first access per site."""
+    if site_key(site_id) not in _initialized_sites:
+        init_db(site_id)  # init_db adds the site to _initialized_sites
     db_path = get_db_path(site_id)
-    conn = sqlite3.connect(db_path, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode=WAL")
-    conn.execute("PRAGMA busy_timeout=5000")
-    cursor = conn.cursor()
+    conn = _connect(db_path, site_id)
+    for pragma in _CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    if _BACKGROUND_CHECKPOINTS and db_path not in _checkpoint_files:
+        _start_checkpointer(db_path)
+    return conn
+
+# ── Background WAL checkpoints ────────────────────────────────────────────────
+# One thread per process checkpoints every database file it has opened recently
+# (see SQLite profiles). A file whose WAL hasn't changed for
+# _CHECKPOINT_IDLE_SECONDS is dropped, with its connection, until get_db()
+# opens it again, so site_ids that are only seen once don't accumulate.
+_CHECKPOINT_IDLE_SECONDS = 300
+_checkpoint_files: dict = {}   # db_path -> [connection or None, last WAL (size, mtime), last change]
+_checkpoints_lock = threading.Lock()
+_checkpoint_stop = threading.Event()
+_checkpoint_thread: Optional[threading.Thread] = None
+
+
+def _checkpoint_file(db_path: Path, state: list, now: float) -> bool:
+    """Checkpoints one file if its WAL changed. Returns False once it has been idle long enough to drop."""
+    try:
+        stat = Path(f"{db_path}-wal").stat()
+    except FileNotFoundError:
+        return now - state[2] < _CHECKPOINT_IDLE_SECONDS
+    # Nothing written since the last pass
+    if (stat.st_size, stat.st_mtime_ns) == state[1]:
+        return now - state[2] < _CHECKPOINT_IDLE_SECONDS
+    if state[0] is None:
+        state[0] = sqlite3.connect(str(db_path), check_same_thread=False)
+    try:
+        # PASSIVE never waits on, or blocks, readers and writers
+        state[0].execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+    except sqlite3.Error as exc:
+        logger.warning("checkpoint of %s failed: %s", db_path.name, exc)
+        return True
+    state[1] = (stat.st_size, stat.st_mtime_ns)
+    state[2] = now
+    return True
+
+
+def _checkpoint_loop():
+    while not _checkpoint_stop.wait(SQLITE_CHECKPOINT_SECONDS):
+        now = time.monotonic()
+        with _checkpoints_lock:
+            files = list(_checkpoint_files.items())
+        for db_path, state in files:
+            if _checkpoint_file(db_path, state, now):
+                continue
+            with _checkpoints_lock:
+                _checkpoint_files.pop(db_path, None)
+            if state[0] is not None:
+                state[0].close()
+    with _checkpoints_lock:
+        files = list(_checkpoint_files.items())
+        _checkpoint_files.clear()
+    for db_path, state in files:
+        if state[0] is None:
+            state[0] = sqlite3.connect(str(db_path), check_same_thread=False)
+        try:
+            state[0].execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+        except sqlite3.Error as exc:
+            logger.warning("checkpoint of %s failed: %s", db_path.name, exc)
+        finally:
+            state[0].close()
+
+
+def _start_checkpointer(db_path: Path):
+    global _checkpoint_thread
+    with _checkpoints_lock:
+        if db_path in _checkpoint_files or _checkpoint_stop.is_set():
+            return
+        _checkpoint_files[db_path] = [None, None, time.monotonic()]
+        if _checkpoint_thread is None or not _checkpoint_thread.is_alive():
+            _checkpoint_thread = threading.Thread(target=_checkpoint_loop, name="wal-checkpoint", daemon=True)
+            _checkpoint_thread.start()
+
+
+def stop_checkpointers():
+    """Stops the checkpoint thread after a last checkpoint of each file."""
+    global _checkpoint_thread
+    _checkpoint_stop.set()
+    if _checkpoint_thread is not None:
+        _checkpoint_thread.join(timeout=5)
+        _checkpoint_thread = None
+    _checkpoint_stop.clear()
+
+# ── Schema ────────────────────────────────────────────────────────────────────
+# Every table is keyed by site_id first. Per-site files created before the
+# sharded layout existed keep their original primary keys and get a constant
+# site_id column added by _migrate_schema().
+SITE_TABLES = (
+    "unique_visitors", "country_stats", "page_stats", "device_stats", "browser_stats",
+    "os_stats", "referrer_stats", "daily_stats", "link_stats", "visitor_activity",
+    "bot_logs", "auth_config", "general_stats", "page_country_stats",
+    "bot_daily_stats", "bot_page_stats", "ip_path_counts", "traffic_anomalies",
+)
+
+def _create_schema(cursor: sqlite3.Cursor):
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS unique_visitors (
-            ip_hash TEXT PRIMARY KEY,
-            last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            site_id TEXT NOT NULL,
+            ip_hash TEXT NOT NULL,
+            last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (site_id, ip_hash)
         )
     """)
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS country_stats (
-            country_code TEXT PRIMARY KEY,
-            visitor_count INTEGER DEFAULT 0
+            site_id TEXT NOT NULL,
+            country_code TEXT NOT NULL,
+            visitor_count INTEGER DEFAULT 0,
+            PRIMARY KEY (site_id, country_code)
         )
     """)
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS page_stats (
-            page_path TEXT PRIMARY KEY,
+            site_id TEXT NOT NULL,
+            page_path TEXT NOT NULL,
             view_count INTEGER DEFAULT 0,
-            last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (site_id, page_path)
         )
     """)
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS device_stats (
-            device_type TEXT PRIMARY KEY,
-            count INTEGER DEFAULT 0
+            site_id TEXT NOT NULL,
+            device_type TEXT NOT NULL,
+            count INTEGER DEFAULT 0,
+            PRIMARY KEY (site_id, device_type)
         )
     """)
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS browser_stats (
-            browser_family TEXT PRIMARY KEY,
-            count INTEGER DEFAULT 0
+            site_id TEXT NOT NULL,
+            browser_family TEXT NOT NULL,
+            count INTEGER DEFAULT 0,
+            PRIMARY KEY (site_id, browser_family)
         )
     """)
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS os_stats (
-            os_family TEXT PRIMARY KEY,
-            count INTEGER DEFAULT 0
+            site_id TEXT NOT NULL,
+            os_family TEXT NOT NULL,
+            count INTEGER DEFAULT 0,
+            PRIMARY KEY (site_id, os_family)
         )
     """)
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS referrer_stats (
-            category TEXT PRIMARY KEY,
-            count INTEGER DEFAULT 0
+            site_id TEXT NOT NULL,
+            category TEXT NOT NULL,
+            count INTEGER DEFAULT 0,
+            PRIMARY KEY (site_id, category)
         )
     """)
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS daily_stats (
-            date TEXT PRIMARY KEY,
+            site_id TEXT NOT NULL,
+            date TEXT NOT NULL,
             total_visits INTEGER DEFAULT 0,
-            unique_visitors INTEGER DEFAULT 0
+            unique_visitors INTEGER DEFAULT 0,
+            PRIMARY KEY (site_id, date)
         )
     """)
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS link_stats (
-            link_url TEXT PRIMARY KEY,
-            click_count INTEGER DEFAULT 0
+            site_id TEXT NOT NULL,
+            link_url TEXT NOT NULL,
+            click_count INTEGER DEFAULT 0,
+            PRIMARY KEY (site_id, link_url)
         )
     """)
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS visitor_activity (
-            ip_hash TEXT PRIMARY KEY,
+            site_id TEXT NOT NULL,
+            ip_hash TEXT NOT NULL,
             first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             request_count INTEGER DEFAULT 1,
-            ua_score REAL DEFAULT 0.0
+            ua_score REAL DEFAULT 0.0,
+            bot_type TEXT DEFAULT 'none',
+            PRIMARY KEY (site_id, ip_hash)
         )
     """)
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS bot_logs (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
+            site_id TEXT NOT NULL,
             ip_hash TEXT,
             detected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             reason TEXT,
-            confidence REAL
+            confidence REAL,
+            bot_type TEXT DEFAULT 'bot'
         )
     """)
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS auth_config (
-            key_type TEXT PRIMARY KEY,
-            key_value TEXT
+            site_id TEXT NOT NULL,
+            key_type TEXT NOT NULL,
+            key_value TEXT,
+            PRIMARY KEY (site_id, key_type)
         )
     """)
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS general_stats (
-            key TEXT PRIMARY KEY,
-            value INTEGER DEFAULT 0
+            site_id TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value INTEGER DEFAULT 0,
+            PRIMARY KEY (site_id, key)
         )
     """)
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS page_country_stats (
+            site_id      TEXT NOT NULL,
             page_path    TEXT NOT NULL,
             country_code TEXT NOT NULL,
             view_count   INTEGER DEFAULT 0,
-            PRIMARY KEY (page_path, country_code)
+            PRIMARY KEY (site_id, page_path, country_code)
         )
     """)
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS bot_daily_stats (
-            date TEXT PRIMARY KEY,
+            site_id TEXT NOT NULL,
+            date TEXT NOT NULL,
             bot_visits INTEGER DEFAULT 0,
-            crawler_visits INTEGER DEFAULT 0
+            crawler_visits INTEGER DEFAULT 0,
+            PRIMARY KEY (site_id, date)
         )
     """)
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS bot_page_stats (
-            page_path TEXT PRIMARY KEY,
+            site_id TEXT NOT NULL,
+            page_path TEXT NOT NULL,
             bot_views INTEGER DEFAULT 0,
-            crawler_views INTEGER DEFAULT 0
+            crawler_views INTEGER DEFAULT 0,
+            total_views INTEGER DEFAULT 0,
+            PRIMARY KEY (site_id, page_path)
         )
     """)
-
-    # Initialize total visits if not exists
-    cursor.execute("INSERT OR IGNORE INTO general_stats (key, value) VALUES ('total_visits', 0)")
-
-    # ── Indexes for ORDER BY performance ────────────────────────────────────
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_country_count ON country_stats(visitor_count DESC)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_page_count ON page_stats(view_count DESC)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_device_count ON device_stats(count DESC)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_browser_count ON browser_stats(count DESC)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_os_count ON os_stats(count DESC)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_referrer_count ON referrer_stats(count DESC)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_link_count ON link_stats(click_count DESC)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_activity_requests ON visitor_activity(request_count DESC)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_page_country ON page_country_stats(page_path, view_count DESC)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bot_daily ON bot_daily_stats(date DESC)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bot_page ON bot_page_stats(page_path)")
-
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS ip_path_counts (
+            site_id TEXT NOT NULL,
             ip_hash TEXT NOT NULL,
             path TEXT NOT NULL,
-            PRIMARY KEY (ip_hash, path)
+            PRIMARY KEY (site_id, ip_hash, path)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS traffic_anomalies (
+            site_id TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            bucket_start TEXT NOT NULL,
+            type TEXT NOT NULL,
+            observed INTEGER,
+            expected REAL,
+            score REAL,
+            detected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (site_id, metric, bucket_start)
         )
     """)
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ip_path ON ip_path_counts(ip_hash)")
 
-    # ── Schema migrations ────────────────────────────────────────────────────
+def _migrate_schema(cursor: sqlite3.Cursor, site_id: str):
+    """Brings a per-site file created by an older version up to the current schema."""
+    # Add site_id to every table of pre-sharding DBs. The file holds one site,
+    # so a constant default fills existing rows; the old primary keys stay.
+    for table in SITE_TABLES:
+        try:
+            cursor.execute(
+                f"ALTER TABLE {table} ADD COLUMN site_id TEXT NOT NULL DEFAULT '{site_key(site_id)}'"
+            )
+        except Exception:
+            pass  # Column already present
+
     # Add created_at to auth_config if it doesn't exist yet (idempotent)
     try:
         cursor.execute(
@@ -190,21 +613,6 @@ def init_db(site_id: str = "default"):
     except Exception:
         pass  # Column already present
 
-    # Add page_country_stats for existing DBs that predate this table
-    # (CREATE TABLE IF NOT EXISTS above handles new DBs; this is a no-op on those)
-    try:
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS page_country_stats (
-                page_path    TEXT NOT NULL,
-                country_code TEXT NOT NULL,
-                view_count   INTEGER DEFAULT 0,
-                PRIMARY KEY (page_path, country_code)
-            )
-        """)
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_page_country ON page_country_stats(page_path, view_count DESC)")
-    except Exception:
-        pass
-
     # Add bot_type to visitor_activity for existing DBs
     try:
         cursor.execute("ALTER TABLE visitor_activity ADD COLUMN bot_type TEXT DEFAULT 'none'")
@@ -217,79 +625,153 @@ def init_db(site_id: str = "default"):
     except Exception:
         pass
 
-    # Add bot tracking tables for existing DBs
+    # Add last_seen to page_stats for existing DBs (enables cleanup job)
     try:
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS bot_daily_stats (
-                date TEXT PRIMARY KEY,
-                bot_visits INTEGER DEFAULT 0,
-                crawler_visits INTEGER DEFAULT 0
-            )
-        """)
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_bot_daily ON bot_daily_stats(date DESC)")
+        cursor.execute(
+            "ALTER TABLE page_stats ADD COLUMN last_seen TIMESTAMP DEFAULT NULL"
+        )
     except Exception:
         pass
 
+def _upgrade_schema(cursor: sqlite3.Cursor):
+    """Column additions that apply to every file (per-site and shards)."""
+    # bot_views + crawler_views, stored so top bot pages can be read off an index
     try:
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS bot_page_stats (
-                page_path TEXT PRIMARY KEY,
-                bot_views INTEGER DEFAULT 0,
-                crawler_views INTEGER DEFAULT 0
-            )
-        """)
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_bot_page ON bot_page_stats(page_path)")
+        cursor.execute("ALTER TABLE bot_page_stats ADD COLUMN total_views INTEGER DEFAULT 0")
     except Exception:
-        pass
+        pass  # Column already present
+    else:
+        cursor.execute("UPDATE bot_page_stats SET total_views = bot_views + crawler_views")
 
-    try:
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS ip_path_counts (
-                ip_hash TEXT NOT NULL,
-                path TEXT NOT NULL,
-                PRIMARY KEY (ip_hash, path)
-            )
-        """)
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_ip_path ON ip_path_counts(ip_hash)")
-    except Exception:
-        pass
+def _create_indexes(cursor: sqlite3.Cursor):
+    # ── Indexes for ORDER BY performance ────────────────────────────────────
+    # Pre-sharding files keep their original (site_id-less) definitions, which
+    # serve the same queries there since site_id is constant within the file.
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_country_count ON country_stats(site_id, visitor_count DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_page_count ON page_stats(site_id, view_count DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_device_count ON device_stats(site_id, count DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_browser_count ON browser_stats(site_id, count DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_os_count ON os_stats(site_id, count DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_referrer_count ON referrer_stats(site_id, count DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_link_count ON link_stats(site_id, click_count DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_activity_requests ON visitor_activity(site_id, request_count DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_page_country ON page_country_stats(site_id, page_path, view_count DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bot_daily ON bot_daily_stats(site_id, date DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bot_page_total ON bot_page_stats(site_id, total_views DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bot_logs_detected ON bot_logs(site_id, detected_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_anomalies_detected ON traffic_anomalies(site_id, detected_at)")
 
-    # Add last_seen to page_stats for existing DBs (enables cleanup job)
-    try:
-        cursor.execute(
-            "ALTER TABLE page_stats ADD COLUMN last_seen TIMESTAMP DEFAULT NULL"
-        )
-    except Exception:
-        pass
+    # Partial index for purge_stale_pages: only single-view rows, ordered by age
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_page_stale ON page_stats(site_id, last_seen) WHERE view_count = 1"
+    )
+
+# ── Fused human-visit write ───────────────────────────────────────────────────
+# One INSERT into the human_hits view applies every per-dimension counter a
+# human page view touches, so the ingest path issues a single statement instead
+# of one per table (totals and daily_stats go through app/counters.py). Replaced in existing files whenever the definition below changes.
+_HUMAN_HITS_VIEW = """
+    CREATE VIEW human_hits (
+        site_id, ip_hash, page_path, country, device, browser, os, referrer
+    ) AS SELECT NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL WHERE 0
+"""
+_HUMAN_HITS_TRIGGER = """
+    CREATE TRIGGER human_hits_insert INSTEAD OF INSERT ON human_hits
+    BEGIN
+        INSERT INTO country_stats (site_id, country_code, visitor_count)
+        VALUES (NEW.site_id, NEW.country, 1)
+        ON CONFLICT DO UPDATE SET visitor_count = visitor_count + 1;
+
+        INSERT INTO page_stats (site_id, page_path, view_count, last_seen)
+        VALUES (NEW.site_id, NEW.page_path, 1, CURRENT_TIMESTAMP)
+        ON CONFLICT DO UPDATE SET view_count = view_count + 1, last_seen = CURRENT_TIMESTAMP;
+
+        INSERT OR IGNORE INTO ip_path_counts (site_id, ip_hash, path)
+        VALUES (NEW.site_id, NEW.ip_hash, NEW.page_path);
+
+        INSERT INTO device_stats (site_id, device_type, count)
+        VALUES (NEW.site_id, NEW.device, 1)
+        ON CONFLICT DO UPDATE SET count = count + 1;
+
+        INSERT INTO browser_stats (site_id, browser_family, count)
+        VALUES (NEW.site_id, NEW.browser, 1)
+        ON CONFLICT DO UPDATE SET count = count + 1;
 
+        INSERT INTO os_stats (site_id, os_family, count)
+        VALUES (NEW.site_id, NEW.os, 1)
+        ON CONFLICT DO UPDATE SET count = count + 1;
+
+        INSERT INTO referrer_stats (site_id, category, count)
+        VALUES (NEW.site_id, NEW.referrer, 1)
+        ON CONFLICT DO UPDATE SET count = count + 1;
+
+        INSERT INTO page_country_stats (site_id, page_path, country_code, view_count)
+        VALUES (NEW.site_id, NEW.page_path, NEW.country, 1)
+        ON CONFLICT DO UPDATE SET view_count = view_count + 1;
+    END
+"""
+
+def _create_triggers(cursor: sqlite3.Cursor):
+    current = dict(cursor.execute(
+        "SELECT name, sql FROM sqlite_master WHERE name IN ('human_hits', 'human_hits_insert')"
+    ).fetchall())
+    if (current.get("human_hits") == _HUMAN_HITS_VIEW.strip()
+            and current.get("human_hits_insert") == _HUMAN_HITS_TRIGGER.strip()):
+        return
+    # In one transaction, so other processes never see the view without its trigger
+    cursor.execute("SAVEPOINT human_hits")
+    cursor.execute("DROP TRIGGER IF EXISTS human_hits_insert")
+    cursor.execute("DROP VIEW IF EXISTS human_hits")
+    cursor.execute(_HUMAN_HITS_VIEW)
+    cursor.execute(_HUMAN_HITS_TRIGGER)
+    cursor.execute("RELEASE human_hits")
+
+def _init_file(db_path: Path, site_id: str, per_site: bool = STORAGE_LAYOUT == "per_site"):
+    """Creates or upgrades the schema of one DB file (a per-site file, or a shard)."""
+    conn = sqlite3.connect(str(db_path), check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    # Must precede the first CREATE TABLE; no-op on existing DBs (see storage.SQLiteStorage.compact)
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    cursor = conn.cursor()
+    _create_schema(cursor)
+    if per_site:
+        _migrate_schema(cursor, site_id)
+    _upgrade_schema(cursor)
+    _create_indexes(cursor)
+    _create_triggers(cursor)
     conn.commit()
     conn.close()
-    _initialized_sites.add(site_id)
 
+def init_db(site_id: str = "default"):
+    db_path = get_db_path(site_id)
+    if db_path not in _initialized_files:
+        _init_file(db_path, site_id)
+        _initialized_files.add(db_path)
 
-def purge_stale_pages(site_id: str, days: int = 30) -> int:
-    """
-    Deletes page_stats rows that have view_count = 1 and have not been seen
-    in the last `days` days. Returns the number of rows deleted.
+    conn = _connect(db_path, site_id)
+    conn.execute("PRAGMA busy_timeout=5000")
+    cursor = conn.cursor()
 
-    This is a self-healing cleanup for single-hit bot traffic that slipped
-    through detection. Safe to run repeatedly; idempotent.
-    """
-    conn = get_db(site_id)
-    try:
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            DELETE FROM page_stats
-            WHERE view_count = 1
-              AND (last_seen IS NULL OR last_seen < datetime('now', ? || ' days'))
-            """,
-            (f"-{days}",),
-        )
-        deleted = cursor.rowcount
-        conn.commit()
-        return deleted
-    except Exception:
-        return 0
-    finally:
-        conn.close()
+    # Initialize total visits if not exists
+    cursor.execute(
+        "INSERT OR IGNORE INTO general_stats (site_id, key, value) VALUES (?, 'total_visits', 0)",
+        (conn.site_id,),
+    )
+    # Unique visitors removed by retention, so lifetime unique counts survive purges
+    # (returning visitors are counted again: the total becomes an upper bound)
+    cursor.execute(
+        "INSERT OR IGNORE INTO general_stats (site_id, key, value) VALUES (?, 'purged_unique_visitors', 0)",
+        (conn.site_id,),
+    )
+
+    requires_auth = cursor.execute(
+        "SELECT 1 FROM auth_config WHERE site_id = ? AND key_type = 'public_key'",
+        (conn.site_id,),
+    ).fetchone() is not None
+
+    conn.commit()
+    conn.close()
+    _initialized_sites.add(conn.site_id)
+    update_site(site_id, requires_auth=requires_auth)
@@ -0,0 +1,158 @@
+import os
+from datetime import datetime
+from typing import Optional
+from .heavy_hitters import HEAVY_HITTER_THRESHOLD
+
+# ── Behavioral bot detection ──────────────────────────────────────────────────
+# The checks /track applies on top of the User-Agent classification. They live
+# here so `python -m app.replay` can re-run exactly the same rules over the
+# event journal, with event timestamps instead of the wall clock.
+
+# Rolling window: ip_hash -> list of (page_path, unix_timestamp)
+PATH_WINDOW_SECONDS = 900        # 15-minute window
+PATH_WINDOW_THRESHOLD = 20       # distinct paths within the window to flag
+PATH_WINDOW_MAX_ENTRIES = 200    # cap per IP to prevent memory abuse
+LIFETIME_PATH_THRESHOLD = 50     # distinct paths lifetime to flag
+
+# Distributed crawls: timestamps of first-ever IP visits per site, to detect
+# many new IPs each hitting only a small number of paths.
+NEW_IP_WINDOW_SECONDS = 300      # 5-minute window
+NEW_IP_ALERT_THRESHOLD = int(os.getenv("CRAWL_ALERT_THRESHOLD", "100"))  # new IPs / 5 min
+
+
+class BotDetector:
+    """
+    Behavioral checks with their in-memory windows. The API keeps one per
+    process (windows reset on restart; intentional for single-process
+    deployments); a replay creates its own.
+    """
+
+    def __init__(self):
+        self.path_window: dict = {}      # ip_hash -> [(page_path, ts)]
+        self.new_ip_window: dict = {}    # site_id -> [ts]
+
+    def check(
+        self,
+        site_id: str,
+        ip_hash: str,
+        page_path: str,
+        bot_type: str,
+        ua_score: float,
+        existing_activity: Optional[dict],
+        prior_path_count: int,
+        ip_recent_hits: float,
+        now: float,
+    ) -> tuple:
+        """
+        Applies carry-forward and the behavioral checks to one visit.
+        `existing_activity` is the visitor_activity row before this visit (or
+        None) and `prior_path_count` its distinct human paths. Returns
+        (bot_type, ua_score, bot_log_reason, update_activity, flag_visitor)
+        for VisitRecord.
+        """
+        # Carry forward existing bot flag (once flagged, always flagged)
+        if existing_activity:
+            prev_bot_type = existing_activity["bot_type"] or "none"
+            if prev_bot_type != "none" and bot_type == "none":
+                bot_type = prev_bot_type
+                ua_score = 1.0 if bot_type == "bot" else 0.5
+
+        behavioral_flag = False
+        behavioral_reason = None
+
+        # (0) Distributed crawl detection — for brand-new IPs only
+        # Track the rate of new unique IPs per site. If it exceeds the threshold
+        # within a 5-minute window, flag this new IP as part of a distributed crawl.
+        if bot_type == "none" and existing_activity is None:
+            site_window = self.new_ip_window.get(site_id, [])
+            site_window.append(now)
+            cutoff = now - NEW_IP_WINDOW_SECONDS
+            site_window = [t for t in site_window if t >= cutoff]
+            self.new_ip_window[site_id] = site_window
+            if len(site_window) > NEW_IP_ALERT_THRESHOLD:
+                bot_type = "bot"
+                ua_score = 1.0
+                behavioral_flag = True
+                behavioral_reason = "Behavioral: Distributed Crawl Pattern"
+
+        # (1) Rolling window: >20 distinct paths within 15 minutes
+        if bot_type == "none":
+            window = self.path_window.get(ip_hash, [])
+            if len(window) >= PATH_WINDOW_MAX_ENTRIES:
+                window = window[-PATH_WINDOW_MAX_ENTRIES:]
+            window.append((page_path, now))
+            cutoff = now - PATH_WINDOW_SECONDS
+            window = [(p, t) for p, t in window if t >= cutoff]
+            self.path_window[ip_hash] = window
+            if len({p for p, _ in window}) > PATH_WINDOW_THRESHOLD:
+                bot_type = "bot"
+                ua_score = 1.0
+                behavioral_flag = True
+                behavioral_reason = "Behavioral: High Path Diversity (rolling window)"
+
+        # (2) Lifetime distinct path heuristic: >=50 distinct paths ever seen
+        # Uses the pre-read count (before this request's path is inserted) so no
+        # write lock is acquired here.
+        if bot_type == "none" and prior_path_count >= LIFETIME_PATH_THRESHOLD:
+            bot_type = "bot"
+            ua_score = 1.0
+            behavioral_flag = True
+            behavioral_reason = "Behavioral: High Unique Path Count"
+
+        # (3) Behavioral rate check: high lifetime request rate
+        if bot_type == "none" and existing_activity:
+            try:
+                existing_count = existing_activity["request_count"]
+                first_seen_dt = datetime.fromisoformat(existing_activity["first_seen"])
+                last_seen_dt = datetime.fromisoformat(existing_activity["last_seen"])
+                duration_seconds = max(1.0, (last_seen_dt - first_seen_dt).total_seconds())
+                rate_per_hour = (existing_count / duration_seconds) * 3600
+                if existing_count >= 50 and rate_per_hour > 60:
+                    bot_type = "bot"
+                    ua_score = 1.0
+                    behavioral_flag = True
+                    behavioral_reason = "Behavioral: High Request Rate"
+            except Exception:
+                pass
+
+        # (4) Heavy hitter: sustained recent volume from this IP, from the decayed
+        # streaming counts (catches fast scrapers before the lifetime checks do).
+        # Only lasts while the volume does: the hits count as bot traffic but the
+        # visitor isn't flagged, as a NAT or office address carries many people.
+        heavy_hitter = False
+        if bot_type == "none" and HEAVY_HITTER_THRESHOLD > 0 and ip_recent_hits >= HEAVY_HITTER_THRESHOLD:
+            bot_type = "bot"
+            ua_score = 1.0
+            behavioral_flag = True
+            behavioral_reason = "Behavioral: Heavy Hitter (recent volume)"
+            heavy_hitter = True
+
+        # Only log a bot on first detection per IP (for heavy hitters: per burst,
+        # i.e. on the hit that takes the decayed count over the threshold)
+        prev_bot_type = (existing_activity["bot_type"] or "none") if existing_activity else "none"
+        should_log_bot = bot_type != "none" and prev_bot_type == "none"
+        if heavy_hitter:
+            should_log_bot = ip_recent_hits - 1 < HEAVY_HITTER_THRESHOLD
+
+        # For already-known bots (carry-forward, no new behavioral flag), skip the
+        # visitor_activity upsert. It's the highest-frequency write and the data
+        # (request_count, last_seen) is not needed once a bot is flagged. Bot volume
+        # stats (bot_daily_stats, bot_page_stats) are still written.
+        # The first hit of each UTC day still upserts, so last_seen stays recent
+        # and the retention job doesn't expire an active bot (and its flag).
+        seen_today = bool(existing_activity) and (existing_activity["last_seen"] or "")[:10] == (
+            datetime.utcfromtimestamp(now).strftime("%Y-%m-%d")
+        )
+        skip_activity_upsert = bot_type != "none" and prev_bot_type != "none" and not behavioral_flag and seen_today
+
+        if should_log_bot:
+            if behavioral_flag:
+                reason = behavioral_reason
+            elif bot_type == "crawler":
+                reason = "Known Crawler (User-Agent)"
+            else:
+                reason = "Known Bot Signature (User-Agent)"
+        else:
+            reason = None
+
+        return bot_type, ua_score, reason, not skip_activity_upsert, not heavy_hitter
@@ -0,0 +1,67 @@
+import csv
+import io
+import json
+import zlib
+from typing import Iterator
+from .storage import get_storage
+
+# Aggregate tables that may be exported. Auth keys are deliberately excluded.
+EXPORT_TABLES = (
+    "daily_stats",
+    "page_stats",
+    "page_country_stats",
+    "country_stats",
+    "device_stats",
+    "browser_stats",
+    "os_stats",
+    "referrer_stats",
+    "link_stats",
+    "bot_daily_stats",
+    "bot_page_stats",
+    "bot_logs",
+)
+EXPORT_FORMATS = ("ndjson", "csv")
+
+# Rows pulled from the database cursor per step; bounds memory per response
+_EXPORT_BATCH = 1000
+
+
+def _encode_ndjson(batches) -> Iterator[bytes]:
+    for columns, rows in batches:
+        yield "".join(
+            json.dumps(dict(zip(columns, row)), separators=(",", ":")) + "\n" for row in rows
+        ).encode()
+
+
+def _encode_csv(batches) -> Iterator[bytes]:
+    header_written = False
+    for columns, rows in batches:
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        if not header_written:
+            writer.writerow(columns)
+            header_written = True
+        writer.writerows(tuple(row) for row in rows)
+        yield buf.getvalue().encode()
+
+
+def _gzip(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)  # gzip container
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def stream_table(site_id: str, table: str, fmt: str = "ndjson", compress: bool = False) -> Iterator[bytes]:
+    """
+    Streams a whole aggregate table as NDJSON or CSV bytes, optionally gzipped.
+    The caller must validate `table` against EXPORT_TABLES and `fmt` against
+    EXPORT_FORMATS.
+    """
+    store = get_storage()
+    store.flush_counters()  # include buffered total/daily counts
+    batches = store.iter_table(site_id, table, batch_size=_EXPORT_BATCH)
+    chunks = _encode_csv(batches) if fmt == "csv" else _encode_ndjson(batches)
+    return _gzip(chunks) if compress else chunks
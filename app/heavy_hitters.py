@@ -0,0 +1,129 @@
+import math
+import os
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from .database import site_key
+
+# ── Streaming heavy hitters ───────────────────────────────────────────────────
+# Per site, every tracked request is counted by ip_hash and by path in
+# constant memory: a Count-Min Sketch gives an upper-bound estimate for any
+# key, and Space-Saving keeps the HEAVY_HITTER_CAPACITY largest keys for
+# /top-talkers. Counts decay exponentially with HEAVY_HITTER_HALF_LIFE_SECONDS
+# (forward decay: each hit is weighted 2^(age/half_life) against a landmark
+# time, so nothing has to be aged on the hot path), so a steady rate of r
+# requests/second settles at about r * half_life / ln 2.
+# In-memory and per process, like the rolling windows in api.py. A site's two
+# sketches take about 128 KB, so only the HEAVY_HITTER_MAX_SITES most recently
+# tracked sites are kept; a site evicted and seen again starts from zero.
+HEAVY_HITTER_HALF_LIFE_SECONDS = float(os.getenv("HEAVY_HITTER_HALF_LIFE_SECONDS", "300"))
+HEAVY_HITTER_CAPACITY = int(os.getenv("HEAVY_HITTER_CAPACITY", "64"))
+# Decayed hits from one IP at which /track counts its hits as bot traffic
+# (about 4.6 requests/second sustained at the default half-life); 0 disables
+HEAVY_HITTER_THRESHOLD = float(os.getenv("HEAVY_HITTER_THRESHOLD", "2000"))
+HEAVY_HITTER_MAX_SITES = int(os.getenv("HEAVY_HITTER_MAX_SITES", "256"))
+_SKETCH_WIDTH = 2048
+_SKETCH_DEPTH = 4
+_RESCALE_AT = 2.0 ** 40   # renormalise weights long before floats lose precision
+
+
+class HeavyHitters:
+    """Time-decayed Count-Min Sketch plus Space-Saving top-k over one stream of keys."""
+
+    def __init__(self, capacity: int = HEAVY_HITTER_CAPACITY, half_life: float = HEAVY_HITTER_HALF_LIFE_SECONDS,
+                 width: int = _SKETCH_WIDTH, depth: int = _SKETCH_DEPTH):
+        self.capacity = capacity
+        self.half_life = half_life
+        self.width = width
+        self.rows = [array("d", bytes(8 * width)) for _ in range(depth)]
+        self.top: dict = {}        # key -> [weighted count, weighted overestimate]
+        self.landmark = time.time()
+
+    def _weight(self, now: float) -> float:
+        return 2.0 ** ((now - self.landmark) / self.half_life)
+
+    def _rescale(self, now: float):
+        factor = 1.0 / self._weight(now)
+        for row in self.rows:
+            for i in range(self.width):
+                row[i] *= factor
+        for entry in self.top.values():
+            entry[0] *= factor
+            entry[1] *= factor
+        self.landmark = now
+
+    def _cells(self, key: str):
+        h = hash(key)
+        step = (h >> 17) | 1
+        return [(row, (h + i * step) % self.width) for i, row in enumerate(self.rows)]
+
+    def add(self, key: str, now: float) -> float:
+        """Counts one hit for `key` and returns its decayed count, this hit included."""
+        weight = self._weight(now)
+        if weight > _RESCALE_AT:
+            self._rescale(now)
+            weight = 1.0
+
+        estimate = math.inf
+        for row, i in self._cells(key):
+            row[i] += weight
+            estimate = min(estimate, row[i])
+
+        entry = self.top.get(key)
+        if entry is not None:
+            entry[0] += weight
+        elif len(self.top) < self.capacity:
+            self.top[key] = [weight, 0.0]
+        else:
+            # Space-Saving: the new key takes over the smallest counter
+            victim = min(self.top, key=lambda k: self.top[k][0])
+            floor = self.top.pop(victim)[0]
+            self.top[key] = [floor + weight, floor]
+        return estimate / weight
+
+    def most_common(self, n: int, now: float) -> list:
+        """[(key, decayed count, max overcount)] for the n largest tracked keys."""
+        weight = self._weight(now)
+        result = []
+        for key, (count, error) in self.top.items():
+            # Both structures overestimate; the sketch is often the tighter bound
+            hits = min(count, min(row[i] for row, i in self._cells(key)))
+            result.append((key, hits / weight, min(error, hits) / weight))
+        result.sort(key=lambda item: item[1], reverse=True)
+        return result[:n]
+
+
+# site_id -> {"ips": HeavyHitters, "paths": HeavyHitters}, least recently tracked first
+_trackers: OrderedDict = OrderedDict()
+_lock = threading.Lock()
+
+
+def observe(site_id: str, ip_hash: str, path: str) -> float:
+    """Counts a request and returns the IP's decayed hit count."""
+    now = time.time()
+    sid = site_key(site_id)
+    with _lock:
+        trackers = _trackers.get(sid)
+        if trackers is None:
+            trackers = _trackers[sid] = {"ips": HeavyHitters(), "paths": HeavyHitters()}
+            if len(_trackers) > HEAVY_HITTER_MAX_SITES:
+                _trackers.popitem(last=False)
+        else:
+            _trackers.move_to_end(sid)
+        trackers["paths"].add(path, now)
+        return trackers["ips"].add(ip_hash, now)
+
+
+def top_talkers(site_id: str, n: int = 20) -> dict:
+    now = time.time()
+    with _lock:
+        trackers = _trackers.get(site_key(site_id))
+        ips = trackers["ips"].most_common(n, now) if trackers else []
+        paths = trackers["paths"].most_common(n, now) if trackers else []
+    return {
+        "site_id": site_id,
+        "half_life_seconds": HEAVY_HITTER_HALF_LIFE_SECONDS,
+        "ips": [{"ip_hash": k, "hits": round(hits, 1), "max_overcount": round(err, 1)} for k, hits, err in ips],
+        "paths": [{"path": k, "hits": round(hits, 1), "max_overcount": round(err, 1)} for k, hits, err in paths],
+    }
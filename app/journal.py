@@ -0,0 +1,185 @@
+import gzip
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator, Optional
+from .database import DATA_DIR, site_key
+
+logger = logging.getLogger(__name__)
+
+# ── Event journal ─────────────────────────────────────────────────────────────
+# With EVENT_JOURNAL=true every tracked hit is also appended, unclassified, to
+# data/journal/{site_id}/ so the aggregates can be rebuilt after a classifier
+# or heuristic change (`python -m app.replay`). Only what /track sees after IP
+# hashing is kept: timestamp, ip_hash, country, path, raw User-Agent and raw
+# Referer. /track only appends to an in-memory buffer; a flusher thread writes
+# it every JOURNAL_FLUSH_SECONDS as one gzip member per segment, so a segment
+# is a valid concatenated .gz file after every flush.
+# Segments are per writer process (host, pid, start time) and per UTC day, and
+# roll over at JOURNAL_SEGMENT_MB compressed. Lines within one segment are in
+# time order. A killed process loses at most one flush interval.
+# `python -m app.replay --apply` pauses the site it rebuilds by creating
+# data/journal/{site_id}/PAUSED. Each API process picks the marker up on its
+# next flush tick: from then on /track journals the site's hits without
+# counting them, marked "u": 1, and every tick also flushes the hot counters,
+# so nothing is left buffered to land on top of the swapped-in tables. After
+# the resume the replay counts the marked hits it hadn't read before the swap.
+JOURNAL_ENABLED = os.getenv("EVENT_JOURNAL", "false").lower() == "true"
+JOURNAL_DIR = DATA_DIR / "journal"
+JOURNAL_FLUSH_SECONDS = float(os.getenv("JOURNAL_FLUSH_SECONDS", "1"))
+JOURNAL_SEGMENT_BYTES = int(float(os.getenv("JOURNAL_SEGMENT_MB", "64")) * 1024 * 1024)
+
+_WRITER_ID = f"{socket.gethostname()}-{os.getpid()}-{int(time.time())}"
+
+# site_id -> [(ts, ip_hash, country, path, user_agent, referrer, counted)]
+_buffer: dict = {}
+_buffer_lock = threading.Lock()
+# (site_id, day) -> [segment sequence number, path]
+_segments: dict = {}
+_write_lock = threading.Lock()
+
+_flusher_thread: Optional[threading.Thread] = None
+_flusher_stop = threading.Event()
+
+PAUSE_MARKER = "PAUSED"
+_paused: frozenset = frozenset()
+
+
+def record(site_id: str, ts: float, ip_hash: str, country: str, path: str,
+           user_agent: str, referrer: Optional[str], counted: bool = True):
+    """
+    Queues one hit for the journal. A no-op unless EVENT_JOURNAL is enabled.
+    Pass counted=False for a hit left out of the aggregates (site paused).
+    """
+    if not JOURNAL_ENABLED:
+        return
+    event = (ts, ip_hash, country, path, user_agent, referrer, counted)
+    with _buffer_lock:
+        _buffer.setdefault(site_key(site_id), []).append(event)
+
+
+def _segment_path(site_id: str, day: str, size: int) -> Path:
+    """The segment to append `size` bytes to, starting a new one when full."""
+    entry = _segments.get((site_id, day))
+    if entry is None or (entry[1].exists() and entry[1].stat().st_size + size > JOURNAL_SEGMENT_BYTES):
+        seq = entry[0] + 1 if entry else 0
+        directory = JOURNAL_DIR / site_id
+        directory.mkdir(parents=True, exist_ok=True)
+        entry = _segments[(site_id, day)] = [seq, directory / f"{day}.{_WRITER_ID}.{seq:04d}.ndjson.gz"]
+    return entry[1]
+
+
+def flush():
+    """Writes the buffered events to their segments."""
+    with _buffer_lock:
+        pending = dict(_buffer)
+        _buffer.clear()
+    with _write_lock:
+        for site_id, events in pending.items():
+            by_day: dict = {}
+            for event in events:
+                day = datetime.fromtimestamp(event[0], timezone.utc).strftime("%Y-%m-%d")
+                by_day.setdefault(day, []).append(event)
+            for day, day_events in by_day.items():
+                lines = "".join(
+                    json.dumps(
+                        {"t": round(ts, 3), "ip": ip_hash, "cc": country, "p": path, "ua": ua, "r": ref,
+                         **({} if counted else {"u": 1})},
+                        separators=(",", ":"),
+                    ) + "\n"
+                    for ts, ip_hash, country, path, ua, ref, counted in day_events
+                )
+                member = gzip.compress(lines.encode(), compresslevel=6)
+                try:
+                    with open(_segment_path(site_id, day, len(member)), "ab") as f:
+                        f.write(member)
+                except OSError:
+                    logger.exception("journal write failed for site=%s (%d events dropped)", site_id, len(day_events))
+
+
+def _flusher_loop(flush_counters):
+    while not _flusher_stop.wait(JOURNAL_FLUSH_SECONDS):
+        _refresh_paused()
+        flush()
+        if _paused:
+            flush_counters()
+
+
+def start_flusher(flush_counters):
+    """Starts the flush thread; `flush_counters` is called on every tick while a site is paused."""
+    global _flusher_thread
+    if not JOURNAL_ENABLED or (_flusher_thread and _flusher_thread.is_alive()):
+        return
+    _refresh_paused()
+    _flusher_stop.clear()
+    _flusher_thread = threading.Thread(target=_flusher_loop, args=(flush_counters,), name="journal-flush", daemon=True)
+    _flusher_thread.start()
+
+
+def stop_flusher():
+    _flusher_stop.set()
+    if _flusher_thread:
+        _flusher_thread.join(timeout=5)
+    flush()
+
+
+# ── Pausing ──
+
+def _refresh_paused():
+    global _paused
+    if JOURNAL_DIR.exists():
+        _paused = frozenset(p.parent.name for p in JOURNAL_DIR.glob(f"*/{PAUSE_MARKER}"))
+    else:
+        _paused = frozenset()
+
+
+def is_paused(site_id: str) -> bool:
+    """Whether /track should only journal the site's hits (as of this process's last flush tick)."""
+    return bool(_paused) and site_key(site_id) in _paused
+
+
+def pause(site_id: str):
+    directory = JOURNAL_DIR / site_key(site_id)
+    directory.mkdir(parents=True, exist_ok=True)
+    (directory / PAUSE_MARKER).touch()
+
+
+def resume(site_id: str):
+    (JOURNAL_DIR / site_key(site_id) / PAUSE_MARKER).unlink(missing_ok=True)
+
+
+# ── Reading ──
+
+def journal_sites() -> list:
+    return sorted(p.name for p in JOURNAL_DIR.iterdir() if p.is_dir()) if JOURNAL_DIR.exists() else []
+
+
+def list_segments(site_id: str) -> list:
+    """The site's segment files ordered by day, then writer and sequence."""
+    directory = JOURNAL_DIR / site_key(site_id)
+    return sorted(directory.glob("*.ndjson.gz")) if directory.exists() else []
+
+
+def segment_day(path: Path) -> str:
+    return path.name.split(".", 1)[0]
+
+
+def read_segment(path: Path, skip: int = 0) -> Iterator[dict]:
+    """
+    Yields the events of a segment after the first `skip`. A segment still
+    being appended to may end in a partial gzip member; reading stops there.
+    """
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for i, line in enumerate(f):
+                if not line.endswith("\n"):
+                    return
+                if i >= skip:
+                    yield json.loads(line)
+    except (EOFError, gzip.BadGzipFile, json.JSONDecodeError):
+        return
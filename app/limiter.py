@@ -1,4 +1,229 @@
-from slowapi import Limiter
-from slowapi.util import get_remote_address
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+from starlette.requests import HTTPConnection
+from starlette.responses import JSONResponse
+from .database import DATA_DIR, site_key
+from .utils import get_client_ip
 
-limiter = Limiter(key_func=get_remote_address)
+logger = logging.getLogger(__name__)
+
+# ── Rate limiting ─────────────────────────────────────────────────────────────
+# Fixed-window request counters per client IP, checked by an ASGI
+# middleware before the body is read or the route runs, so a refused request
+# costs one counter update (and nothing at all once the client is known to be
+# over its limit for the current window).
+# The client is get_client_ip(): the validated X-Forwarded-For address /track
+# hashes, so visitors behind the reverse proxy don't share one budget.
+# Counters are kept in data/ratelimit.sqlite3 (not *.db, which would make it a
+# site), shared by every worker process on the host; RATE_LIMIT_STORAGE=memory
+# keeps them per process instead.
+# Sites listed in RATE_LIMIT_SITES get their own budget per client IP. Every
+# other request, whatever site_id it names, counts towards the client's one
+# default budget, so rotating ?site_id= doesn't buy fresh requests.
+# The body isn't parsed yet, so the site is taken from the `site_id` query
+# parameter; requests without one get the default limit.
+RATE_LIMIT_TRACK = os.getenv("RATE_LIMIT_TRACK", "60/minute")
+RATE_LIMIT_SITES = os.getenv("RATE_LIMIT_SITES", "")      # "site=limit,site=limit"
+RATE_LIMIT_STORAGE = os.getenv("RATE_LIMIT_STORAGE", "sqlite")
+RATE_LIMIT_DB = DATA_DIR / "ratelimit.sqlite3"
+# Where earlier versions kept the counters, inside the per-site namespace
+_LEGACY_RATE_LIMIT_DB = DATA_DIR / "ratelimit.db"
+RATE_LIMITED_PATHS = {"/track", "/pixel.gif", "/beacon"}
+
+_PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+_PRUNE_SECONDS = 60
+
+
+def parse_limit(text: str) -> Optional[tuple]:
+    """"60/minute" -> (60, 60.0, "60 per 1 minute"); empty or zero -> None (unlimited)."""
+    text = text.strip()
+    if not text:
+        return None
+    count, _, unit = text.partition("/")
+    unit = unit.strip().lower().rstrip("s")
+    if unit not in _PERIODS:
+        raise ValueError(f"Invalid rate limit {text!r}: expected N/second, N/minute, N/hour or N/day")
+    count = int(count)
+    return (count, float(_PERIODS[unit]), f"{count} per 1 {unit}") if count > 0 else None
+
+
+def _parse_site_limits(text: str) -> dict:
+    limits = {}
+    for item in text.split(","):
+        if "=" in item:
+            site, limit = item.split("=", 1)
+            limits[site_key(site.strip())] = parse_limit(limit)
+    return limits
+
+
+DEFAULT_LIMIT = parse_limit(RATE_LIMIT_TRACK)
+SITE_LIMITS = _parse_site_limits(RATE_LIMIT_SITES)
+
+
+def _override(site_id: Optional[str]) -> Optional[str]:
+    """The site's key if RATE_LIMIT_SITES configures it, else None (default budget)."""
+    if site_id is not None:
+        sid = site_key(site_id)
+        if sid in SITE_LIMITS:
+            return sid
+    return None
+
+
+def limit_for(site_id: Optional[str]) -> Optional[tuple]:
+    sid = _override(site_id)
+    return SITE_LIMITS[sid] if sid is not None else DEFAULT_LIMIT
+
+
+class MemoryCounters:
+    """Per-process counters: key -> [window end, count]."""
+
+    def __init__(self):
+        self._counts: dict = {}
+        self._lock = threading.Lock()
+        self._pruned_at = time.time()
+
+    def hit(self, key: str, window_end: float, now: float) -> int:
+        with self._lock:
+            if now - self._pruned_at > _PRUNE_SECONDS:
+                self._counts = {k: v for k, v in self._counts.items() if v[0] > now}
+                self._pruned_at = now
+            entry = self._counts.get(key)
+            if entry is None or entry[0] != window_end:
+                entry = self._counts[key] = [window_end, 0]
+            entry[1] += 1
+            return entry[1]
+
+
+class SQLiteCounters:
+    """
+    Counters in a small SQLite file shared by the processes on this host. One
+    autocommit upsert per request; the counts are disposable, so the file is
+    written without fsync.
+    """
+
+    def __init__(self, path=RATE_LIMIT_DB):
+        path.parent.mkdir(exist_ok=True)
+        self._conn = sqlite3.connect(str(path), isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute("PRAGMA busy_timeout=1000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS hits (key TEXT PRIMARY KEY, window_end REAL, count INTEGER) WITHOUT ROWID"
+        )
+        self._pruned_at = time.time()
+
+    def hit(self, key: str, window_end: float, now: float) -> int:
+        if now - self._pruned_at > _PRUNE_SECONDS:
+            self._conn.execute("DELETE FROM hits WHERE window_end <= ?", (now,))
+            self._pruned_at = now
+        return self._conn.execute("""
+            INSERT INTO hits (key, window_end, count) VALUES (?, ?, 1)
+            ON CONFLICT (key) DO UPDATE SET
+                count = CASE WHEN window_end = excluded.window_end THEN count + 1 ELSE 1 END,
+                window_end = excluded.window_end
+            RETURNING count
+        """, (key, window_end)).fetchone()[0]
+
+
+def _remove_legacy_file():
+    """
+    Deletes data/ratelimit.db if it holds rate limit counters, so it is no
+    longer listed as a site. A real site named "ratelimit" has no hits table.
+    """
+    if not _LEGACY_RATE_LIMIT_DB.exists():
+        return
+    try:
+        conn = sqlite3.connect(f"file:{_LEGACY_RATE_LIMIT_DB}?mode=ro", uri=True)
+        try:
+            is_counters = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'hits'"
+            ).fetchone() is not None
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return
+    if is_counters:
+        for suffix in ("", "-wal", "-shm"):
+            Path(f"{_LEGACY_RATE_LIMIT_DB}{suffix}").unlink(missing_ok=True)
+
+
+# Before startup lists the sites on disk
+_remove_legacy_file()
+
+_counters = None
+_counters_lock = threading.Lock()
+# SQLite counters are used from one thread, off the event loop
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rate-limit")
+# key -> window end, for clients already over their limit in this process
+_blocked: dict = {}
+
+
+def _get_counters():
+    global _counters
+    if _counters is None:
+        with _counters_lock:
+            if _counters is None:
+                _counters = SQLiteCounters() if RATE_LIMIT_STORAGE == "sqlite" else MemoryCounters()
+    return _counters
+
+
+def _hit(key: str, window_end: float, now: float) -> int:
+    try:
+        return _get_counters().hit(key, window_end, now)
+    except sqlite3.Error:
+        # Fail open: a locked or broken counter file must not take /track down
+        logger.warning("rate limit counter update failed", exc_info=True)
+        return 0
+
+
+async def check(site_id: Optional[str], client_ip: str) -> Optional[float]:
+    """Counts a request. Returns None if it is allowed, else the seconds until the window resets."""
+    limit = limit_for(site_id)
+    if limit is None:
+        return None
+    count_limit, period, _ = limit
+    now = time.time()
+    window_end = (now // period + 1) * period
+    key = f"{_override(site_id) or ''}|{client_ip}|{int(period)}"
+
+    if _blocked.get(key) == window_end:
+        return window_end - now
+    if RATE_LIMIT_STORAGE == "sqlite":
+        count = await asyncio.get_running_loop().run_in_executor(_executor, _hit, key, window_end, now)
+    else:
+        count = _hit(key, window_end, now)
+    if count <= count_limit:
+        return None
+    if len(_blocked) > 10000:
+        _blocked.clear()
+    _blocked[key] = window_end
+    return window_end - now
+
+
+class RateLimitMiddleware:
+    """Refuses over-limit requests to RATE_LIMITED_PATHS with 429 before the app sees them."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in RATE_LIMITED_PATHS or scope["method"] == "OPTIONS":
+            return await self.app(scope, receive, send)
+        conn = HTTPConnection(scope)
+        site_id = conn.query_params.get("site_id")
+        retry_after = await check(site_id, get_client_ip(conn))
+        if retry_after is None:
+            return await self.app(scope, receive, send)
+        response = JSONResponse(
+            {"error": f"Rate limit exceeded: {limit_for(site_id)[2]}"},
+            status_code=429,
+            headers={"Retry-After": str(max(1, int(retry_after + 0.999)))},
+        )
+        await response(scope, receive, send)
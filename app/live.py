@@ -0,0 +1,160 @@
+import asyncio
+import os
+import time
+from typing import Optional
+from .database import site_key
+from .serialization import dumps
+
+# ── Live stream ───────────────────────────────────────────────────────────────
+# GET /live holds a Server-Sent Events stream per dashboard. /track publishes
+# each visit into the site's pending delta (a few integer adds, nothing at all
+# for sites nobody is watching); every LIVE_INTERVAL_SECONDS the deltas are
+# encoded once and handed to each subscriber of the site. A subscriber that
+# hasn't sent the previous delta yet (slow client, full socket buffer) has the
+# new one merged into it instead of queued, so every stream gets at most one
+# message per interval and holds at most one pending delta.
+# Visits are published by the process that records them, so a stream only
+# sees the visits handled by its own worker process.
+LIVE_INTERVAL_SECONDS = float(os.getenv("LIVE_INTERVAL_SECONDS", "2"))
+LIVE_HEARTBEAT_SECONDS = float(os.getenv("LIVE_HEARTBEAT_SECONDS", "15"))
+# Streams are closed after this long; the client reconnects with a fresh signature
+LIVE_MAX_SECONDS = float(os.getenv("LIVE_MAX_SECONDS", "3600"))
+LIVE_MAX_SUBSCRIBERS = int(os.getenv("LIVE_MAX_SUBSCRIBERS", "1000"))
+_MAX_PATHS = 200   # distinct paths per delta; views of further paths go to "other_pages"
+_COUNTS = ("visits", "uniques", "unique_today", "bots", "crawlers", "other_pages")
+
+
+def _new_delta() -> dict:
+    return {"t": 0, **dict.fromkeys(_COUNTS, 0), "pages": {}}
+
+
+def _add_pages(delta: dict, pages: dict):
+    own = delta["pages"]
+    for path, views in pages.items():
+        if path in own or len(own) < _MAX_PATHS:
+            own[path] = own.get(path, 0) + views
+        else:
+            delta["other_pages"] += views
+
+
+def _merge(into: dict, delta: dict) -> dict:
+    into["t"] = delta["t"]
+    for key in _COUNTS:
+        into[key] += delta[key]
+    _add_pages(into, delta["pages"])
+    return into
+
+
+class Subscriber:
+    """One open stream: the delta it has yet to send, pre-encoded while it is the shared one."""
+
+    __slots__ = ("site_id", "pending", "body", "ready")
+
+    def __init__(self, site_id: str):
+        self.site_id = site_id
+        self.pending: Optional[dict] = None
+        self.body: Optional[bytes] = None
+        self.ready = asyncio.Event()
+
+    def offer(self, delta: dict, body: bytes):
+        if self.pending is None:
+            # Caught up: keep the shared delta and its encoding as they are
+            self.pending, self.body = delta, body
+        else:
+            # Still sending the last one: coalesce (copying the shared delta first)
+            if self.body is not None:
+                self.pending = _merge(_new_delta(), self.pending)
+                self.body = None
+            _merge(self.pending, delta)
+        self.ready.set()
+
+    def take(self) -> bytes:
+        body = self.body if self.body is not None else dumps(self.pending)
+        self.pending = self.body = None
+        self.ready.clear()
+        return body
+
+
+class LiveHub:
+    """In-process pub/sub from /track to the open /live streams."""
+
+    def __init__(self):
+        self._subscribers: dict = {}   # site_id -> set of Subscriber
+        self._pending: dict = {}       # site_id -> delta collected since the last tick
+        self._ticker: Optional[asyncio.Task] = None
+        self.count = 0
+
+    def subscribe(self, site_id: str) -> Optional[Subscriber]:
+        """A new Subscriber for the site, or None when LIVE_MAX_SUBSCRIBERS are open."""
+        if self.count >= LIVE_MAX_SUBSCRIBERS:
+            return None
+        sid = site_key(site_id)
+        subscriber = Subscriber(sid)
+        self._subscribers.setdefault(sid, set()).add(subscriber)
+        self.count += 1
+        if self._ticker is None or self._ticker.done():
+            self._ticker = asyncio.ensure_future(self._tick())
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        subscribers = self._subscribers.get(subscriber.site_id)
+        if subscribers is None or subscriber not in subscribers:
+            return
+        subscribers.discard(subscriber)
+        self.count -= 1
+        if not subscribers:
+            del self._subscribers[subscriber.site_id]
+            self._pending.pop(subscriber.site_id, None)
+
+    def publish(self, site_id: str, page_path: str, bot_type: str, unique: bool, unique_today: bool):
+        """Adds one recorded visit to the site's next delta, if anyone is watching the site."""
+        if not self._subscribers:
+            return
+        sid = site_key(site_id)
+        if sid not in self._subscribers:
+            return
+        delta = self._pending.get(sid)
+        if delta is None:
+            delta = self._pending[sid] = _new_delta()
+        if bot_type == "bot":
+            delta["bots"] += 1
+        elif bot_type == "crawler":
+            delta["crawlers"] += 1
+        else:
+            delta["visits"] += 1
+            delta["uniques"] += unique
+            delta["unique_today"] += unique_today
+            _add_pages(delta, {page_path: 1})
+
+    async def _tick(self):
+        while self._subscribers:
+            await asyncio.sleep(LIVE_INTERVAL_SECONDS)
+            pending, self._pending = self._pending, {}
+            now = int(time.time())
+            for sid, delta in pending.items():
+                delta["t"] = now
+                body = dumps(delta)
+                for subscriber in self._subscribers.get(sid, ()):
+                    subscriber.offer(delta, body)
+
+    async def stream(self, subscriber: Subscriber):
+        """The SSE body for `subscriber`: deltas, heartbeat comments, closed after LIVE_MAX_SECONDS."""
+        deadline = time.monotonic() + LIVE_MAX_SECONDS
+        try:
+            yield b"retry: 5000\n\n"
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    await asyncio.wait_for(subscriber.ready.wait(), min(LIVE_HEARTBEAT_SECONDS, remaining))
+                except asyncio.TimeoutError:
+                    # Keeps proxies from timing the connection out, and finds closed clients
+                    yield b": ping\n\n"
+                    continue
+                yield b"event: delta\ndata: " + subscriber.take() + b"\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+
+
+live_hub = LiveHub()
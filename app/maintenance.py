@@ -0,0 +1,212 @@
+import logging
+import os
+try:
+    import fcntl
+except ImportError:  # not on Windows; the scheduler then runs in every process
+    fcntl = None
+import random
+import threading
+import time
+from typing import Optional
+from .database import DATA_DIR, get_maintenance_report, list_sites, save_maintenance_report, update_site
+from .storage import get_storage
+from .snapshots import SNAPSHOT_INTERVAL, write_snapshots
+from .read_copies import READ_COPY_SECONDS, refresh_read_copy
+
+logger = logging.getLogger(__name__)
+
+# ── Retention policy ──────────────────────────────────────────────────────────
+# Per-table TTLs in days, measured against each table's own timestamp column.
+# Set a TTL to 0 to keep that table forever. ip_path_counts has no timestamp of
+# its own; its rows are dropped once the owning visitor_activity row expires.
+RETENTION_DAYS = {
+    "visitor_activity": int(os.getenv("RETENTION_VISITOR_ACTIVITY_DAYS", "90")),
+    "unique_visitors": int(os.getenv("RETENTION_UNIQUE_VISITORS_DAYS", "365")),
+    "bot_logs": int(os.getenv("RETENTION_BOT_LOGS_DAYS", "180")),
+    "traffic_anomalies": int(os.getenv("RETENTION_TRAFFIC_ANOMALIES_DAYS", "180")),
+}
+_TIMESTAMP_COLUMNS = {
+    "visitor_activity": "last_seen",
+    "unique_visitors": "last_seen",
+    "bot_logs": "detected_at",
+    "traffic_anomalies": "detected_at",
+}
+_RETENTION_INTERVAL = int(os.getenv("RETENTION_INTERVAL_SECONDS", "86400"))
+
+# Single-view page_stats rows older than this are treated as stray bot hits
+_PAGE_PURGE_DAYS = int(os.getenv("PAGE_PURGE_DAYS", "30"))
+_PAGE_PURGE_INTERVAL = int(os.getenv("PAGE_PURGE_INTERVAL_SECONDS", "86400"))
+
+def run_retention(site_id: str) -> dict:
+    """
+    Applies RETENTION_DAYS to a site's per-visitor tables, then compacts the
+    database. Returns a report with per-table deleted rows and reclaimed bytes.
+
+    Expired unique_visitors rows are added to the 'purged_unique_visitors'
+    counter so they stay in the lifetime unique visitor total in /stats. No
+    record of them is kept, so one who returns is counted again: after
+    expiry, the total is an upper bound.
+    """
+    started = time.time()
+    store = get_storage()
+    bytes_before = store.size_bytes(site_id)
+    deleted = {}
+
+    for table, days in RETENTION_DAYS.items():
+        if days <= 0:
+            continue
+        deleted[table] = store.expire_rows(
+            site_id,
+            table,
+            _TIMESTAMP_COLUMNS[table],
+            days,
+            counter_key="purged_unique_visitors" if table == "unique_visitors" else None,
+        )
+
+    if RETENTION_DAYS["visitor_activity"] > 0:
+        deleted["ip_path_counts"] = store.expire_orphan_paths(site_id)
+
+    compaction = store.compact(site_id)
+    bytes_after = store.size_bytes(site_id)
+
+    report = {
+        "site_id": site_id,
+        "ran_at": int(started),
+        "duration_ms": int((time.time() - started) * 1000),
+        "deleted": deleted,
+        "bytes_before": bytes_before,
+        "bytes_after": bytes_after,
+        "reclaimed_bytes": max(0, bytes_before - bytes_after),
+        **compaction,
+    }
+    save_maintenance_report(site_id, report)
+    update_site(site_id, db_size=bytes_after)
+    logger.info(
+        "retention site=%s deleted=%s reclaimed_bytes=%d",
+        site_id, deleted, report["reclaimed_bytes"],
+    )
+    return report
+
+
+def get_last_report(site_id: str) -> Optional[dict]:
+    return get_maintenance_report(site_id)
+
+
+def purge_stale_pages(site_id: str, days: int = 30) -> int:
+    """
+    Deletes page_stats rows that have view_count = 1 and have not been seen
+    in the last `days` days. Returns the number of rows deleted.
+
+    This is a self-healing cleanup for single-hit bot traffic that slipped
+    through detection. Safe to run repeatedly; idempotent.
+    """
+    try:
+        return get_storage().purge_stale_pages(site_id, days)
+    except Exception:
+        logger.exception("purge_stale_pages failed for site=%s", site_id)
+        return 0
+
+
+# ── Background scheduler ──────────────────────────────────────────────────────
+# A single daemon thread owns every periodic per-site job, keeping deletes and
+# checkpoints off the request path. Each (site, job) pair gets a random phase
+# within _SCHEDULER_JITTER so sites don't all hit the disk at the same moment;
+# jobs run one at a time, so at most one maintenance write is in flight.
+# Every uvicorn worker starts the thread, but only the one holding an exclusive
+# lock on data/maintenance.lock runs jobs. The others retry the lock each tick
+# and take over when the holder exits, since the OS drops the lock with it.
+_SCHEDULER_TICK = 30              # seconds between due-checks
+_SCHEDULER_STARTUP_DELAY = 60     # let the app warm up before the first pass
+_SCHEDULER_JITTER = int(os.getenv("MAINTENANCE_JITTER_SECONDS", "3600"))
+
+# name -> (interval_seconds, func(site_id)); an interval of 0 disables the job
+_jobs: dict = {}
+# (site_id, job_name) -> unix timestamp of the next run
+_next_run: dict = {}
+_scheduler_thread: Optional[threading.Thread] = None
+_scheduler_stop = threading.Event()
+_LEASE_PATH = DATA_DIR / "maintenance.lock"
+_lease_file = None
+
+
+def register_job(name: str, interval: int, func):
+    """Registers a periodic job that the scheduler runs once per site every `interval` seconds."""
+    _jobs[name] = (interval, func)
+
+
+def _run_due_jobs():
+    now = time.time()
+    for site_id in list_sites():
+        for name, (interval, func) in list(_jobs.items()):
+            if interval <= 0:
+                continue
+            key = (site_id, name)
+            due = _next_run.get(key)
+            if due is None:
+                _next_run[key] = now + _SCHEDULER_STARTUP_DELAY + random.uniform(0, min(interval, _SCHEDULER_JITTER))
+                continue
+            if now < due:
+                continue
+            if _scheduler_stop.is_set():
+                return
+            try:
+                func(site_id)
+            except Exception:
+                logger.exception("maintenance job %s failed for site=%s", name, site_id)
+            # Keep the site's phase unless we've fallen a whole interval behind
+            _next_run[key] = max(due + interval, time.time())
+            now = time.time()
+
+
+def _hold_lease() -> bool:
+    """True once this process holds the scheduler lease; kept until stop_scheduler."""
+    global _lease_file
+    if _lease_file is not None or fcntl is None:
+        return True
+    lease_file = open(_LEASE_PATH, "a")
+    try:
+        fcntl.flock(lease_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lease_file.close()
+        return False
+    _lease_file = lease_file
+    logger.info("maintenance scheduler lease taken by pid=%d", os.getpid())
+    return True
+
+
+def _release_lease():
+    global _lease_file
+    if _lease_file is not None:
+        _lease_file.close()  # closing the file drops the lock
+        _lease_file = None
+
+
+def _scheduler_loop():
+    while True:
+        if _hold_lease():
+            _run_due_jobs()
+        if _scheduler_stop.wait(_SCHEDULER_TICK):
+            return
+
+
+def start_scheduler():
+    global _scheduler_thread
+    if _scheduler_thread and _scheduler_thread.is_alive():
+        return
+    _scheduler_stop.clear()
+    _scheduler_thread = threading.Thread(target=_scheduler_loop, name="maintenance", daemon=True)
+    _scheduler_thread.start()
+
+
+def stop_scheduler():
+    _scheduler_stop.set()
+    if _scheduler_thread:
+        _scheduler_thread.join(timeout=5)
+    if not (_scheduler_thread and _scheduler_thread.is_alive()):
+        _release_lease()
+
+
+register_job("retention", _RETENTION_INTERVAL, run_retention)
+register_job("purge_stale_pages", _PAGE_PURGE_INTERVAL, lambda site_id: purge_stale_pages(site_id, days=_PAGE_PURGE_DAYS))
+register_job("snapshots", SNAPSHOT_INTERVAL, write_snapshots)
+register_job("read_copies", READ_COPY_SECONDS, refresh_read_copy)
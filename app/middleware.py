@@ -0,0 +1,65 @@
+import os
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse, PlainTextResponse
+
+# ── Request body size limit ──────────────────────────────────────────────────
+# Checked against Content-Length up front, and counted while the body streams
+# in, so a chunked upload without Content-Length is cut off at the limit
+# instead of being buffered whole.
+MAX_REQUEST_BODY = 64 * 1024  # 64 KB
+
+
+class RequestSizeLimitMiddleware:
+    def __init__(self, app, max_body: int = MAX_REQUEST_BODY):
+        self.app = app
+        self.max_body = max_body
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length:
+            try:
+                if int(content_length) > self.max_body:
+                    return await PlainTextResponse("Request body too large", status_code=413)(scope, receive, send)
+            except ValueError:
+                pass
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body:
+                    # Raised inside the handler's body read; answered as a 413 by Starlette
+                    raise HTTPException(status_code=413, detail="Request body too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+# ── Self-tracking filter ──────────────────────────────────────────────────────
+# Requests originating from the site's own backend proxy carry this header.
+# Tracking them would pollute analytics with server-side fetch noise, so they
+# are answered before the rate limiter, body parsing or any lookup.
+PROXY_SOURCE_HEADER = "x-proxy-source"
+SELF_SOURCE_VALUE = os.getenv("PROXY_SOURCE_VALUE", "followthecredits")
+TRACKING_PATHS = {"/track", "/pixel.gif", "/beacon"}
+
+
+class SelfTrackingFilterMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.skipped = JSONResponse({"status": "ok", "skipped": True})
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] == "http"
+            and scope["path"] in TRACKING_PATHS
+            and Headers(scope=scope).get(PROXY_SOURCE_HEADER, "").strip().lower() == SELF_SOURCE_VALUE
+        ):
+            return await self.skipped(scope, receive, send)
+        await self.app(scope, receive, send)
@@ -0,0 +1,116 @@
+"""
+Copies per-site databases (data/{site_id}.db) into the sharded layout.
+
+    python -m app.migrate --shards 8
+
+Run it from the project root with the API stopped, then start the API with
+STORAGE_LAYOUT=sharded and the same STORAGE_SHARDS. The per-site files are
+left in place; delete them once the sharded deployment is verified.
+
+With --postgres, every site in the current SQLite storage (STORAGE_LAYOUT)
+is copied into the PostgreSQL database at DATABASE_URL instead:
+
+    DATABASE_URL=postgresql://... python -m app.migrate --postgres
+
+then start the API with STORAGE_BACKEND=postgres.
+"""
+import argparse
+import sqlite3
+from .database import (
+    DATA_DIR, SHARD_DIR, SITE_TABLES, STORAGE_SHARDS,
+    _init_file, _sites_on_disk, get_shard_index, get_shard_path,
+)
+from .storage import SQLiteStorage
+
+
+def _columns(conn: sqlite3.Connection, schema: str, table: str) -> list:
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def migrate_site(db_path, shards: int, force: bool = False) -> str:
+    """Copies one per-site file into its shard. Returns a short status line."""
+    site_id = db_path.stem
+    shard_path = get_shard_path(get_shard_index(site_id, shards))
+
+    # Bring the source up to the current schema so it has site_id columns
+    _init_file(db_path, site_id, per_site=True)
+    _init_file(shard_path, site_id, per_site=False)
+
+    conn = sqlite3.connect(str(shard_path))
+    try:
+        conn.execute("PRAGMA busy_timeout=5000")
+        exists = conn.execute(
+            "SELECT 1 FROM general_stats WHERE site_id = ? AND key = 'total_visits'", (site_id,)
+        ).fetchone()
+        if exists and not force:
+            return f"{site_id}: already in {shard_path.name}, skipped (use --force to overwrite)"
+
+        conn.execute("ATTACH DATABASE ? AS src", (str(db_path),))
+        copied = 0
+        for table in SITE_TABLES:
+            dest_columns = set(_columns(conn, "main", table))
+            # bot_logs ids are only unique per file; let the shard assign new ones
+            columns = [
+                c for c in _columns(conn, "src", table)
+                if c in dest_columns and not (table == "bot_logs" and c == "id")
+            ]
+            column_list = ", ".join(columns)
+            if force and table == "bot_logs":
+                conn.execute("DELETE FROM main.bot_logs WHERE site_id = ?", (site_id,))
+            cur = conn.execute(
+                f"INSERT OR REPLACE INTO main.{table} ({column_list}) "
+                f"SELECT {column_list} FROM src.{table} WHERE site_id = ?",
+                (site_id,),
+            )
+            copied += cur.rowcount
+        conn.commit()
+        conn.execute("DETACH DATABASE src")
+    finally:
+        conn.close()
+    return f"{site_id}: {copied} rows -> {shard_path.name}"
+
+
+def migrate_site_to_postgres(site_id: str, source, target, force: bool = False) -> str:
+    """Copies one site from SQLite storage into PostgreSQL. Returns a short status line."""
+    if site_id in target.site_auth_status() and not force:
+        return f"{site_id}: already in PostgreSQL, skipped (use --force to overwrite)"
+    target.delete_site(site_id)
+    copied = 0
+    for table in SITE_TABLES:
+        dest_columns = {name for name, _ in target.table_columns(site_id, table)}
+        # bot_logs ids come from the PostgreSQL sequence
+        columns = [
+            name for name, _ in source.table_columns(site_id, table)
+            if name in dest_columns and not (table == "bot_logs" and name == "id")
+        ]
+        rows = (row for _, batch in source.iter_table(site_id, table, columns) for row in batch)
+        copied += target.load_rows(site_id, table, columns, rows)
+    return f"{site_id}: {copied} rows -> PostgreSQL"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shards", type=int, default=STORAGE_SHARDS, help="number of shard files (default: STORAGE_SHARDS)")
+    parser.add_argument("--force", action="store_true", help="overwrite sites already present in the destination")
+    parser.add_argument("--postgres", action="store_true", help="copy into DATABASE_URL instead of shards")
+    args = parser.parse_args()
+
+    if args.postgres:
+        from .storage_postgres import PostgresStorage  # needs psycopg
+        source, target = SQLiteStorage(), PostgresStorage()
+        try:
+            for site_id in sorted(_sites_on_disk()):
+                print(migrate_site_to_postgres(site_id, source, target, args.force))
+        finally:
+            target.close()
+        print("Done. Start the API with STORAGE_BACKEND=postgres.")
+        return
+
+    SHARD_DIR.mkdir(exist_ok=True)
+    for db_path in sorted(DATA_DIR.glob("*.db")):
+        print(migrate_site(db_path, args.shards, args.force))
+    print(f"Done. Start the API with STORAGE_LAYOUT=sharded STORAGE_SHARDS={args.shards}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,23 +3,34 @@ import numpy as np
 from sklearn.linear_model import LinearRegression
 from sklearn.ensemble import IsolationForest
 from datetime import datetime, timedelta
-from .database import get_db
+from .storage import get_storage
+from .snapshots import read_snapshot
 
 def get_daily_data(site_id: str) -> pd.DataFrame:
     """
-    Fetches daily stats from the database and returns a Pandas DataFrame.
+    Fetches daily stats and returns a Pandas DataFrame.
+    Reads the columnar snapshot when one is fresh, otherwise the database.
     """
-    conn = get_db(site_id)
-    query = "SELECT date, total_visits, unique_visitors FROM daily_stats ORDER BY date ASC"
-    try:
-        df = pd.read_sql_query(query, conn)
-    finally:
-        conn.close()
+    df = read_snapshot(site_id, "daily_stats")
+    if df is not None:
+        snapshot = df.attrs["snapshot"]
+        df = df[['date', 'total_visits', 'unique_visitors']].sort_values('date', ignore_index=True)
+        df.attrs["snapshot"] = snapshot
+    else:
+        rows = get_storage().read_daily_stats(site_id)
+        df = pd.DataFrame.from_records(rows, columns=['date', 'total_visits', 'unique_visitors']).sort_values('date', ignore_index=True)
     
     if not df.empty:
         df['date'] = pd.to_datetime(df['date'])
     return df
 
+def _with_snapshot(result: dict, df: pd.DataFrame) -> dict:
+    """Adds the snapshot's age to `result` when `df` was read from one."""
+    snapshot = df.attrs.get("snapshot")
+    if snapshot:
+        result["snapshot"] = snapshot
+    return result
+
 def generate_forecast(site_id: str, days: int = 7):
     """
     Predicts future traffic using Linear Regression.
@@ -28,10 +39,10 @@ def generate_forecast(site_id: str, days: int = 7):
     
     # Need at least 3 data points to make a reasonable trend line
     if len(df) < 3:
-        return {
+        return _with_snapshot({
             "can_forecast": False,
             "message": "Not enough data. Need at least 3 days of history."
-        }
+        }, df)
     
     # Prepare data for Linear Regression
     # We use ordinal dates (integer representation) as the feature
@@ -63,12 +74,12 @@ def generate_forecast(site_id: str, days: int = 7):
     if slope > 0.5: trend = "increasing"
     elif slope < -0.5: trend = "decreasing"
         
-    return {
+    return _with_snapshot({
         "can_forecast": True,
         "forecast": forecast,
         "trend": trend,
         "slope": round(slope, 2)
-    }
+    }, df)
 
 def generate_summary(site_id: str):
     """
@@ -77,7 +88,7 @@ def generate_summary(site_id: str):
     df = get_daily_data(site_id)
     
     if df.empty:
-        return {"error": "No data available"}
+        return _with_snapshot({"error": "No data available"}, df)
         
     # 1. Basic Averages
     avg_daily_visits = df['total_visits'].mean()
@@ -102,7 +113,7 @@ def generate_summary(site_id: str):
         if previous_week_visits > 0:
             growth_rate = ((current_week_visits - previous_week_visits) / previous_week_visits) * 100
     
-    return {
+    return _with_snapshot({
         "average_daily_visits": round(avg_daily_visits, 1),
         "average_daily_unique": round(avg_daily_unique, 1),
         "busiest_day_of_week": busiest_day,
@@ -111,7 +122,7 @@ def generate_summary(site_id: str):
             "previous_week_visits": int(previous_week_visits),
             "growth_rate_percent": round(growth_rate, 1)
         }
-    }
+    }, df)
 
 def detect_anomalies(site_id: str):
     """
@@ -121,10 +132,10 @@ def detect_anomalies(site_id: str):
     
     # Need reasonable amount of data for anomaly detection
     if len(df) < 5:
-        return {
+        return _with_snapshot({
             "has_anomalies": False,
             "message": "Not enough data. Need at least 5 days of history."
-        }
+        }, df)
         
     # Prepare data
     X = df[['total_visits']]
@@ -152,25 +163,23 @@ def detect_anomalies(site_id: str):
                 "type": type_
             })
             
-    return {
+    return _with_snapshot({
         "has_anomalies": len(results) > 0,
         "anomalies": results
-    }
+    }, df)
 
-def detect_bots(site_id: str):
+def detect_bots(site_id: str, store=None):
     """
     Identifies potential bots using Isolation Forest on visitor activity.
+    `store` is the Storage to read when there is no snapshot (default: the live one).
     """
-    conn = get_db(site_id)
-    try:
-        # Fetch visitor activity
-        query = "SELECT * FROM visitor_activity"
-        df = pd.read_sql_query(query, conn)
-    finally:
-        conn.close()
+    df = read_snapshot(site_id, "visitor_activity")
+    if df is None:
+        columns, rows = (store or get_storage()).read_table(site_id, "visitor_activity")
+        df = pd.DataFrame.from_records(rows, columns=columns)
         
     if len(df) < 10:
-        return {"message": "Not enough data for bot detection (need > 10 visitors)"}
+        return _with_snapshot({"message": "Not enough data for bot detection (need > 10 visitors)"}, df)
         
     # Features for detection:
     # 1. Request Count (High count = suspicious)
@@ -227,7 +236,7 @@ def detect_bots(site_id: str):
             "detected_type": detected_type,
         })
 
-    return {
+    return _with_snapshot({
         "detected_bots_count": len(results),
         "bots": results,
-    }
+    }, df)
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import os
+import time
+from .async_storage import get_async_storage
+from .database import site_key
+
+logger = logging.getLogger(__name__)
+
+# ── Public page view counters ─────────────────────────────────────────────────
+# /page-views is embedded on every article, so it is read about as often as
+# /track is written. Counts are cached per (site, path) for
+# PAGE_VIEWS_CACHE_SECONDS; an entry past that age is still served for up to
+# PAGE_VIEWS_STALE_SECONDS while one background query refreshes it. Concurrent
+# misses for the same key share one query (single flight), and a batch request
+# loads all its missing paths in one query. The same two values are sent as
+# Cache-Control max-age / stale-while-revalidate so a CDN can do the same.
+PAGE_VIEWS_CACHE_SECONDS = float(os.getenv("PAGE_VIEWS_CACHE_SECONDS", "30"))
+PAGE_VIEWS_STALE_SECONDS = float(os.getenv("PAGE_VIEWS_STALE_SECONDS", "300"))
+PAGE_VIEWS_MAX_PATHS = int(os.getenv("PAGE_VIEWS_MAX_PATHS", "100"))
+# Sites with a registered key are only served if listed here (comma-separated)
+PUBLIC_PAGE_VIEWS_SITES = {
+    site_key(s.strip()) for s in os.getenv("PUBLIC_PAGE_VIEWS_SITES", "").split(",") if s.strip()
+}
+_CACHE_MAX_ENTRIES = 100_000
+
+
+class PageViewCache:
+    """TTL cache of page view counts with stale-while-revalidate and single-flight loads."""
+
+    def __init__(self, ttl: float = PAGE_VIEWS_CACHE_SECONDS, stale: float = PAGE_VIEWS_STALE_SECONDS):
+        self.ttl = ttl
+        self.stale = stale
+        self._entries: dict = {}    # (site_id, path) -> (view_count, loaded_at)
+        self._inflight: dict = {}   # (site_id, path) -> Task loading it
+
+    async def get_many(self, site_id: str, paths: list) -> dict:
+        """{path: view_count} for every path in `paths` (0 for unknown paths)."""
+        sid = site_key(site_id)
+        now = time.monotonic()
+        views = {}
+        pending = {}     # path -> task whose result it waits for
+        missing = []     # paths to load, awaited
+        refresh = []     # stale paths to reload in the background
+        for path in paths:
+            key = (sid, path)
+            entry = self._entries.get(key)
+            age = now - entry[1] if entry else None
+            if age is not None and age < self.ttl + self.stale:
+                views[path] = entry[0]
+                if age >= self.ttl and key not in self._inflight:
+                    refresh.append(path)
+            elif key in self._inflight:
+                pending[path] = self._inflight[key]
+            else:
+                missing.append(path)
+
+        if missing or refresh:
+            task = asyncio.ensure_future(self._load(sid, missing + refresh))
+            task.add_done_callback(_log_failure)
+            for path in missing + refresh:
+                self._inflight[(sid, path)] = task
+            for path in missing:
+                pending[path] = task
+
+        for task in set(pending.values()):
+            # Shielded: a client disconnecting must not cancel a load others wait on
+            counts = await asyncio.shield(task)
+            for path, t in pending.items():
+                if t is task:
+                    views[path] = counts.get(path, 0)
+        return {path: views[path] for path in paths}
+
+    async def _load(self, sid: str, paths: list) -> dict:
+        try:
+            counts = await get_async_storage().get_page_views(sid, paths)
+            loaded_at = time.monotonic()
+            if len(self._entries) + len(paths) > _CACHE_MAX_ENTRIES:
+                self._entries = {k: v for k, v in self._entries.items() if loaded_at - v[1] < self.ttl + self.stale}
+                if len(self._entries) + len(paths) > _CACHE_MAX_ENTRIES:
+                    self._entries.clear()
+            for path in paths:
+                self._entries[(sid, path)] = (counts.get(path, 0), loaded_at)
+            return counts
+        finally:
+            for path in paths:
+                if self._inflight.get((sid, path)) is asyncio.current_task():
+                    del self._inflight[(sid, path)]
+
+
+def _log_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("page view load failed: %r", task.exception())
+
+
+page_view_cache = PageViewCache()
+
+# site_id -> (is public, checked_at); key registration is rare, so this follows the same TTL
+_public_sites: dict = {}
+
+
+async def is_public(site_id: str) -> bool:
+    """True if the site's counters may be served without a signature."""
+    sid = site_key(site_id)
+    if sid in PUBLIC_PAGE_VIEWS_SITES:
+        return True
+    now = time.monotonic()
+    entry = _public_sites.get(sid)
+    if entry is None or now - entry[1] >= PAGE_VIEWS_CACHE_SECONDS:
+        if len(_public_sites) > 10_000:
+            _public_sites.clear()
+        entry = _public_sites[sid] = (await get_async_storage().get_public_key(sid) is None, now)
+    return entry[0]
@@ -0,0 +1,110 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+from .database import DATA_DIR, STORAGE_BACKEND, SiteConnection, get_db_path, site_key
+from .storage import SQLiteStorage, get_storage
+
+# ── Read copies ───────────────────────────────────────────────────────────────
+# /stats, /bot-stats and /bots run long read transactions. On the live file
+# those keep WAL checkpoints from completing while ingest continues, so the
+# WAL grows. With READ_COPY_SECONDS set, the maintenance scheduler copies each
+# database file to data/read_copies/ that often, using SQLite's online backup
+# API in steps of READ_COPY_STEP_PAGES pages. Those endpoints read the copy
+# while it is younger than READ_COPY_MAX_AGE_SECONDS, and report its age.
+# The source is read inside one read transaction for the whole copy. Otherwise
+# the backup restarts every time ingest writes, and on a busy site it never
+# finishes. That pins the WAL only for the few seconds the copy takes.
+# The copy's mtime is the moment it was taken, so every worker can tell its age.
+READ_COPY_SECONDS = int(os.getenv("READ_COPY_SECONDS", "0"))   # 0 disables
+READ_COPY_MAX_AGE_SECONDS = int(os.getenv("READ_COPY_MAX_AGE_SECONDS", str(2 * max(READ_COPY_SECONDS, 1))))
+READ_COPY_STEP_PAGES = int(os.getenv("READ_COPY_STEP_PAGES", "256"))
+READ_COPY_STEP_PAUSE_SECONDS = float(os.getenv("READ_COPY_STEP_PAUSE_SECONDS", "0.01"))
+READ_COPY_DIR = DATA_DIR / "read_copies"
+
+_refresh_lock = threading.Lock()
+
+
+def _copy_path(db_path: Path) -> Path:
+    # Per-site files and shards have distinct names
+    return READ_COPY_DIR / db_path.name
+
+
+def refresh_read_copy(site_id: str) -> Optional[float]:
+    """
+    Copies the site's database file, unless a copy younger than half the
+    interval exists (sites sharing a shard share one copy). Returns the time
+    the copy was taken, or None if it was fresh enough already.
+    """
+    if READ_COPY_SECONDS <= 0 or STORAGE_BACKEND != "sqlite":
+        return None
+    db_path = get_db_path(site_id)
+    copy_path = _copy_path(db_path)
+    with _refresh_lock:
+        try:
+            if time.time() - copy_path.stat().st_mtime < READ_COPY_SECONDS / 2:
+                return None
+        except FileNotFoundError:
+            pass
+        READ_COPY_DIR.mkdir(exist_ok=True)
+        tmp_path = copy_path.with_name(copy_path.name + ".tmp")
+        tmp_path.unlink(missing_ok=True)
+
+        get_storage().flush_counters()  # include buffered total/daily counts
+        src = sqlite3.connect(str(db_path))
+        dst = sqlite3.connect(str(tmp_path))
+        try:
+            src.execute("PRAGMA busy_timeout=5000")
+            # Pin one snapshot of the source for every backup step
+            src.execute("BEGIN")
+            src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            taken_at = time.time()
+            src.backup(dst, pages=READ_COPY_STEP_PAGES, sleep=READ_COPY_STEP_PAUSE_SECONDS)
+            src.rollback()
+            # A rollback-journal file can be opened read-only without -wal/-shm files
+            dst.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            dst.close()
+            src.close()
+        os.utime(tmp_path, (taken_at, taken_at))
+        os.replace(tmp_path, copy_path)
+    return taken_at
+
+
+class ReadCopyStorage(SQLiteStorage):
+    """SQLiteStorage whose reads go to the read copies. Never write through it."""
+
+    def _read_db(self, site_id: str) -> SiteConnection:
+        path = _copy_path(get_db_path(site_id))
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False, factory=SiteConnection)
+        conn.site_id = site_key(site_id)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @contextmanager
+    def _pending_counts(self, site_id: str):
+        # Counters were flushed before the copy was taken; later ones aren't in it
+        yield 0, {}
+
+
+_read_copy_storage = ReadCopyStorage()
+
+
+def read_copy(site_id: str) -> Optional[tuple]:
+    """
+    (storage, info) to serve a heavy read from, where info is the
+    {"as_of", "age_seconds"} to report; None to read the live database.
+    """
+    if READ_COPY_SECONDS <= 0 or STORAGE_BACKEND != "sqlite":
+        return None
+    try:
+        as_of = _copy_path(get_db_path(site_id)).stat().st_mtime
+    except FileNotFoundError:
+        return None
+    age = time.time() - as_of
+    if age > READ_COPY_MAX_AGE_SECONDS:
+        return None
+    return _read_copy_storage, {"as_of": int(as_of), "age_seconds": round(age, 1)}
@@ -0,0 +1,340 @@
+"""
+Rebuilds a site's aggregates from the event journal (EVENT_JOURNAL=true).
+
+    python -m app.replay --site example.com             # dry run: print old vs new totals
+    python -m app.replay --site example.com --apply     # swap the rebuilt tables in
+
+Run it after changing the User-Agent / referrer classifiers or the bot
+heuristics (app/utils.py, app/detection.py). Segments are decompressed and
+classified by --workers processes; the visits are then replayed in timestamp
+order through the same checks /track applies, with the event time in place of
+the wall clock.
+
+--apply needs the site's ingest to be quiet while the tables are swapped.
+By default it pauses the site (see app/journal.py): the API processes keep
+journaling its hits, marked as not counted, and flush what they have buffered.
+Once they have, the events journaled meanwhile are folded in, every rebuilt
+table is replaced in one transaction, and the site is resumed. Hits keep
+arriving paused until every process has seen the resume, so once they have
+been flushed, the marked hits journaled after that final read are written
+through Storage.record_visits() like /track would have. With --ingest-stopped
+the site isn't paused; only use it when no API process is running.
+
+link_stats, auth_config and the retention job's purged_unique_visitors
+history are not journaled: clicks are kept as they are, and purged visitors
+come back until the next retention pass expires them.
+
+--apply refuses to run when the site has daily_stats older than the journal
+(the rebuild would drop that history) unless --force is given.
+"""
+import argparse
+import heapq
+import os
+import time
+from datetime import datetime, timezone
+from typing import Optional
+from multiprocessing import Pool
+from .database import site_key
+from .detection import BotDetector
+from .heavy_hitters import HeavyHitters
+from .journal import (
+    JOURNAL_FLUSH_SECONDS, journal_sites, list_segments, pause, read_segment, resume, segment_day,
+)
+from .storage import VisitRecord, get_storage
+from .utils import parse_referrer_batch, parse_user_agent_batch
+
+_BOT_RANK = {"none": 0, "crawler": 1, "bot": 2}
+# A flush tick for every API process to see the pause marker (or its removal),
+# one more to flush what requests already in flight recorded, and a margin for
+# their writes
+_PAUSE_SETTLE_SECONDS = 2 * JOURNAL_FLUSH_SECONDS + 1
+
+
+def _timestamp(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def classify_segment(job: tuple) -> tuple:
+    """
+    Worker: reads a segment from line `skip` on and classifies its events.
+    Returns (path, lines read, ua_infos, events) with events as
+    (t, ip_hash, country, path, index into ua_infos, referrer category, uncounted).
+    """
+    path, skip = job
+    raw = list(read_segment(path, skip))
+    uas = list(dict.fromkeys(e["ua"] for e in raw))
+    ua_index = {ua: i for i, ua in enumerate(uas)}
+    referrers = parse_referrer_batch([e["r"] for e in raw])
+    events = [
+        (e["t"], e["ip"], e["cc"], e["p"], ua_index[e["ua"]], ref, "u" in e)
+        for e, ref in zip(raw, referrers)
+    ]
+    return path, len(raw), parse_user_agent_batch(uas), events
+
+
+class SiteReplay:
+    """The state /track and Storage.record_visit() keep for one site, in memory."""
+
+    def __init__(self, site_id: str):
+        self.site_id = site_id
+        self.detector = BotDetector()
+        self.ips = None                  # HeavyHitters, anchored at the first event
+        self.activity: dict = {}         # ip -> [first_seen, last_seen, request_count, ua_score, bot_type]
+        self.paths: dict = {}            # ip -> {path}
+        self.unique: dict = {}           # ip -> last_seen
+        self.total = 0
+        self.daily: dict = {}            # date -> [visits, uniques]
+        self.countries: dict = {}
+        self.pages: dict = {}            # path -> [views, last_seen]
+        self.devices: dict = {}
+        self.browsers: dict = {}
+        self.os: dict = {}
+        self.referrers: dict = {}
+        self.page_countries: dict = {}   # (path, country) -> views
+        self.bot_daily: dict = {}        # date -> [bot_visits, crawler_visits]
+        self.bot_pages: dict = {}        # path -> [bot_views, crawler_views]
+        self.bot_logs: list = []
+        self.events = 0
+
+    def visit(self, ts: float, ip: str, country: str, page: str, ua: dict, referrer: str,
+              uncounted: bool = False) -> Optional[VisitRecord]:
+        """Applies one hit. For an `uncounted` one, also returns the VisitRecord /track would have written."""
+        self.events += 1
+        if self.ips is None:
+            self.ips = HeavyHitters()
+            self.ips.landmark = ts
+        now = _timestamp(ts)
+        date = now[:10]
+
+        activity = self.activity.get(ip)
+        existing = None if activity is None else {
+            "first_seen": activity[0], "last_seen": activity[1],
+            "request_count": activity[2], "bot_type": activity[4],
+        }
+        bot_type, ua_score, reason, update_activity, flag_visitor = self.detector.check(
+            self.site_id, ip, page, ua["bot_type"], ua["ua_score"],
+            existing, len(self.paths.get(ip, ())), self.ips.add(ip, ts), ts,
+        )
+        record = VisitRecord(
+            ip_hash=ip, page_path=page, country=country, device=ua["device"], browser=ua["browser"],
+            os=ua["os"], referrer=referrer, date=date, bot_type=bot_type, ua_score=ua_score,
+            update_activity=update_activity, flag_visitor=flag_visitor, bot_log_reason=reason,
+        ) if uncounted else None
+
+        if update_activity:
+            visitor_type = bot_type if flag_visitor else "none"
+            if activity is None:
+                self.activity[ip] = [now, now, 1, ua_score, visitor_type]
+            else:
+                activity[1] = now
+                activity[2] += 1
+                activity[3] = ua_score
+                if _BOT_RANK.get(visitor_type, 0) > _BOT_RANK.get(activity[4], 0):
+                    activity[4] = visitor_type
+
+        if bot_type != "none":
+            column = 0 if bot_type == "bot" else 1
+            self.bot_daily.setdefault(date, [0, 0])[column] += 1
+            self.bot_pages.setdefault(page, [0, 0])[column] += 1
+            if reason:
+                self.bot_logs.append((ip, now, reason, ua_score, bot_type))
+            return record
+
+        last_seen = self.unique.get(ip)
+        is_unique_today = last_seen is None or last_seen[:10] != date
+        self.unique[ip] = now
+        self.total += 1
+        counts = self.daily.setdefault(date, [0, 0])
+        counts[0] += 1
+        counts[1] += is_unique_today
+        self.paths.setdefault(ip, set()).add(page)
+        self.countries[country] = self.countries.get(country, 0) + 1
+        page_entry = self.pages.setdefault(page, [0, now])
+        page_entry[0] += 1
+        page_entry[1] = now
+        for table, key in ((self.devices, ua["device"]), (self.browsers, ua["browser"]),
+                           (self.os, ua["os"]), (self.referrers, referrer),
+                           (self.page_countries, (page, country))):
+            table[key] = table.get(key, 0) + 1
+        return record
+
+    def tables(self) -> dict:
+        """{table: (columns, rows)} for Storage.replace_tables(); rows exclude site_id."""
+        return {
+            "unique_visitors": (["ip_hash", "last_seen"], list(self.unique.items())),
+            "visitor_activity": (
+                ["ip_hash", "first_seen", "last_seen", "request_count", "ua_score", "bot_type"],
+                [(ip, *a) for ip, a in self.activity.items()],
+            ),
+            "ip_path_counts": (["ip_hash", "path"], [(ip, p) for ip, paths in self.paths.items() for p in paths]),
+            "daily_stats": (["date", "total_visits", "unique_visitors"], [(d, *c) for d, c in self.daily.items()]),
+            "general_stats": (["key", "value"], [("total_visits", self.total), ("purged_unique_visitors", 0)]),
+            "country_stats": (["country_code", "visitor_count"], list(self.countries.items())),
+            "page_stats": (["page_path", "view_count", "last_seen"], [(p, *v) for p, v in self.pages.items()]),
+            "device_stats": (["device_type", "count"], list(self.devices.items())),
+            "browser_stats": (["browser_family", "count"], list(self.browsers.items())),
+            "os_stats": (["os_family", "count"], list(self.os.items())),
+            "referrer_stats": (["category", "count"], list(self.referrers.items())),
+            "page_country_stats": (
+                ["page_path", "country_code", "view_count"],
+                [(p, c, n) for (p, c), n in self.page_countries.items()],
+            ),
+            "bot_daily_stats": (["date", "bot_visits", "crawler_visits"], [(d, *c) for d, c in self.bot_daily.items()]),
+            "bot_page_stats": (
+                ["page_path", "bot_views", "crawler_views", "total_views"],
+                [(p, b, c, b + c) for p, (b, c) in self.bot_pages.items()],
+            ),
+            "bot_logs": (["ip_hash", "detected_at", "reason", "confidence", "bot_type"], self.bot_logs),
+        }
+
+    def summary(self) -> dict:
+        return {
+            "total_visits": self.total,
+            "unique_visitors": len(self.unique),
+            "bot_visits": sum(b for b, _ in self.bot_daily.values()),
+            "crawler_visits": sum(c for _, c in self.bot_daily.values()),
+            "bot_logs": len(self.bot_logs),
+        }
+
+
+def _visits(uas: list, events: list):
+    for t, ip, cc, p, ua, ref, uncounted in events:
+        yield t, ip, cc, p, uas[ua], ref, uncounted
+
+
+def _replay_batch(replay: SiteReplay, results: list) -> list:
+    """
+    Feeds classified segments to the replay, merged into timestamp order.
+    Returns the VisitRecords of the hits journaled as not counted.
+    """
+    streams = [_visits(uas, events) for _, _, uas, events in results]
+    missed = []
+    for event in heapq.merge(*streams, key=lambda e: e[0]):
+        record = replay.visit(*event)
+        if record is not None:
+            missed.append(record)
+    return missed
+
+
+def replay_site(site_id: str, pool: Pool, consumed: dict) -> SiteReplay:
+    """
+    Replays every journaled event of the site, one day of segments at a time.
+    `consumed` collects the number of lines read per segment.
+    """
+    replay = SiteReplay(site_id)
+    segments = list_segments(site_id)
+    day, batch = None, []
+    for result in pool.imap(classify_segment, [(path, 0) for path in segments]):
+        path = result[0]
+        consumed[path] = result[1]
+        if segment_day(path) != day and batch:
+            _replay_batch(replay, batch)
+            batch = []
+        day = segment_day(path)
+        batch.append(result)
+    if batch:
+        _replay_batch(replay, batch)
+    return replay
+
+
+def _read_new(replay: SiteReplay, pool: Pool, consumed: dict) -> list:
+    """Replays the events appended since the last read; returns the uncounted ones' VisitRecords."""
+    jobs = [(path, consumed.get(path, 0)) for path in list_segments(replay.site_id)]
+    results = [r for r in pool.imap(classify_segment, jobs) if r[1]]
+    for path, lines, _, _ in results:
+        consumed[path] = consumed.get(path, 0) + lines
+    return _replay_batch(replay, results)
+
+
+def catch_up(replay: SiteReplay, pool: Pool, consumed: dict) -> int:
+    """Replays events appended since replay_site() read the journal. Returns how many."""
+    before = replay.events
+    _read_new(replay, pool, consumed)
+    return replay.events - before
+
+
+def count_missed(replay: SiteReplay, pool: Pool, consumed: dict, store) -> int:
+    """
+    After the swap and resume: writes the hits that were journaled while the
+    site was paused but after catch_up() read the journal, which neither the
+    swapped-in tables nor /track counted. Returns how many.
+    """
+    missed = _read_new(replay, pool, consumed)
+    if missed:
+        store.record_visits(replay.site_id, missed)
+        store.flush_counters()
+    return len(missed)
+
+
+def _current_summary(store, site_id: str) -> dict:
+    stats = store.get_stats(site_id)
+    bots = store.get_bot_stats(site_id)
+    return {
+        "total_visits": stats["total_visits"],
+        "unique_visitors": stats["unique_visitors"],
+        "bot_visits": bots["summary"]["total_bot_visits"],
+        "crawler_visits": bots["summary"]["total_crawler_visits"],
+        "bot_logs": store.count_rows(site_id, "bot_logs"),
+    }
+
+
+def _history_start(store, site_id: str):
+    dates = [date for date, _, _ in store.read_daily_stats(site_id)]
+    return min(dates) if dates else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--site", action="append", help="site to rebuild (repeatable; default: every journaled site)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="decompress/classify processes")
+    parser.add_argument("--apply", action="store_true", help="replace the site's tables with the rebuilt ones")
+    parser.add_argument("--force", action="store_true", help="apply even if the journal starts after the site's history")
+    parser.add_argument("--ingest-stopped", action="store_true",
+                        help="with --apply: don't pause the site, because no API process is running")
+    args = parser.parse_args()
+
+    store = get_storage()
+    sites = [site_key(s) for s in args.site] if args.site else journal_sites()
+    try:
+        with Pool(args.workers) as pool:
+            for site_id in sites:
+                segments = list_segments(site_id)
+                if not segments:
+                    print(f"{site_id}: no journal segments, skipped")
+                    continue
+                consumed: dict = {}
+                replay = replay_site(site_id, pool, consumed)
+                print(f"{site_id}: {replay.events} events from {len(segments)} segments")
+                current = _current_summary(store, site_id)
+                for key, value in replay.summary().items():
+                    print(f"  {key:<16} {current[key]:>12} -> {value}")
+                if not args.apply:
+                    continue
+
+                history_start = _history_start(store, site_id)
+                journal_start = segment_day(segments[0])
+                if history_start and history_start < journal_start and not args.force:
+                    print(f"  not applied: daily_stats go back to {history_start}, the journal to {journal_start} "
+                          "(use --force to drop the older history)")
+                    continue
+                if not args.ingest_stopped:
+                    pause(site_id)
+                    print(f"  paused; waiting {_PAUSE_SETTLE_SECONDS:g}s for the API processes to flush")
+                    time.sleep(_PAUSE_SETTLE_SECONDS)
+                try:
+                    print(f"  caught up {catch_up(replay, pool, consumed)} events journaled during the replay")
+                    store.replace_tables(site_id, replay.tables())
+                finally:
+                    if not args.ingest_stopped:
+                        resume(site_id)
+                if not args.ingest_stopped:
+                    print(f"  resumed; waiting {_PAUSE_SETTLE_SECONDS:g}s for the API processes to flush")
+                    time.sleep(_PAUSE_SETTLE_SECONDS)
+                    print(f"  counted {count_missed(replay, pool, consumed, store)} paused hits journaled after the swap")
+                print("  applied")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import json
+from decimal import Decimal
+from typing import Optional
+from fastapi.exceptions import RequestValidationError
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel, ValidationError
+from .compression import COMPRESS_MIN_BYTES, compress, negotiate
+
+# orjson is optional; without it responses are encoded with the json module
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# ── Serialization ─────────────────────────────────────────────────────────────
+# FastAPI runs every returned dict through jsonable_encoder (a recursive copy)
+# and then json.dumps. The read endpoints return FastJSONResponse instead,
+# which encodes the dict once with orjson, and caches keep EncodedJSON bytes
+# so a cached document is not encoded again per request. Ingest bodies are
+# decoded and validated in one pass by pydantic's JSON parser.
+
+
+def _default(value):
+    """Types orjson / json don't encode natively, encoded the way jsonable_encoder does."""
+    if isinstance(value, Decimal):   # PostgreSQL SUM() / numeric columns
+        return int(value) if value.as_tuple().exponent >= 0 else float(value)
+    if hasattr(value, "item"):       # numpy scalars from the ML endpoints
+        return value.item()
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse encoded with dumps(). Return it directly to skip jsonable_encoder."""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+class EncodedJSON:
+    """
+    A JSON document encoded once, for caches that serve it many times. Each
+    compressed variant is made on first request and kept alongside the raw
+    bytes, so later hits cost no encoding or compression at all.
+    """
+
+    __slots__ = ("body", "variants")
+
+    def __init__(self, content):
+        self.body = dumps(content)
+        self.variants: dict = {}   # coding -> compressed body
+
+    def response(self, request: Optional[Request] = None) -> Response:
+        """The document as a Response, compressed for `request`'s Accept-Encoding when worth it."""
+        encoding = None
+        if request is not None and len(self.body) >= COMPRESS_MIN_BYTES:
+            encoding = negotiate(request.headers.get("accept-encoding"))
+        if encoding is None:
+            return Response(self.body, media_type="application/json")
+        body = self.variants.get(encoding)
+        if body is None:
+            body = self.variants[encoding] = compress(self.body, encoding, stored=True)
+        return Response(
+            body,
+            media_type="application/json",
+            headers={"Content-Encoding": encoding, "Vary": "Accept-Encoding"},
+        )
+
+
+def decode_model(model: type, body: bytes, required: bool = False) -> Optional[BaseModel]:
+    """
+    Parses and validates a JSON request body into `model` in one step (no
+    intermediate dict). An empty body gives None unless `required`; invalid
+    input raises the same 422 error FastAPI's own body parsing does.
+    """
+    if not body.strip():
+        if required:
+            raise RequestValidationError([{"type": "missing", "loc": ("body",), "msg": "Field required", "input": None}])
+        return None
+    try:
+        return model.model_validate_json(body)
+    except ValidationError as exc:
+        raise RequestValidationError(
+            [{**error, "loc": ("body", *error["loc"])} for error in exc.errors(include_url=False)]
+        )
+
+
+def json_body_schema(model: type) -> dict:
+    """openapi_extra documenting a body read with decode_model()."""
+    return {"requestBody": {"content": {"application/json": {"schema": model.model_json_schema()}}}}
@@ -0,0 +1,104 @@
+import os
+import time
+from pathlib import Path
+from .database import DATA_DIR, site_key
+from .storage import get_storage
+
+# pyarrow is only needed for columnar snapshots; without it the ML code keeps
+# reading straight from the database.
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+except ImportError:
+    pa = None
+
+# ── Columnar snapshots ────────────────────────────────────────────────────────
+# Per-site Arrow IPC files under data/snapshots/{site_id}/{table}.arrow. They
+# are written uncompressed so readers can memory-map them without copying.
+SNAPSHOT_DIR = DATA_DIR / "snapshots"
+SNAPSHOT_TABLES = (
+    "daily_stats",
+    "visitor_activity",
+    "bot_daily_stats",
+    "country_stats",
+    "page_stats",
+    "device_stats",
+    "browser_stats",
+    "os_stats",
+    "referrer_stats",
+    "bot_page_stats",
+)
+SNAPSHOT_INTERVAL = int(os.getenv("SNAPSHOT_INTERVAL_SECONDS", "3600")) if pa else 0
+# Snapshots older than this are ignored by readers, which fall back to the database
+_SNAPSHOT_MAX_AGE = int(os.getenv("SNAPSHOT_MAX_AGE_SECONDS", str(2 * max(SNAPSHOT_INTERVAL, 1))))
+_SNAPSHOT_BATCH = 10000
+
+
+def _snapshot_path(site_id: str, table: str) -> Path:
+    return SNAPSHOT_DIR / site_key(site_id) / f"{table}.arrow"
+
+
+def _arrow_type(declared: str):
+    declared = (declared or "").upper()
+    if "INT" in declared:
+        return pa.int64()
+    if "REAL" in declared or "FLOA" in declared or "DOUB" in declared:
+        return pa.float64()
+    return pa.string()
+
+
+def _write_table(store, site_id: str, table: str) -> int:
+    """Writes one table to its snapshot file atomically. Returns the row count."""
+    columns = store.table_columns(site_id, table)
+    schema = pa.schema([(name, _arrow_type(declared)) for name, declared in columns])
+
+    path = _snapshot_path(site_id, table)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".arrow.tmp")
+
+    rows_written = 0
+    batches = store.iter_table(site_id, table, schema.names, batch_size=_SNAPSHOT_BATCH)
+    with pa.OSFile(str(tmp_path), "wb") as sink, pa_ipc.new_file(sink, schema) as writer:
+        for _, rows in batches:
+            arrays = [
+                pa.array([row[i] for row in rows], type=field.type)
+                for i, field in enumerate(schema)
+            ]
+            writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+            rows_written += len(rows)
+    os.replace(tmp_path, path)
+    return rows_written
+
+
+def write_snapshots(site_id: str) -> dict:
+    """
+    Writes columnar snapshots of SNAPSHOT_TABLES for a site.
+    Returns {table: row_count}; empty if pyarrow is not installed.
+    """
+    if pa is None:
+        return {}
+    store = get_storage()
+    store.flush_counters()  # include buffered total/daily counts
+    return {table: _write_table(store, site_id, table) for table in SNAPSHOT_TABLES}
+
+
+def read_snapshot(site_id: str, table: str):
+    """
+    Returns a fresh snapshot of `table` as a pandas DataFrame, loaded through a
+    memory map, or None if there is no usable snapshot. The snapshot's
+    {"as_of", "age_seconds"} is in the DataFrame's attrs["snapshot"].
+    """
+    if pa is None:
+        return None
+    path = _snapshot_path(site_id, table)
+    try:
+        as_of = path.stat().st_mtime
+        age = time.time() - as_of
+        if age > _SNAPSHOT_MAX_AGE:
+            return None
+        with pa.memory_map(str(path), "r") as source:
+            df = pa_ipc.open_file(source).read_all().to_pandas()
+    except (FileNotFoundError, pa.ArrowInvalid):
+        return None
+    df.attrs["snapshot"] = {"as_of": int(as_of), "age_seconds": round(age, 1)}
+    return df
@@ -0,0 +1,883 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterator, Optional
+from .counters import COUNTER_FLUSH_SECONDS, hot_counters
+from .database import STORAGE_BACKEND, _read_requires_auth, _sites_on_disk, get_db, get_db_size, init_db, site_key
+
+# ── Storage backends ──────────────────────────────────────────────────────────
+# All reads and writes of analytics data go through a Storage object, so the
+# handlers don't depend on the database engine. STORAGE_BACKEND picks one:
+#   "sqlite":   the per-site / sharded SQLite files (app/database.py). Default.
+#   "postgres": one shared PostgreSQL database (app/storage_postgres.py), so
+#               any number of API nodes can ingest concurrently.
+# The read queries below are portable SQL with "?" placeholders; each backend
+# supplies connections and its own write statements.
+
+# Rows deleted per transaction by retention and page purges
+DELETE_CHUNK_SIZE = int(os.getenv("RETENTION_CHUNK_SIZE", "500"))
+DELETE_CHUNK_PAUSE = 0.05  # seconds between chunks so ingest can take the write lock
+
+
+@dataclass
+class VisitRecord:
+    """One classified page view, as written by Storage.record_visit()."""
+    ip_hash: str
+    page_path: str
+    country: str
+    device: str
+    browser: str
+    os: str
+    referrer: str
+    date: str                              # UTC day, YYYY-MM-DD
+    bot_type: str = "none"
+    ua_score: float = 0.0
+    update_activity: bool = True           # False skips the visitor_activity upsert
+    flag_visitor: bool = True              # False counts a bot visit without marking the visitor a bot
+    bot_log_reason: Optional[str] = None   # set on the first detection of a bot only
+
+
+class Storage:
+    """
+    Repository for analytics data. Site ids are sanitized with site_key()
+    before they reach the database, whatever the backend.
+    """
+
+    # ── Connections (backend-specific) ──
+
+    def _query(self, site_id: str):
+        """Context manager yielding run(sql, params) -> list of rows (mappings) on one connection."""
+        raise NotImplementedError
+
+    def init_site(self, site_id: str):
+        """Creates the site's schema/counters if needed and records it in the registry."""
+        raise NotImplementedError
+
+    def site_auth_status(self) -> dict:
+        """site_id -> requires_auth for every site in the database."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def flush_counters(self):
+        """Writes buffered hot counters (see app/counters.py) to the database."""
+
+    @contextmanager
+    def _pending_counts(self, site_id: str):
+        """Yields (total_visits, {date: (visits, uniques)}) written but not yet flushed."""
+        yield 0, {}
+
+    # ── Auth keys ──
+
+    def get_public_key(self, site_id: str) -> Optional[str]:
+        with self._query(site_id) as run:
+            rows = run(
+                "SELECT key_value FROM auth_config WHERE site_id = ? AND key_type = 'public_key'",
+                (site_key(site_id),),
+            )
+        return rows[0]["key_value"] if rows else None
+
+    def set_public_key(self, site_id: str, public_key_hex: str, replace: bool = False) -> bool:
+        """Stores the site's public key. Returns False if one exists and `replace` is not set."""
+        raise NotImplementedError
+
+    # ── Ingest ──
+
+    def get_visitor_state(self, site_id: str, ip_hash: str) -> tuple:
+        """
+        Returns (activity, path_count): the visitor_activity row as a dict
+        (request_count, first_seen, last_seen, bot_type) or None, and the
+        number of distinct paths recorded for the visitor so far.
+        """
+        sid = site_key(site_id)
+        with self._query(site_id) as run:
+            activity = run(
+                "SELECT request_count, first_seen, last_seen, bot_type FROM visitor_activity "
+                "WHERE site_id = ? AND ip_hash = ?",
+                (sid, ip_hash),
+            )
+            path_count = run(
+                "SELECT COUNT(*) AS cnt FROM ip_path_counts WHERE site_id = ? AND ip_hash = ?",
+                (sid, ip_hash),
+            )
+        return (dict(activity[0]) if activity else None), path_count[0]["cnt"]
+
+    def record_visit(self, site_id: str, visit: VisitRecord) -> tuple:
+        """Writes one visit. Returns (is_unique_ever, is_unique_today); both False for bots."""
+        return self.record_visits(site_id, [visit])[0]
+
+    def record_visits(self, site_id: str, visits: list) -> list:
+        """Writes a batch of visits in one transaction. Returns one uniqueness pair per visit."""
+        raise NotImplementedError
+
+    def record_click(self, site_id: str, url: str):
+        raise NotImplementedError
+
+    def record_anomalies(self, site_id: str, events: list):
+        """Stores anomaly.AnomalyEvents; a bucket already recorded for the metric is kept as is."""
+        raise NotImplementedError
+
+    def flag_high_path_bots(self, site_id: str, threshold: int = 50) -> int:
+        """Marks visitors with more than `threshold` distinct paths as bots. Returns how many."""
+        raise NotImplementedError
+
+    # ── Reads ──
+
+    def get_headline(self, site_id: str, today: str) -> dict:
+        """Headline numbers for one site (used by /overview)."""
+        sid = site_key(site_id)
+        with self._query(site_id) as run:
+            locked = run("SELECT 1 FROM auth_config WHERE site_id = ? AND key_type = 'public_key'", (sid,))
+            with self._pending_counts(site_id) as (pending_total, pending_daily):
+                total = run("SELECT value FROM general_stats WHERE site_id = ? AND key = 'total_visits'", (sid,))
+                daily = run(
+                    "SELECT total_visits, unique_visitors FROM daily_stats WHERE site_id = ? AND date = ?", (sid, today)
+                )
+            bots = run(
+                "SELECT bot_visits, crawler_visits FROM bot_daily_stats WHERE site_id = ? AND date = ?", (sid, today)
+            )
+        pending_today = pending_daily.get(today, (0, 0))
+        return {
+            "id": site_id,
+            "requiresAuth": bool(locked),
+            "total_visits": (total[0]["value"] if total else 0) + pending_total,
+            "visits_today": (daily[0]["total_visits"] if daily else 0) + pending_today[0],
+            "unique_visitors_today": (daily[0]["unique_visitors"] if daily else 0) + pending_today[1],
+            "bots_today": bots[0]["bot_visits"] if bots else 0,
+            "crawlers_today": bots[0]["crawler_visits"] if bots else 0,
+        }
+
+    def get_stats(self, site_id: str, top: Optional[int] = None) -> dict:
+        """
+        Totals, history and every dimension breakdown. With `top`, each
+        breakdown is cut to its `top` largest entries, read in order off the
+        count indexes instead of scanning the whole table.
+        """
+        sid = site_key(site_id)
+        limit, limit_params = (" LIMIT ?", (top,)) if top else ("", ())
+        today_str = datetime.utcnow().strftime("%Y-%m-%d")
+        with self._query(site_id) as run:
+            # Persisted counters plus increments not flushed yet, read together
+            with self._pending_counts(site_id) as (pending_total, pending_daily):
+                row = run("SELECT value FROM general_stats WHERE site_id = ? AND key = 'total_visits'", (sid,))
+                total_visits = (row[0]["value"] if row else 0) + pending_total
+
+                # Last 30 days of history
+                history = {
+                    r["date"]: [r["total_visits"], r["unique_visitors"]] for r in run(
+                        "SELECT date, total_visits, unique_visitors FROM daily_stats "
+                        "WHERE site_id = ? ORDER BY date DESC LIMIT 30",
+                        (sid,),
+                    )
+                }
+            for date, (visits, uniques) in pending_daily.items():
+                counts = history.setdefault(date, [0, 0])
+                counts[0] += visits
+                counts[1] += uniques
+            history = [
+                {"date": date, "total_visits": visits, "unique_visitors": uniques}
+                for date, (visits, uniques) in sorted(history.items(), reverse=True)[:30]
+            ]
+
+            row = run("SELECT COUNT(*) AS count FROM unique_visitors WHERE site_id = ?", (sid,))
+            unique_visitors = row[0]["count"] if row else 0
+
+            # Visitors expired by the retention job still count towards the lifetime total
+            # (twice if they came back since, so it is an upper bound once rows expire)
+            row = run("SELECT value FROM general_stats WHERE site_id = ? AND key = 'purged_unique_visitors'", (sid,))
+            unique_visitors += row[0]["value"] if row else 0
+
+            countries = {
+                r["country_code"]: r["visitor_count"]
+                for r in run("SELECT * FROM country_stats WHERE site_id = ? ORDER BY visitor_count DESC" + limit, (sid, *limit_params))
+            }
+            pages = {
+                r["page_path"]: r["view_count"]
+                for r in run("SELECT * FROM page_stats WHERE site_id = ? ORDER BY view_count DESC" + limit, (sid, *limit_params))
+            }
+            devices = {
+                r["device_type"]: r["count"]
+                for r in run("SELECT * FROM device_stats WHERE site_id = ? ORDER BY count DESC" + limit, (sid, *limit_params))
+            }
+            browsers = {
+                r["browser_family"]: r["count"]
+                for r in run("SELECT * FROM browser_stats WHERE site_id = ? ORDER BY count DESC" + limit, (sid, *limit_params))
+            }
+            os_stats = {
+                r["os_family"]: r["count"]
+                for r in run("SELECT * FROM os_stats WHERE site_id = ? ORDER BY count DESC" + limit, (sid, *limit_params))
+            }
+            referrers = {
+                r["category"]: r["count"]
+                for r in run("SELECT * FROM referrer_stats WHERE site_id = ? ORDER BY count DESC" + limit, (sid, *limit_params))
+            }
+            links = {
+                r["link_url"]: r["click_count"]
+                for r in run("SELECT * FROM link_stats WHERE site_id = ? ORDER BY click_count DESC" + limit, (sid, *limit_params))
+            }
+
+            # Per-page country breakdown
+            page_countries: dict = {}
+            page_filter = (
+                " AND page_path IN (SELECT page_path FROM page_stats WHERE site_id = ? ORDER BY view_count DESC LIMIT ?)"
+                if top else ""
+            )
+            for r in run(
+                "SELECT page_path, country_code, view_count FROM page_country_stats "
+                "WHERE site_id = ?" + page_filter + " ORDER BY page_path, view_count DESC",
+                (sid, sid, top) if top else (sid,),
+            ):
+                page_countries.setdefault(r["page_path"], {})[r["country_code"]] = r["view_count"]
+
+            # Bot summary
+            bt = run(
+                "SELECT SUM(bot_visits) AS bv, SUM(crawler_visits) AS cv FROM bot_daily_stats WHERE site_id = ?",
+                (sid,),
+            )
+            bd = run(
+                "SELECT bot_visits, crawler_visits FROM bot_daily_stats WHERE site_id = ? AND date = ?",
+                (sid, today_str),
+            )
+            bot_summary = {
+                "total_bot_visits": int(bt[0]["bv"] or 0) if bt else 0,
+                "total_crawler_visits": int(bt[0]["cv"] or 0) if bt else 0,
+                "bots_today": bd[0]["bot_visits"] if bd else 0,
+                "crawlers_today": bd[0]["crawler_visits"] if bd else 0,
+            }
+
+        return {
+            "total_visits": total_visits,
+            "unique_visitors": unique_visitors,
+            "history": history,
+            "countries": countries,
+            "pages": pages,
+            "devices": devices,
+            "browsers": browsers,
+            "os": os_stats,
+            "referrers": referrers,
+            "links": links,
+            "page_countries": page_countries,
+            "bot_summary": bot_summary,
+        }
+
+    def get_page_stats(self, site_id: str, path: str) -> dict:
+        sid = site_key(site_id)
+        with self._query(site_id) as run:
+            row = run("SELECT view_count FROM page_stats WHERE site_id = ? AND page_path = ?", (sid, path))
+            countries = run(
+                "SELECT country_code, view_count FROM page_country_stats "
+                "WHERE site_id = ? AND page_path = ? ORDER BY view_count DESC",
+                (sid, path),
+            )
+        return {
+            "path": path,
+            "view_count": row[0]["view_count"] if row else 0,
+            "countries": {r["country_code"]: r["view_count"] for r in countries},
+        }
+
+    def get_page_views(self, site_id: str, paths: list) -> dict:
+        """{path: view_count} for the paths that have views (for /page-views)."""
+        if not paths:
+            return {}
+        placeholders = ", ".join("?" * len(paths))
+        with self._query(site_id) as run:
+            rows = run(
+                f"SELECT page_path, view_count FROM page_stats WHERE site_id = ? AND page_path IN ({placeholders})",
+                (site_key(site_id), *paths),
+            )
+        return {r["page_path"]: r["view_count"] for r in rows}
+
+    def get_bot_overview(self, site_id: str) -> dict:
+        """Recent bot trend, top bot pages, type breakdown and latest detections (for /bots)."""
+        sid = site_key(site_id)
+        with self._query(site_id) as run:
+            trend = run(
+                "SELECT date, bot_visits, crawler_visits FROM bot_daily_stats "
+                "WHERE site_id = ? ORDER BY date DESC LIMIT 30",
+                (sid,),
+            )
+            top_pages = run("""
+                SELECT page_path, bot_views, crawler_views, total_views AS total
+                FROM bot_page_stats
+                WHERE site_id = ?
+                ORDER BY total_views DESC
+                LIMIT 10
+            """, (sid,))
+            breakdown = run(
+                "SELECT bot_type, COUNT(*) AS count FROM bot_logs WHERE site_id = ? GROUP BY bot_type", (sid,)
+            )
+            recent = run("""
+                SELECT ip_hash, detected_at, reason, bot_type, confidence
+                FROM bot_logs
+                WHERE site_id = ?
+                ORDER BY detected_at DESC
+                LIMIT 20
+            """, (sid,))
+        return {
+            "bot_daily_trend": [dict(r) for r in trend],
+            "top_bot_pages": [dict(r) for r in top_pages],
+            "bot_type_breakdown": {r["bot_type"]: r["count"] for r in breakdown},
+            "recent_bot_logs": [dict(r) for r in recent],
+        }
+
+    def get_bot_stats(self, site_id: str) -> dict:
+        """Full bot history (for /bot-stats)."""
+        sid = site_key(site_id)
+        with self._query(site_id) as run:
+            daily = [
+                dict(r) for r in run(
+                    "SELECT date, bot_visits, crawler_visits FROM bot_daily_stats WHERE site_id = ? ORDER BY date DESC",
+                    (sid,),
+                )
+            ]
+            pages = run("""
+                SELECT page_path, bot_views, crawler_views
+                FROM bot_page_stats
+                WHERE site_id = ?
+                ORDER BY total_views DESC
+            """, (sid,))
+            breakdown = run(
+                "SELECT bot_type, COUNT(*) AS count FROM bot_logs WHERE site_id = ? GROUP BY bot_type", (sid,)
+            )
+            recent = run("""
+                SELECT ip_hash, detected_at, reason, bot_type, confidence
+                FROM bot_logs
+                WHERE site_id = ?
+                ORDER BY detected_at DESC
+                LIMIT 50
+            """, (sid,))
+        return {
+            "summary": {
+                "total_bot_visits": sum(r["bot_visits"] for r in daily),
+                "total_crawler_visits": sum(r["crawler_visits"] for r in daily),
+            },
+            "daily": daily,
+            "pages": [dict(r) for r in pages],
+            "type_breakdown": {r["bot_type"]: r["count"] for r in breakdown},
+            "recent_logs": [dict(r) for r in recent],
+        }
+
+    def get_traffic_anomalies(self, site_id: str, limit: int = 50) -> list:
+        """The most recent streaming anomaly events (for /anomalies)."""
+        with self._query(site_id) as run:
+            rows = run("""
+                SELECT bucket_start, metric, type, observed, expected, score
+                FROM traffic_anomalies
+                WHERE site_id = ?
+                ORDER BY detected_at DESC, bucket_start DESC
+                LIMIT ?
+            """, (site_key(site_id), limit))
+        return [dict(r) for r in rows]
+
+    # ── Bulk reads (export, snapshots, ML) ──
+
+    def table_columns(self, site_id: str, table: str) -> list:
+        """[(column_name, declared_type)] for `table`, in table order."""
+        raise NotImplementedError
+
+    def iter_table(self, site_id: str, table: str, columns: Optional[list] = None, batch_size: int = 1000) -> Iterator[tuple]:
+        """
+        Yields (column_names, rows) batches of the site's rows in `table`, so
+        only one batch is held in memory however large the table is. Rows are
+        sequences in column order. `table` and `columns` must be trusted names.
+        """
+        raise NotImplementedError
+
+    def read_table(self, site_id: str, table: str, columns: Optional[list] = None) -> tuple:
+        """Whole-table variant of iter_table(): returns (column_names, list of tuples)."""
+        names, rows = columns, []
+        for names, batch in self.iter_table(site_id, table, columns):
+            rows.extend(tuple(r) for r in batch)
+        if names is None:
+            names = [name for name, _ in self.table_columns(site_id, table)]
+        return names, rows
+
+    def count_rows(self, site_id: str, table: str) -> int:
+        """The number of the site's rows in `table`, which must be a trusted name."""
+        with self._query(site_id) as run:
+            rows = run(f"SELECT COUNT(*) AS count FROM {table} WHERE site_id = ?", (site_key(site_id),))
+        return rows[0]["count"]
+
+    def read_daily_stats(self, site_id: str) -> list:
+        """Every (date, total_visits, unique_visitors), including counts not flushed yet."""
+        with self._pending_counts(site_id) as (_, pending_daily):
+            _, rows = self.read_table(site_id, "daily_stats", ["date", "total_visits", "unique_visitors"])
+        daily = {date: [visits, uniques] for date, visits, uniques in rows}
+        for date, (visits, uniques) in pending_daily.items():
+            counts = daily.setdefault(date, [0, 0])
+            counts[0] += visits
+            counts[1] += uniques
+        return [(date, visits, uniques) for date, (visits, uniques) in daily.items()]
+
+    def replace_tables(self, site_id: str, tables: dict):
+        """
+        Replaces the site's rows in each table of `tables` ({table: (columns,
+        rows)}, rows without site_id) in one transaction (used by
+        `python -m app.replay --apply`). `tables` and `columns` must be trusted names.
+        """
+        raise NotImplementedError
+
+    # ── Maintenance ──
+
+    def expire_rows(self, site_id: str, table: str, column: str, days: int, counter_key: Optional[str] = None) -> int:
+        """
+        Deletes the site's rows whose `column` timestamp is older than `days`,
+        in chunks of DELETE_CHUNK_SIZE. If `counter_key` is given, that
+        general_stats counter is incremented by the deleted row count.
+        """
+        raise NotImplementedError
+
+    def expire_orphan_paths(self, site_id: str) -> int:
+        """Deletes ip_path_counts rows whose visitor_activity row is gone."""
+        raise NotImplementedError
+
+    def purge_stale_pages(self, site_id: str, days: int) -> int:
+        """Deletes page_stats rows with view_count = 1 not seen in `days` days."""
+        raise NotImplementedError
+
+    def compact(self, site_id: str) -> dict:
+        """Returns freed space to the OS where the backend needs it done by hand."""
+        return {"incremental_vacuum": False, "wal_truncated": False}
+
+    def size_bytes(self, site_id: str) -> int:
+        """On-disk size attributable to the site, or 0 if the backend can't tell."""
+        return 0
+
+
+# ── SQLite ────────────────────────────────────────────────────────────────────
+
+def _delete_in_chunks(
+    conn,
+    table: str,
+    predicate: str,
+    params: tuple = (),
+    counter_key: Optional[str] = None,
+    index: Optional[str] = None,
+) -> int:
+    """
+    Deletes rows of `table` matching `predicate` in transactions of at most
+    DELETE_CHUNK_SIZE rows. Candidates are found with a read-only query
+    first, so the write lock is only held for the short DELETE itself.
+
+    Without `index`, candidates come from a resumable scan in rowid order.
+    With `index`, each chunk is read through that index (which must cover the
+    predicate); deleted rows leave the index, so every chunk starts at its front.
+
+    If `counter_key` is given, the site's general_stats row with that key is
+    incremented by the number of deleted rows in the same transaction.
+
+    `predicate` must restrict rows to the connection's site (site_id = ?).
+    """
+    deleted = 0
+    last_rowid = 0
+    while True:
+        if index:
+            query = f"SELECT rowid FROM {table} INDEXED BY {index} WHERE {predicate} LIMIT ?"
+            query_params = (*params, DELETE_CHUNK_SIZE)
+        else:
+            query = f"SELECT rowid FROM {table} WHERE rowid > ? AND {predicate} ORDER BY rowid LIMIT ?"
+            query_params = (last_rowid, *params, DELETE_CHUNK_SIZE)
+        rowids = [r[0] for r in conn.execute(query, query_params).fetchall()]
+        if not rowids:
+            break
+        last_rowid = rowids[-1]
+        placeholders = ",".join("?" * len(rowids))
+        # Re-check the predicate: a row may have been refreshed since the scan
+        cur = conn.execute(
+            f"DELETE FROM {table} WHERE rowid IN ({placeholders}) AND {predicate}",
+            (*rowids, *params),
+        )
+        if counter_key and cur.rowcount:
+            conn.execute(
+                "UPDATE general_stats SET value = value + ? WHERE site_id = ? AND key = ?",
+                (cur.rowcount, conn.site_id, counter_key),
+            )
+        conn.commit()
+        deleted += cur.rowcount
+        if len(rowids) < DELETE_CHUNK_SIZE:
+            break
+        time.sleep(DELETE_CHUNK_PAUSE)
+    return deleted
+
+
+class SQLiteStorage(Storage):
+    """The SQLite files managed by app/database.py (per-site or sharded layout)."""
+
+    def _read_db(self, site_id: str):
+        """Connection for the read methods (see read_copies.ReadCopyStorage)."""
+        return get_db(site_id)
+
+    @contextmanager
+    def _query(self, site_id: str):
+        conn = self._read_db(site_id)
+        try:
+            yield lambda sql, params=(): conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def init_site(self, site_id: str):
+        init_db(site_id)
+
+    def site_auth_status(self) -> dict:
+        on_disk = _sites_on_disk()
+        locked = set()
+        for path in set(on_disk.values()):  # sites sharing a shard share one read
+            locked |= _read_requires_auth(path)
+        return {site_id: site_id in locked for site_id in on_disk}
+
+    def set_public_key(self, site_id: str, public_key_hex: str, replace: bool = False) -> bool:
+        conn = get_db(site_id)
+        try:
+            if replace:
+                conn.execute("""
+                    INSERT INTO auth_config (site_id, key_type, key_value) VALUES (?, 'public_key', ?)
+                    ON CONFLICT DO UPDATE SET key_value = excluded.key_value
+                """, (conn.site_id, public_key_hex))
+                stored = True
+            else:
+                cur = conn.execute(
+                    "INSERT INTO auth_config (site_id, key_type, key_value) VALUES (?, 'public_key', ?) "
+                    "ON CONFLICT DO NOTHING",
+                    (conn.site_id, public_key_hex),
+                )
+                stored = cur.rowcount == 1
+            conn.commit()
+        finally:
+            conn.close()
+        return stored
+
+    def record_visits(self, site_id: str, visits: list) -> list:
+        conn = get_db(site_id)
+        cursor = conn.cursor()
+        try:
+            results = [self._write_visit(cursor, conn.site_id, visit) for visit in visits]
+            # total_visits / daily_stats increments of the human visits
+            total = 0
+            daily: dict = {}
+            for visit, (_, is_unique_today) in zip(visits, results):
+                if visit.bot_type == "none":
+                    total += 1
+                    counts = daily.setdefault(visit.date, [0, 0])
+                    counts[0] += 1
+                    counts[1] += is_unique_today
+            if total and COUNTER_FLUSH_SECONDS <= 0:
+                self._add_counts(conn, total, daily)
+            conn.commit()
+        finally:
+            conn.close()
+        # Added after the commit: a flush holds the stripe lock while it waits
+        # for the write lock, so taking the stripe lock inside the transaction
+        # could deadlock against it.
+        if total and COUNTER_FLUSH_SECONDS > 0:
+            hot_counters.add(site_id, total, daily)
+        return results
+
+    @staticmethod
+    def _add_counts(conn, total: int, daily: dict):
+        conn.execute(
+            "UPDATE general_stats SET value = value + ? WHERE site_id = ? AND key = 'total_visits'",
+            (total, conn.site_id),
+        )
+        conn.executemany("""
+            INSERT INTO daily_stats (site_id, date, total_visits, unique_visitors)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT
+            DO UPDATE SET
+                total_visits = total_visits + excluded.total_visits,
+                unique_visitors = unique_visitors + excluded.unique_visitors
+        """, [(conn.site_id, date, visits, uniques) for date, (visits, uniques) in daily.items()])
+
+    def flush_counters(self):
+        hot_counters.flush(self._flush_site_counts)
+
+    def _flush_site_counts(self, site_id: str, total: int, daily: dict):
+        conn = get_db(site_id)
+        try:
+            self._add_counts(conn, total, daily)
+            conn.commit()
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _pending_counts(self, site_id: str):
+        if COUNTER_FLUSH_SECONDS <= 0:
+            yield 0, {}
+            return
+        with hot_counters.view(site_id) as pending:
+            yield pending
+
+    @staticmethod
+    def _write_visit(cursor, sid: str, v: VisitRecord) -> tuple:
+        is_unique_ever = False
+        is_unique_today = False
+
+        # Update visitor_activity for all visitors (needed for rate tracking)
+        if v.update_activity:
+            cursor.execute("""
+            INSERT INTO visitor_activity (site_id, ip_hash, request_count, ua_score, bot_type)
+            VALUES (?, ?, 1, ?, ?)
+            ON CONFLICT
+            DO UPDATE SET
+                last_seen = CURRENT_TIMESTAMP,
+                request_count = request_count + 1,
+                ua_score = excluded.ua_score,
+                bot_type = CASE
+                    WHEN visitor_activity.bot_type = 'bot' THEN 'bot'
+                    WHEN excluded.bot_type = 'bot' THEN 'bot'
+                    WHEN visitor_activity.bot_type = 'crawler' THEN 'crawler'
+                    WHEN excluded.bot_type = 'crawler' THEN 'crawler'
+                    ELSE 'none'
+                END
+        """, (sid, v.ip_hash, v.ua_score, v.bot_type if v.flag_visitor else "none"))
+
+        if v.bot_type != "none":
+            # ── Bot / Crawler path: separate counters, no human stats touched ──
+            if v.bot_type == "bot":
+                cursor.execute("""
+                    INSERT INTO bot_daily_stats (site_id, date, bot_visits, crawler_visits)
+                    VALUES (?, ?, 1, 0)
+                    ON CONFLICT DO UPDATE SET bot_visits = bot_visits + 1
+                """, (sid, v.date))
+                cursor.execute("""
+                    INSERT INTO bot_page_stats (site_id, page_path, bot_views, crawler_views, total_views)
+                    VALUES (?, ?, 1, 0, 1)
+                    ON CONFLICT DO UPDATE SET bot_views = bot_views + 1, total_views = total_views + 1
+                """, (sid, v.page_path))
+            else:  # crawler
+                cursor.execute("""
+                    INSERT INTO bot_daily_stats (site_id, date, bot_visits, crawler_visits)
+                    VALUES (?, ?, 0, 1)
+                    ON CONFLICT DO UPDATE SET crawler_visits = crawler_visits + 1
+                """, (sid, v.date))
+                cursor.execute("""
+                    INSERT INTO bot_page_stats (site_id, page_path, bot_views, crawler_views, total_views)
+                    VALUES (?, ?, 0, 1, 1)
+                    ON CONFLICT DO UPDATE SET crawler_views = crawler_views + 1, total_views = total_views + 1
+                """, (sid, v.page_path))
+
+            if v.bot_log_reason:
+                cursor.execute(
+                    "INSERT INTO bot_logs (site_id, ip_hash, reason, bot_type, confidence) VALUES (?, ?, ?, ?, ?)",
+                    (sid, v.ip_hash, v.bot_log_reason, v.bot_type, v.ua_score),
+                )
+            return is_unique_ever, is_unique_today
+
+        # ── Human traffic path ──
+        # 1. Unique visitor tracking: last_seen is refreshed on every visit
+        #    (retention expires visitors by it); the date it held before
+        #    tells whether this is the visitor's first visit today.
+        row = cursor.execute(
+            "SELECT substr(last_seen, 1, 10) FROM unique_visitors WHERE site_id = ? AND ip_hash = ?",
+            (sid, v.ip_hash),
+        ).fetchone()
+        if row is None:
+            is_unique_ever = True
+            is_unique_today = True
+            cursor.execute("INSERT INTO unique_visitors (site_id, ip_hash) VALUES (?, ?)", (sid, v.ip_hash))
+        else:
+            is_unique_today = row[0] != v.date
+            cursor.execute(
+                "UPDATE unique_visitors SET last_seen = CURRENT_TIMESTAMP WHERE site_id = ? AND ip_hash = ?",
+                (sid, v.ip_hash),
+            )
+
+        # 2. Dimension and per-IP path counters in one statement; see
+        #    database._HUMAN_HITS_TRIGGER. Totals are left to the caller.
+        cursor.execute(
+            "INSERT INTO human_hits (site_id, ip_hash, page_path, country, device, browser, os, referrer) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (sid, v.ip_hash, v.page_path, v.country, v.device, v.browser, v.os, v.referrer),
+        )
+
+        return is_unique_ever, is_unique_today
+
+    def record_click(self, site_id: str, url: str):
+        conn = get_db(site_id)
+        try:
+            conn.execute("""
+                INSERT INTO link_stats (site_id, link_url, click_count)
+                VALUES (?, ?, 1)
+                ON CONFLICT
+                DO UPDATE SET click_count = click_count + 1
+            """, (conn.site_id, url))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def record_anomalies(self, site_id: str, events: list):
+        conn = get_db(site_id)
+        try:
+            conn.executemany("""
+                INSERT INTO traffic_anomalies (site_id, bucket_start, metric, type, observed, expected, score)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT DO NOTHING
+            """, [(conn.site_id, *e) for e in events])
+            conn.commit()
+        finally:
+            conn.close()
+
+    def flag_high_path_bots(self, site_id: str, threshold: int = 50) -> int:
+        conn = get_db(site_id)
+        sid = conn.site_id
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                SELECT ipc.ip_hash, COUNT(ipc.path) AS path_count
+                FROM ip_path_counts ipc
+                JOIN visitor_activity va ON va.site_id = ipc.site_id AND va.ip_hash = ipc.ip_hash
+                WHERE ipc.site_id = ? AND va.bot_type != 'bot'
+                GROUP BY ipc.ip_hash
+                HAVING path_count > ?
+            """, (sid, threshold))
+            rows = cursor.fetchall()
+            for row in rows:
+                ip_hash = row["ip_hash"]
+                cursor.execute(
+                    "UPDATE visitor_activity SET bot_type = 'bot', ua_score = 1.0 WHERE site_id = ? AND ip_hash = ?",
+                    (sid, ip_hash),
+                )
+                cursor.execute("SELECT id FROM bot_logs WHERE site_id = ? AND ip_hash = ? LIMIT 1", (sid, ip_hash))
+                if not cursor.fetchone():
+                    cursor.execute(
+                        "INSERT INTO bot_logs (site_id, ip_hash, reason, bot_type, confidence) VALUES (?, ?, ?, ?, ?)",
+                        (sid, ip_hash, "Behavioral: High Unique Path Count (retroactive)", "bot", 1.0),
+                    )
+            conn.commit()
+        finally:
+            conn.close()
+        return len(rows)
+
+    def table_columns(self, site_id: str, table: str) -> list:
+        conn = self._read_db(site_id)
+        try:
+            return [(c["name"], c["type"]) for c in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+        finally:
+            conn.close()
+
+    def iter_table(self, site_id: str, table: str, columns: Optional[list] = None, batch_size: int = 1000) -> Iterator[tuple]:
+        conn = self._read_db(site_id)
+        try:
+            select = ", ".join(columns) if columns else "*"
+            cursor = conn.execute(f"SELECT {select} FROM {table} WHERE site_id = ?", (conn.site_id,))
+            names = [d[0] for d in cursor.description]
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield names, rows
+        finally:
+            conn.close()
+
+    def replace_tables(self, site_id: str, tables: dict):
+        conn = get_db(site_id)
+        try:
+            for table, (columns, rows) in tables.items():
+                conn.execute(f"DELETE FROM {table} WHERE site_id = ?", (conn.site_id,))
+                placeholders = ", ".join("?" * (len(columns) + 1))
+                conn.executemany(
+                    f"INSERT INTO {table} (site_id, {', '.join(columns)}) VALUES ({placeholders})",
+                    ((conn.site_id, *row) for row in rows),
+                )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def expire_rows(self, site_id: str, table: str, column: str, days: int, counter_key: Optional[str] = None) -> int:
+        conn = get_db(site_id)
+        try:
+            return _delete_in_chunks(
+                conn,
+                table,
+                f"site_id = ? AND {column} < datetime('now', ?)",
+                (conn.site_id, f"-{days} days"),
+                counter_key=counter_key,
+            )
+        finally:
+            conn.close()
+
+    def expire_orphan_paths(self, site_id: str) -> int:
+        conn = get_db(site_id)
+        try:
+            return _delete_in_chunks(
+                conn,
+                "ip_path_counts",
+                "site_id = ? AND NOT EXISTS (SELECT 1 FROM visitor_activity va "
+                "WHERE va.site_id = ip_path_counts.site_id AND va.ip_hash = ip_path_counts.ip_hash)",
+                (conn.site_id,),
+            )
+        finally:
+            conn.close()
+
+    def purge_stale_pages(self, site_id: str, days: int) -> int:
+        # Both passes walk the partial index idx_page_stale, so only
+        # single-view rows are visited.
+        conn = get_db(site_id)
+        try:
+            deleted = _delete_in_chunks(
+                conn,
+                "page_stats",
+                "site_id = ? AND view_count = 1 AND last_seen IS NULL",
+                (conn.site_id,),
+                index="idx_page_stale",
+            )
+            deleted += _delete_in_chunks(
+                conn,
+                "page_stats",
+                "site_id = ? AND view_count = 1 AND last_seen < datetime('now', ?)",
+                (conn.site_id, f"-{days} days"),
+                index="idx_page_stale",
+            )
+            return deleted
+        finally:
+            conn.close()
+
+    def compact(self, site_id: str) -> dict:
+        """
+        Returns free pages to the filesystem (when the DB uses incremental
+        auto-vacuum) and checkpoints the WAL. The checkpoint is PASSIVE, so
+        ingest is never blocked; only when it copied every frame is the WAL
+        also truncated, and then without waiting on a busy lock.
+        """
+        conn = get_db(site_id)
+        truncated = False
+        try:
+            auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+            if auto_vacuum == 2:  # INCREMENTAL
+                conn.execute("PRAGMA incremental_vacuum").fetchall()
+            busy, log_frames, checkpointed = conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+            if busy == 0 and log_frames == checkpointed:
+                conn.execute("PRAGMA busy_timeout=0")
+                busy, _, _ = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+                truncated = busy == 0
+        finally:
+            conn.close()
+        return {
+            "incremental_vacuum": auto_vacuum == 2,
+            "wal_truncated": truncated,
+        }
+
+    def size_bytes(self, site_id: str) -> int:
+        return get_db_size(site_id)
+
+
+_storage: Optional[Storage] = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> Storage:
+    """The process-wide Storage for STORAGE_BACKEND, created on first use."""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                if STORAGE_BACKEND == "postgres":
+                    # Imported lazily so psycopg is only needed for this backend
+                    from .storage_postgres import PostgresStorage
+                    _storage = PostgresStorage()
+                else:
+                    _storage = SQLiteStorage()
+    return _storage
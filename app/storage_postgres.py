@@ -0,0 +1,583 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+from psycopg.rows import dict_row, tuple_row
+from psycopg_pool import ConnectionPool
+from .database import SITE_TABLES, site_key, update_site
+from .storage import DELETE_CHUNK_PAUSE, DELETE_CHUNK_SIZE, Storage
+
+# ── PostgreSQL backend ────────────────────────────────────────────────────────
+# One database shared by every API node. Same tables and columns as the SQLite
+# schema; timestamps are stored as UTC "YYYY-MM-DD HH:MM:SS" text so values,
+# comparisons and exports are identical across backends.
+DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://localhost/analytics")
+PG_POOL_MIN_SIZE = int(os.getenv("PG_POOL_MIN_SIZE", "1"))
+PG_POOL_MAX_SIZE = int(os.getenv("PG_POOL_MAX_SIZE", "10"))
+
+_NOW = "to_char(now() AT TIME ZONE 'utc', 'YYYY-MM-DD HH24:MI:SS')"
+_CUTOFF = "to_char((now() AT TIME ZONE 'utc') - make_interval(days => %s::int), 'YYYY-MM-DD HH24:MI:SS')"
+# Serialises schema creation when several nodes start at once
+_SCHEMA_LOCK_ID = 0x616E616C
+
+_SCHEMA = (
+    f"""CREATE TABLE IF NOT EXISTS unique_visitors (
+        site_id TEXT NOT NULL,
+        ip_hash TEXT NOT NULL,
+        last_seen TEXT DEFAULT {_NOW},
+        PRIMARY KEY (site_id, ip_hash)
+    )""",
+    """CREATE TABLE IF NOT EXISTS country_stats (
+        site_id TEXT NOT NULL,
+        country_code TEXT NOT NULL,
+        visitor_count BIGINT DEFAULT 0,
+        PRIMARY KEY (site_id, country_code)
+    )""",
+    f"""CREATE TABLE IF NOT EXISTS page_stats (
+        site_id TEXT NOT NULL,
+        page_path TEXT NOT NULL,
+        view_count BIGINT DEFAULT 0,
+        last_seen TEXT DEFAULT {_NOW},
+        PRIMARY KEY (site_id, page_path)
+    )""",
+    """CREATE TABLE IF NOT EXISTS device_stats (
+        site_id TEXT NOT NULL,
+        device_type TEXT NOT NULL,
+        count BIGINT DEFAULT 0,
+        PRIMARY KEY (site_id, device_type)
+    )""",
+    """CREATE TABLE IF NOT EXISTS browser_stats (
+        site_id TEXT NOT NULL,
+        browser_family TEXT NOT NULL,
+        count BIGINT DEFAULT 0,
+        PRIMARY KEY (site_id, browser_family)
+    )""",
+    """CREATE TABLE IF NOT EXISTS os_stats (
+        site_id TEXT NOT NULL,
+        os_family TEXT NOT NULL,
+        count BIGINT DEFAULT 0,
+        PRIMARY KEY (site_id, os_family)
+    )""",
+    """CREATE TABLE IF NOT EXISTS referrer_stats (
+        site_id TEXT NOT NULL,
+        category TEXT NOT NULL,
+        count BIGINT DEFAULT 0,
+        PRIMARY KEY (site_id, category)
+    )""",
+    """CREATE TABLE IF NOT EXISTS daily_stats (
+        site_id TEXT NOT NULL,
+        date TEXT NOT NULL,
+        total_visits BIGINT DEFAULT 0,
+        unique_visitors BIGINT DEFAULT 0,
+        PRIMARY KEY (site_id, date)
+    )""",
+    """CREATE TABLE IF NOT EXISTS link_stats (
+        site_id TEXT NOT NULL,
+        link_url TEXT NOT NULL,
+        click_count BIGINT DEFAULT 0,
+        PRIMARY KEY (site_id, link_url)
+    )""",
+    f"""CREATE TABLE IF NOT EXISTS visitor_activity (
+        site_id TEXT NOT NULL,
+        ip_hash TEXT NOT NULL,
+        first_seen TEXT DEFAULT {_NOW},
+        last_seen TEXT DEFAULT {_NOW},
+        request_count BIGINT DEFAULT 1,
+        ua_score DOUBLE PRECISION DEFAULT 0.0,
+        bot_type TEXT DEFAULT 'none',
+        PRIMARY KEY (site_id, ip_hash)
+    )""",
+    f"""CREATE TABLE IF NOT EXISTS bot_logs (
+        id BIGSERIAL PRIMARY KEY,
+        site_id TEXT NOT NULL,
+        ip_hash TEXT,
+        detected_at TEXT DEFAULT {_NOW},
+        reason TEXT,
+        confidence DOUBLE PRECISION,
+        bot_type TEXT DEFAULT 'bot'
+    )""",
+    f"""CREATE TABLE IF NOT EXISTS auth_config (
+        site_id TEXT NOT NULL,
+        key_type TEXT NOT NULL,
+        key_value TEXT,
+        created_at TEXT DEFAULT {_NOW},
+        PRIMARY KEY (site_id, key_type)
+    )""",
+    """CREATE TABLE IF NOT EXISTS general_stats (
+        site_id TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value BIGINT DEFAULT 0,
+        PRIMARY KEY (site_id, key)
+    )""",
+    """CREATE TABLE IF NOT EXISTS page_country_stats (
+        site_id TEXT NOT NULL,
+        page_path TEXT NOT NULL,
+        country_code TEXT NOT NULL,
+        view_count BIGINT DEFAULT 0,
+        PRIMARY KEY (site_id, page_path, country_code)
+    )""",
+    """CREATE TABLE IF NOT EXISTS bot_daily_stats (
+        site_id TEXT NOT NULL,
+        date TEXT NOT NULL,
+        bot_visits BIGINT DEFAULT 0,
+        crawler_visits BIGINT DEFAULT 0,
+        PRIMARY KEY (site_id, date)
+    )""",
+    """CREATE TABLE IF NOT EXISTS bot_page_stats (
+        site_id TEXT NOT NULL,
+        page_path TEXT NOT NULL,
+        bot_views BIGINT DEFAULT 0,
+        crawler_views BIGINT DEFAULT 0,
+        total_views BIGINT DEFAULT 0,
+        PRIMARY KEY (site_id, page_path)
+    )""",
+    # Databases created before total_views existed: add and backfill it once
+    """DO $$ BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'bot_page_stats' AND column_name = 'total_views'
+        ) THEN
+            ALTER TABLE bot_page_stats ADD COLUMN total_views BIGINT DEFAULT 0;
+            UPDATE bot_page_stats SET total_views = bot_views + crawler_views;
+        END IF;
+    END $$""",
+    """CREATE TABLE IF NOT EXISTS ip_path_counts (
+        site_id TEXT NOT NULL,
+        ip_hash TEXT NOT NULL,
+        path TEXT NOT NULL,
+        PRIMARY KEY (site_id, ip_hash, path)
+    )""",
+    f"""CREATE TABLE IF NOT EXISTS traffic_anomalies (
+        site_id TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        bucket_start TEXT NOT NULL,
+        type TEXT NOT NULL,
+        observed BIGINT,
+        expected DOUBLE PRECISION,
+        score DOUBLE PRECISION,
+        detected_at TEXT DEFAULT {_NOW},
+        PRIMARY KEY (site_id, metric, bucket_start)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_country_count ON country_stats(site_id, visitor_count DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_page_count ON page_stats(site_id, view_count DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_device_count ON device_stats(site_id, count DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_browser_count ON browser_stats(site_id, count DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_os_count ON os_stats(site_id, count DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_referrer_count ON referrer_stats(site_id, count DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_link_count ON link_stats(site_id, click_count DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_activity_requests ON visitor_activity(site_id, request_count DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_page_country ON page_country_stats(site_id, page_path, view_count DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_bot_daily ON bot_daily_stats(site_id, date DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_bot_page_total ON bot_page_stats(site_id, total_views DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_bot_logs_detected ON bot_logs(site_id, detected_at)",
+    "CREATE INDEX IF NOT EXISTS idx_bot_logs_ip ON bot_logs(site_id, ip_hash)",
+    "CREATE INDEX IF NOT EXISTS idx_anomalies_detected ON traffic_anomalies(site_id, detected_at)",
+    "CREATE INDEX IF NOT EXISTS idx_page_stale ON page_stats(site_id, last_seen) WHERE view_count = 1",
+)
+
+_BOT_RANK = {"none": 0, "crawler": 1, "bot": 2}
+
+
+def _add_counts(cur, sid: str, table: str, key_columns: tuple, count_columns: tuple, rows: dict, touch: Optional[str] = None):
+    """
+    Adds `rows` ({key tuple: count tuple}) to the site's counters in `table`
+    with one multi-row upsert over unnest()ed arrays. Keys are sorted so that
+    concurrent batches lock rows in the same order and cannot deadlock.
+    `touch` names a timestamp column to set to now on update.
+    """
+    if not rows:
+        return
+    keys = sorted(rows)
+    arrays = [list(col) for col in zip(*keys)] + [list(col) for col in zip(*(rows[k] for k in keys))]
+    casts = ", ".join(["%s::text[]"] * len(key_columns) + ["%s::bigint[]"] * len(count_columns))
+    updates = [f"{c} = t.{c} + excluded.{c}" for c in count_columns]
+    if touch:
+        updates.append(f"{touch} = {_NOW}")
+    cur.execute(
+        f"INSERT INTO {table} AS t (site_id, {', '.join(key_columns + count_columns)}) "
+        f"SELECT %s::text, * FROM unnest({casts}) "
+        f"ON CONFLICT (site_id, {', '.join(key_columns)}) DO UPDATE SET {', '.join(updates)}",
+        (sid, *arrays),
+    )
+
+
+class PostgresStorage(Storage):
+    """
+    PostgreSQL via a psycopg connection pool. Batches are written with one
+    multi-row upsert per table (and COPY for bot_logs), so a batch costs a
+    fixed number of round trips however many visits it holds.
+    """
+
+    def __init__(self, conninfo: str = DATABASE_URL):
+        self.pool = ConnectionPool(
+            conninfo,
+            min_size=PG_POOL_MIN_SIZE,
+            max_size=PG_POOL_MAX_SIZE,
+            kwargs={"row_factory": dict_row},
+            name="analytics",
+            open=True,
+        )
+        self._sites: set = set()
+        self._sites_lock = threading.Lock()
+        with self.pool.connection() as conn:
+            conn.execute("SELECT pg_advisory_xact_lock(%s)", (_SCHEMA_LOCK_ID,))
+            for statement in _SCHEMA:
+                conn.execute(statement)
+
+    def close(self):
+        self.pool.close()
+
+    def _ensure_site(self, site_id: str) -> str:
+        sid = site_key(site_id)
+        if sid not in self._sites:
+            self.init_site(site_id)
+        return sid
+
+    @contextmanager
+    def _query(self, site_id: str):
+        self._ensure_site(site_id)
+        with self.pool.connection() as conn:
+            yield lambda sql, params=(): conn.execute(sql.replace("?", "%s"), params).fetchall()
+
+    def init_site(self, site_id: str):
+        sid = site_key(site_id)
+        with self.pool.connection() as conn:
+            conn.execute(
+                "INSERT INTO general_stats (site_id, key, value) "
+                "VALUES (%s, 'total_visits', 0), (%s, 'purged_unique_visitors', 0) ON CONFLICT DO NOTHING",
+                (sid, sid),
+            )
+            requires_auth = conn.execute(
+                "SELECT 1 FROM auth_config WHERE site_id = %s AND key_type = 'public_key'", (sid,)
+            ).fetchone() is not None
+        with self._sites_lock:
+            self._sites.add(sid)
+        update_site(site_id, requires_auth=requires_auth)
+
+    def site_auth_status(self) -> dict:
+        with self.pool.connection() as conn:
+            rows = conn.execute("""
+                SELECT g.site_id, EXISTS (
+                    SELECT 1 FROM auth_config a WHERE a.site_id = g.site_id AND a.key_type = 'public_key'
+                ) AS requires_auth
+                FROM general_stats g
+                WHERE g.key = 'total_visits'
+            """).fetchall()
+        return {row["site_id"]: row["requires_auth"] for row in rows}
+
+    def set_public_key(self, site_id: str, public_key_hex: str, replace: bool = False) -> bool:
+        sid = self._ensure_site(site_id)
+        action = "DO UPDATE SET key_value = excluded.key_value" if replace else "DO NOTHING"
+        with self.pool.connection() as conn:
+            cur = conn.execute(
+                "INSERT INTO auth_config (site_id, key_type, key_value) VALUES (%s, 'public_key', %s) "
+                f"ON CONFLICT (site_id, key_type) {action}",
+                (sid, public_key_hex),
+            )
+            return cur.rowcount == 1
+
+    # ── Ingest ──
+
+    def record_visits(self, site_id: str, visits: list) -> list:
+        sid = self._ensure_site(site_id)
+        results = [(False, False)] * len(visits)
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            self._write_activity(cur, sid, visits)
+            humans = [(i, v) for i, v in enumerate(visits) if v.bot_type == "none"]
+            if humans:
+                self._write_humans(cur, sid, humans, results)
+            bots = [v for v in visits if v.bot_type != "none"]
+            if bots:
+                self._write_bots(cur, sid, bots)
+        return results
+
+    @staticmethod
+    def _write_activity(cur, sid: str, visits: list):
+        # One row per visitor: summed request count, latest score, strongest bot flag
+        activity: dict = {}
+        for v in visits:
+            if not v.update_activity:
+                continue
+            bot_type = v.bot_type if v.flag_visitor else "none"
+            entry = activity.get(v.ip_hash)
+            if entry is None:
+                activity[v.ip_hash] = [1, v.ua_score, bot_type]
+            else:
+                entry[0] += 1
+                entry[1] = v.ua_score
+                if _BOT_RANK.get(bot_type, 0) > _BOT_RANK.get(entry[2], 0):
+                    entry[2] = bot_type
+        if not activity:
+            return
+        ips = sorted(activity)
+        cur.execute(f"""
+            INSERT INTO visitor_activity AS va (site_id, ip_hash, request_count, ua_score, bot_type)
+            SELECT %s::text, * FROM unnest(%s::text[], %s::bigint[], %s::float8[], %s::text[])
+            ON CONFLICT (site_id, ip_hash) DO UPDATE SET
+                last_seen = {_NOW},
+                request_count = va.request_count + excluded.request_count,
+                ua_score = excluded.ua_score,
+                bot_type = CASE
+                    WHEN va.bot_type = 'bot' THEN 'bot'
+                    WHEN excluded.bot_type = 'bot' THEN 'bot'
+                    WHEN va.bot_type = 'crawler' THEN 'crawler'
+                    WHEN excluded.bot_type = 'crawler' THEN 'crawler'
+                    ELSE 'none'
+                END
+        """, (
+            sid,
+            ips,
+            [activity[ip][0] for ip in ips],
+            [activity[ip][1] for ip in ips],
+            [activity[ip][2] for ip in ips],
+        ))
+
+    @staticmethod
+    def _write_humans(cur, sid: str, humans: list, results: list):
+        # Unique visitors, one day at a time (a live batch holds a single day).
+        # Existing rows are locked and read before last_seen is refreshed, and
+        # new ones are inserted with DO NOTHING, so a visitor hitting two
+        # nodes at once is counted once. last_seen moves on every visit.
+        daily: dict = {}
+        by_date: dict = {}
+        for i, v in humans:
+            by_date.setdefault(v.date, []).append((i, v))
+        for date in sorted(by_date):
+            group = by_date[date]
+            ips = sorted({v.ip_hash for _, v in group})
+            cur.execute(
+                "SELECT ip_hash, left(last_seen, 10) <> %s AS first_today FROM unique_visitors "
+                "WHERE site_id = %s AND ip_hash = ANY(%s) ORDER BY ip_hash FOR UPDATE",
+                (date, sid, ips),
+            )
+            seen = {row["ip_hash"]: row["first_today"] for row in cur.fetchall()}
+            if seen:
+                cur.execute(
+                    f"UPDATE unique_visitors SET last_seen = {_NOW} WHERE site_id = %s AND ip_hash = ANY(%s)",
+                    (sid, sorted(seen)),
+                )
+            returning = {ip for ip, first_today in seen.items() if first_today}
+            cur.execute(
+                "INSERT INTO unique_visitors (site_id, ip_hash) SELECT %s::text, unnest(%s::text[]) "
+                "ON CONFLICT DO NOTHING RETURNING ip_hash",
+                (sid, [ip for ip in ips if ip not in seen]),
+            )
+            new = {row["ip_hash"] for row in cur.fetchall()}
+            uniques = 0
+            for i, v in group:
+                if v.ip_hash in new:
+                    results[i] = (True, True)
+                    new.discard(v.ip_hash)
+                    uniques += 1
+                elif v.ip_hash in returning:
+                    results[i] = (False, True)
+                    returning.discard(v.ip_hash)
+                    uniques += 1
+            daily[(date,)] = (len(group), uniques)
+
+        countries: dict = {}
+        pages: dict = {}
+        devices: dict = {}
+        browsers: dict = {}
+        oses: dict = {}
+        referrers: dict = {}
+        page_countries: dict = {}
+        paths: set = set()
+        for _, v in humans:
+            for counter, key in (
+                (countries, (v.country,)),
+                (pages, (v.page_path,)),
+                (devices, (v.device,)),
+                (browsers, (v.browser,)),
+                (oses, (v.os,)),
+                (referrers, (v.referrer,)),
+                (page_countries, (v.page_path, v.country)),
+            ):
+                counter[key] = (counter.get(key, (0,))[0] + 1,)
+            paths.add((v.ip_hash, v.page_path))
+
+        cur.execute(
+            "UPDATE general_stats SET value = value + %s WHERE site_id = %s AND key = 'total_visits'",
+            (len(humans), sid),
+        )
+        _add_counts(cur, sid, "daily_stats", ("date",), ("total_visits", "unique_visitors"), daily)
+        _add_counts(cur, sid, "country_stats", ("country_code",), ("visitor_count",), countries)
+        _add_counts(cur, sid, "page_stats", ("page_path",), ("view_count",), pages, touch="last_seen")
+        _add_counts(cur, sid, "device_stats", ("device_type",), ("count",), devices)
+        _add_counts(cur, sid, "browser_stats", ("browser_family",), ("count",), browsers)
+        _add_counts(cur, sid, "os_stats", ("os_family",), ("count",), oses)
+        _add_counts(cur, sid, "referrer_stats", ("category",), ("count",), referrers)
+        _add_counts(cur, sid, "page_country_stats", ("page_path", "country_code"), ("view_count",), page_countries)
+
+        ordered = sorted(paths)
+        cur.execute(
+            "INSERT INTO ip_path_counts (site_id, ip_hash, path) "
+            "SELECT %s::text, * FROM unnest(%s::text[], %s::text[]) ON CONFLICT DO NOTHING",
+            (sid, [p[0] for p in ordered], [p[1] for p in ordered]),
+        )
+
+    @staticmethod
+    def _write_bots(cur, sid: str, bots: list):
+        days: dict = {}
+        pages: dict = {}
+        for v in bots:
+            hit = (1, 0) if v.bot_type == "bot" else (0, 1)
+            prev = days.get((v.date,), (0, 0))
+            days[(v.date,)] = (prev[0] + hit[0], prev[1] + hit[1])
+            prev = pages.get((v.page_path,), (0, 0, 0))
+            pages[(v.page_path,)] = (prev[0] + hit[0], prev[1] + hit[1], prev[2] + 1)
+        _add_counts(cur, sid, "bot_daily_stats", ("date",), ("bot_visits", "crawler_visits"), days)
+        _add_counts(cur, sid, "bot_page_stats", ("page_path",), ("bot_views", "crawler_views", "total_views"), pages)
+
+        logs = [(sid, v.ip_hash, v.bot_log_reason, v.bot_type, v.ua_score) for v in bots if v.bot_log_reason]
+        if logs:
+            with cur.copy("COPY bot_logs (site_id, ip_hash, reason, bot_type, confidence) FROM STDIN") as copy:
+                for row in logs:
+                    copy.write_row(row)
+
+    def record_click(self, site_id: str, url: str):
+        sid = self._ensure_site(site_id)
+        with self.pool.connection() as conn:
+            conn.execute("""
+                INSERT INTO link_stats AS t (site_id, link_url, click_count)
+                VALUES (%s, %s, 1)
+                ON CONFLICT (site_id, link_url)
+                DO UPDATE SET click_count = t.click_count + 1
+            """, (sid, url))
+
+    def record_anomalies(self, site_id: str, events: list):
+        sid = self._ensure_site(site_id)
+        with self.pool.connection() as conn:
+            conn.cursor().executemany("""
+                INSERT INTO traffic_anomalies (site_id, bucket_start, metric, type, observed, expected, score)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT DO NOTHING
+            """, [(sid, *e) for e in events])
+
+    def flag_high_path_bots(self, site_id: str, threshold: int = 50) -> int:
+        sid = self._ensure_site(site_id)
+        with self.pool.connection() as conn:
+            ips = [row["ip_hash"] for row in conn.execute("""
+                SELECT ipc.ip_hash
+                FROM ip_path_counts ipc
+                JOIN visitor_activity va ON va.site_id = ipc.site_id AND va.ip_hash = ipc.ip_hash
+                WHERE ipc.site_id = %s AND va.bot_type != 'bot'
+                GROUP BY ipc.ip_hash
+                HAVING COUNT(ipc.path) > %s
+                ORDER BY ipc.ip_hash
+            """, (sid, threshold)).fetchall()]
+            if ips:
+                conn.execute(
+                    "UPDATE visitor_activity SET bot_type = 'bot', ua_score = 1.0 WHERE site_id = %s AND ip_hash = ANY(%s)",
+                    (sid, ips),
+                )
+                conn.execute("""
+                    INSERT INTO bot_logs (site_id, ip_hash, reason, bot_type, confidence)
+                    SELECT %s::text, ip, 'Behavioral: High Unique Path Count (retroactive)', 'bot', 1.0
+                    FROM unnest(%s::text[]) AS ip
+                    WHERE NOT EXISTS (SELECT 1 FROM bot_logs b WHERE b.site_id = %s AND b.ip_hash = ip)
+                """, (sid, ips, sid))
+        return len(ips)
+
+    # ── Bulk reads ──
+
+    def table_columns(self, site_id: str, table: str) -> list:
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                "SELECT column_name, data_type FROM information_schema.columns "
+                "WHERE table_schema = current_schema() AND table_name = %s ORDER BY ordinal_position",
+                (table,),
+            ).fetchall()
+        return [(row["column_name"], row["data_type"]) for row in rows]
+
+    def iter_table(self, site_id: str, table: str, columns: Optional[list] = None, batch_size: int = 1000) -> Iterator[tuple]:
+        sid = self._ensure_site(site_id)
+        select = ", ".join(columns) if columns else "*"
+        # A named (server-side) cursor, so rows are fetched from the server batch by batch
+        with self.pool.connection() as conn:
+            with conn.cursor(name=f"iter_{table}", row_factory=tuple_row) as cur:
+                cur.itersize = batch_size
+                cur.execute(f"SELECT {select} FROM {table} WHERE site_id = %s", (sid,))
+                names = [d.name for d in cur.description]
+                while True:
+                    rows = cur.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield names, rows
+
+    def delete_site(self, site_id: str):
+        """Removes every row of a site (used by `python -m app.migrate --postgres --force`)."""
+        sid = site_key(site_id)
+        with self.pool.connection() as conn:
+            for table in SITE_TABLES:
+                conn.execute(f"DELETE FROM {table} WHERE site_id = %s", (sid,))
+        with self._sites_lock:
+            self._sites.discard(sid)
+
+    def load_rows(self, site_id: str, table: str, columns: list, rows) -> int:
+        """Appends `rows` to `table` with COPY (used by `python -m app.migrate --postgres`)."""
+        sid = site_key(site_id)
+        count = 0
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            with cur.copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row([sid if name == "site_id" else value for name, value in zip(columns, row)])
+                    count += 1
+        return count
+
+    def replace_tables(self, site_id: str, tables: dict):
+        sid = self._ensure_site(site_id)
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            for table, (columns, rows) in tables.items():
+                cur.execute(f"DELETE FROM {table} WHERE site_id = %s", (sid,))
+                with cur.copy(f"COPY {table} (site_id, {', '.join(columns)}) FROM STDIN") as copy:
+                    for row in rows:
+                        copy.write_row((sid, *row))
+
+    # ── Maintenance ──
+
+    def _delete_in_chunks(self, sid: str, table: str, predicate: str, params: tuple, counter_key: Optional[str] = None) -> int:
+        """Deletes matching rows DELETE_CHUNK_SIZE at a time, one short transaction per chunk."""
+        deleted = 0
+        while True:
+            with self.pool.connection() as conn:
+                cur = conn.execute(
+                    f"DELETE FROM {table} WHERE ctid IN (SELECT ctid FROM {table} WHERE {predicate} LIMIT %s)",
+                    (*params, DELETE_CHUNK_SIZE),
+                )
+                if counter_key and cur.rowcount:
+                    conn.execute(
+                        "UPDATE general_stats SET value = value + %s WHERE site_id = %s AND key = %s",
+                        (cur.rowcount, sid, counter_key),
+                    )
+            deleted += cur.rowcount
+            if cur.rowcount < DELETE_CHUNK_SIZE:
+                break
+            time.sleep(DELETE_CHUNK_PAUSE)
+        return deleted
+
+    def expire_rows(self, site_id: str, table: str, column: str, days: int, counter_key: Optional[str] = None) -> int:
+        sid = self._ensure_site(site_id)
+        return self._delete_in_chunks(
+            sid, table, f"site_id = %s AND {column} < {_CUTOFF}", (sid, days), counter_key=counter_key
+        )
+
+    def expire_orphan_paths(self, site_id: str) -> int:
+        sid = self._ensure_site(site_id)
+        return self._delete_in_chunks(
+            sid,
+            "ip_path_counts",
+            "site_id = %s AND NOT EXISTS (SELECT 1 FROM visitor_activity va "
+            "WHERE va.site_id = ip_path_counts.site_id AND va.ip_hash = ip_path_counts.ip_hash)",
+            (sid,),
+        )
+
+    def purge_stale_pages(self, site_id: str, days: int) -> int:
+        sid = self._ensure_site(site_id)
+        return self._delete_in_chunks(
+            sid,
+            "page_stats",
+            f"site_id = %s AND view_count = 1 AND (last_seen IS NULL OR last_seen < {_CUTOFF})",
+            (sid, days),
+        )
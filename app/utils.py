@@ -1,4 +1,6 @@
 import hashlib
+import ipaddress
+import logging
 import os
 import re
 from pathlib import Path
@@ -6,6 +8,8 @@ from urllib.parse import urlparse
 import geoip2.database
 from user_agents import parse
 
+logger = logging.getLogger(__name__)
+
 # Salt for hashing IP addresses. 
 # Created once and stored to maintain consistency across restarts.
 SALT_FILE = Path("data/.salt")
@@ -30,6 +34,68 @@ def hash_ip(ip_address: str) -> str:
     """
     return hashlib.sha256(SALT + ip_address.encode()).hexdigest()
 
+# Reverse proxies whose X-Forwarded-For is believed (comma-separated IPs/CIDRs).
+# Any other peer can put whatever it likes in the header, so for them the
+# socket address is the client. Unset keeps the old behaviour (the left-most
+# X-Forwarded-For entry from any peer), which clients can spoof.
+_TRUSTED_PROXIES_ENV = os.getenv("TRUSTED_PROXIES")
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(entry.strip(), strict=False)
+    for entry in (_TRUSTED_PROXIES_ENV or "").split(",")
+    if entry.strip()
+]
+if _TRUSTED_PROXIES_ENV is None:
+    logger.warning(
+        "TRUSTED_PROXIES is not set: X-Forwarded-For is taken from any client. "
+        "Set it to your reverse proxy's address (see API_DOCUMENTATION.md)."
+    )
+
+
+def _is_trusted_proxy(address) -> bool:
+    return any(address in network for network in TRUSTED_PROXIES)
+
+
+def _legacy_client_ip(request, peer: str) -> str:
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded:
+        raw = forwarded.split(",")[0].strip()
+        try:
+            ipaddress.ip_address(raw)
+            return raw
+        except ValueError:
+            pass
+    return peer
+
+
+def get_client_ip(request) -> str:
+    """
+    The client's IP: the socket peer, or, when the peer is in TRUSTED_PROXIES,
+    the right-most X-Forwarded-For hop that isn't a trusted proxy itself.
+    Takes a Request or any other starlette HTTPConnection (the rate limiter builds one from the ASGI scope).
+    """
+    peer = (request.client.host if request.client else None) or "0.0.0.0"
+    if _TRUSTED_PROXIES_ENV is None:
+        return _legacy_client_ip(request, peer)
+    try:
+        trusted = _is_trusted_proxy(ipaddress.ip_address(peer))
+    except ValueError:
+        trusted = False
+    if not trusted:
+        return peer
+
+    client = peer
+    hops = ",".join(request.headers.getlist("x-forwarded-for")).split(",")
+    for hop in reversed(hops):
+        hop = hop.strip()
+        try:
+            address = ipaddress.ip_address(hop)
+        except ValueError:
+            break  # Unparseable: nothing to its left can be trusted either
+        client = hop
+        if not _is_trusted_proxy(address):
+            break
+    return client
+
 def get_country_from_ip(ip_address: str) -> str:
     """
     Resolves an IP address to a country code using GeoLite2.
@@ -129,31 +195,66 @@ def parse_user_agent_info(ua_string: str) -> dict:
         "ua_score": 0.0,
     }
 
+# Referrer hostnames are matched by substring against each list, search
+# engines first. One compiled alternation per list replaces the per-call scans.
+_SEARCH_ENGINES = (
+    "google.", "bing.", "yahoo.", "duckduckgo.", "baidu.", "yandex.", "ask.com", "aol.com", "ecosia.org",
+)
+_SOCIAL_MEDIA = (
+    "facebook.", "twitter.", "t.co", "instagram.", "linkedin.", "pinterest.", "reddit.", "tiktok.", "youtube.", "whatsapp.",
+)
+_SEARCH_ENGINE_RE = re.compile("|".join(map(re.escape, _SEARCH_ENGINES)))
+_SOCIAL_MEDIA_RE = re.compile("|".join(map(re.escape, _SOCIAL_MEDIA)))
+
+
+def _referrer_host_category(hostname: str) -> str:
+    if _SEARCH_ENGINE_RE.search(hostname):
+        return "Search Engine"
+    if _SOCIAL_MEDIA_RE.search(hostname):
+        return "Social Media"
+    return "Other"
+
+
 def parse_referrer_category(referrer_url: str) -> str:
     """
     Categorizes the referrer URL into 'Direct', 'Search Engine', 'Social Media', or 'Other'.
     """
     if not referrer_url:
         return "Direct"
-    
+
     try:
-        parsed = urlparse(referrer_url)
-        hostname = parsed.netloc.lower()
-        
-        # Common Search Engines
-        search_engines = [
-            "google.", "bing.", "yahoo.", "duckduckgo.", "baidu.", "yandex.", "ask.com", "aol.com", "ecosia.org"
-        ]
-        if any(se in hostname for se in search_engines):
-            return "Search Engine"
-            
-        # Common Social Media
-        social_media = [
-            "facebook.", "twitter.", "t.co", "instagram.", "linkedin.", "pinterest.", "reddit.", "tiktok.", "youtube.", "whatsapp."
-        ]
-        if any(sm in hostname for sm in social_media):
-            return "Social Media"
-            
-        return "Other"
+        return _referrer_host_category(urlparse(referrer_url).netloc.lower())
     except:
         return "Unknown"
+
+
+# ── Batch classification ──────────────────────────────────────────────────────
+# For replays, backfills and batch ingest: each distinct input is classified
+# once and results come back aligned with the input.
+
+def parse_user_agent_batch(ua_strings) -> list:
+    """parse_user_agent_info() for an iterable of User-Agent strings; returns one dict per input."""
+    ua_strings = list(ua_strings)   # iterated twice
+    unique = {ua: parse_user_agent_info(ua) for ua in dict.fromkeys(ua_strings)}
+    # Copies, so callers may modify one result without affecting its duplicates
+    return [dict(unique[ua]) for ua in ua_strings]
+
+
+def parse_referrer_batch(referrer_urls) -> list:
+    """parse_referrer_category() for an iterable of referrer URLs; returns one category per input."""
+    referrer_urls = list(referrer_urls)   # iterated twice
+    hosts: dict = {}
+    categories: dict = {}
+    for url in dict.fromkeys(referrer_urls):
+        if not url:
+            categories[url] = "Direct"
+            continue
+        try:
+            hostname = urlparse(url).netloc.lower()
+        except Exception:
+            categories[url] = "Unknown"
+            continue
+        if hostname not in hosts:
+            hosts[hostname] = _referrer_host_category(hostname)
+        categories[url] = hosts[hostname]
+    return [categories[url] for url in referrer_urls]
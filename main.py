@@ -1,39 +1,27 @@
 import os
-from fastapi import FastAPI, Request
+from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
-from starlette.middleware.base import BaseHTTPMiddleware
-from slowapi.errors import RateLimitExceeded
-from slowapi import _rate_limit_exceeded_handler
 from app.api import router
-from app.database import init_db, list_sites, get_db
-from app.limiter import limiter
-
-# ── Request body size limit ──────────────────────────────────────────────────
-MAX_REQUEST_BODY = 64 * 1024  # 64 KB
-
-class RequestSizeLimitMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        content_length = request.headers.get("content-length")
-        if content_length:
-            try:
-                if int(content_length) > MAX_REQUEST_BODY:
-                    return Response(content="Request body too large", status_code=413)
-            except ValueError:
-                pass
-        return await call_next(request)
+from app.async_storage import shutdown_executors
+from app.compression import CompressionMiddleware
+from app.counters import start_flusher, stop_flusher
+from app.database import list_sites, stop_checkpointers
+from app import journal
+from app.limiter import RateLimitMiddleware
+from app.maintenance import start_scheduler, stop_scheduler
+from app.middleware import RequestSizeLimitMiddleware, SelfTrackingFilterMiddleware
+from app.storage import get_storage
 
 # ── App setup ────────────────────────────────────────────────────────────────
 app = FastAPI(title="Privacy Visitor Tracker")
 
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
-
 # CORS — set ALLOWED_ORIGINS env var to a comma-separated list of your domains.
 # e.g. ALLOWED_ORIGINS="https://yourmediasite.com,https://www.yourmediasite.com"
 _raw_origins = os.getenv("ALLOWED_ORIGINS", "http://localhost:3000,http://localhost:8000,http://localhost:8011")
 ALLOWED_ORIGINS = [o.strip() for o in _raw_origins.split(",") if o.strip()]
 
+# Inside CORS, so 429 responses still carry the CORS headers
+app.add_middleware(RateLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=ALLOWED_ORIGINS,
@@ -41,49 +29,41 @@ app.add_middleware(
     allow_methods=["GET", "POST"],
     allow_headers=["Content-Type", "X-Timestamp", "X-Signature"],
 )
+app.add_middleware(CompressionMiddleware)
+# Outermost: cheap rejections before anything else runs
+app.add_middleware(SelfTrackingFilterMiddleware)
 app.add_middleware(RequestSizeLimitMiddleware)
 
 @app.on_event("startup")
 def on_startup():
     sites = list_sites() or ["default"]
+    store = get_storage()
     for site_id in sites:
-        init_db(site_id)
+        store.init_site(site_id)
         _retroactive_flag_high_path_bots(site_id)
     if "default" not in sites:
-        init_db("default")
+        store.init_site("default")
+    start_scheduler()
+    start_flusher(store.flush_counters)
+    journal.start_flusher(store.flush_counters)
+
+
+@app.on_event("shutdown")
+def on_shutdown():
+    stop_scheduler()
+    shutdown_executors()
+    stop_flusher(get_storage().flush_counters)
+    journal.stop_flusher()
+    get_storage().close()
+    stop_checkpointers()
 
 
 def _retroactive_flag_high_path_bots(site_id: str):
     """Flag any IPs in ip_path_counts with >50 distinct paths not yet marked as bots."""
-    conn = get_db(site_id)
-    cursor = conn.cursor()
     try:
-        cursor.execute("""
-            SELECT ipc.ip_hash, COUNT(ipc.path) AS path_count
-            FROM ip_path_counts ipc
-            JOIN visitor_activity va ON va.ip_hash = ipc.ip_hash
-            WHERE va.bot_type != 'bot'
-            GROUP BY ipc.ip_hash
-            HAVING path_count > 50
-        """)
-        rows = cursor.fetchall()
-        for row in rows:
-            ip_hash = row["ip_hash"]
-            cursor.execute(
-                "UPDATE visitor_activity SET bot_type = 'bot', ua_score = 1.0 WHERE ip_hash = ?",
-                (ip_hash,),
-            )
-            cursor.execute("SELECT id FROM bot_logs WHERE ip_hash = ? LIMIT 1", (ip_hash,))
-            if not cursor.fetchone():
-                cursor.execute(
-                    "INSERT INTO bot_logs (ip_hash, reason, bot_type, confidence) VALUES (?, ?, ?, ?)",
-                    (ip_hash, "Behavioral: High Unique Path Count (retroactive)", "bot", 1.0),
-                )
-        conn.commit()
+        get_storage().flag_high_path_bots(site_id, threshold=50)
     except Exception:
         pass
-    finally:
-        conn.close()
 
 @app.get("/")
 def read_root():